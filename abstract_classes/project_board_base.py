@@ -93,7 +93,8 @@ class ProjectBoardBase(ABC):
         [
           {
             "id" : "<board_id>",
-            "name" : "<board_name>"
+            "name" : "<board_name>",
+            "version" : <int>
           }
         ]
         """
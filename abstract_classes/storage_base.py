@@ -0,0 +1,103 @@
+# Abstract storage interface so managers don't depend on a particular backend
+
+from abc import ABC, abstractmethod
+from typing import Dict, Any, Iterator, List, Optional
+
+class StorageBase(ABC):
+    """
+    A collection of JSON records keyed by id.
+    Records returned by values() and find() are shared with the backend and must be treated as read-only,
+    get() and read() return private copies.
+    """
+
+    # whole collection as {id: record}
+    @abstractmethod
+    def read(self) -> Dict[str, Any]:
+        pass
+
+    # replace the whole collection
+    @abstractmethod
+    def write(self, data: Dict[str, Any]) -> None:
+        pass
+
+    # single record by id, None if missing
+    @abstractmethod
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        pass
+
+    # insert or replace a single record
+    @abstractmethod
+    def put(self, key: str, record: Dict[str, Any]) -> None:
+        pass
+
+    # insert or replace several records as one write: all of them are stored or none
+    @abstractmethod
+    def put_many(self, records: Dict[str, Dict[str, Any]]) -> None:
+        pass
+
+    # remove the records with these ids as one write, ids not stored are ignored
+    @abstractmethod
+    def delete_many(self, keys: List[str]) -> None:
+        pass
+
+    # optimistic update of existing records: each one is stored only if the stored record still has the
+    # "version" it carries (a missing field counts as 0), and is then stored with version + 1.
+    # The rest are left untouched and their keys returned, for the caller to re-read and retry
+    @abstractmethod
+    def compare_and_put(self, records: Dict[str, Dict[str, Any]]) -> List[str]:
+        pass
+
+    # all records, in insertion order
+    @abstractmethod
+    def values(self) -> List[Dict[str, Any]]:
+        pass
+
+    # up to `limit` records ordered by id, starting after id `after` (from the first when None)
+    @abstractmethod
+    def page(self, after: Optional[str], limit: int) -> List[Dict[str, Any]]:
+        pass
+
+    # records whose fields equal the given values, e.g. find(team_id=..., name=...)
+    # a list field matches when it contains the value, e.g. find(users=user_id)
+    @abstractmethod
+    def find(self, **fields: Any) -> List[Dict[str, Any]]:
+        pass
+
+    # up to `limit` of the records find(**fields) returns, ordered by id, starting after id `after`;
+    # served from the index in id order, so a page costs the same however many records match
+    @abstractmethod
+    def find_page(self, after: Optional[str], limit: int, **fields: Any) -> List[Dict[str, Any]]:
+        pass
+
+    # the records find_page() returns, from id `after` on and `batch` at a time, read as they are consumed:
+    # for callers that filter them further, e.g. by a range no index covers
+    def iter_find(self, after: Optional[str], batch: int, **fields: Any) -> Iterator[Dict[str, Any]]:
+        while True:
+            records = self.find_page(after, batch, **fields)
+            yield from records
+            if len(records) < batch:
+                return
+            after = records[-1]["id"]
+
+    # number of records find(**fields) would return
+    @abstractmethod
+    def count(self, **fields: Any) -> int:
+        pass
+
+    @abstractmethod
+    def __contains__(self, key: str) -> bool:
+        pass
+
+    # opaque token that changes with every change to the collection, compare for equality only
+    @abstractmethod
+    def version(self) -> str:
+        pass
+
+    # True when reads are currently answered from memory, without blocking I/O
+    def in_memory(self) -> bool:
+        return False
+
+    # flush pending writes and release files/connections
+    @abstractmethod
+    def close(self) -> None:
+        pass
@@ -0,0 +1,43 @@
+# Server-side response cache for the hot read endpoints: a hit is answered with the stored bytes,
+# without touching storage, building dicts or running the response model
+
+from typing import Any, Awaitable, Callable, Iterable, Mapping, Type, Union
+
+from fastapi import Request, Response
+from pydantic import BaseModel
+
+from abstract_classes.storage_base import StorageBase
+from utils.concurrency import AsyncDispatcher
+from utils.response_cache import CachedResponse, ResponseCache
+
+Tags = Union[Iterable[str], Callable[[Any], Iterable[str]]]
+
+
+async def cached_json(request: Request, response: Response, io: AsyncDispatcher, cache: ResponseCache,
+                      stores: Mapping[str, StorageBase], model: Type[BaseModel],
+                      produce: Callable[[], Awaitable[Any]], tags: Tags = (), params: str = "") -> Response:
+    """
+    Returns the cached response for this route, query and `params`, or awaits `produce()` and caches its result
+    encoded through the route's response `model`.
+    `stores` are the collections the endpoint reads by name, `tags` the records it depends on,
+    or a function of the result for dependencies only known once it is built (e.g. the members of a team).
+    """
+    # a version is a stat while the collection is cached, a reload or a query otherwise: see make_etag()
+    for name, store in stores.items():
+        cache.sync(name, await io.read(store.version))
+    key = "\n".join([request.url.path, request.url.query, params])
+
+    cached = cache.get(key)
+    if cached is None:
+        token = cache.token()
+        result = await produce()
+        headers = {k: v for k, v in response.headers.items() if k.lower() not in ("etag", "content-length")}
+        cached = CachedResponse(model.model_validate(result).model_dump_json().encode(), headers)
+        if callable(tags):
+            tags = tags(result)
+        cache.put(key, cached, [*stores, *tags], token)
+
+    # the ETag is computed per request and already on `response`
+    headers = {k: v for k, v in response.headers.items() if k.lower() != "content-length"}
+    headers.update(cached.headers)
+    return Response(cached.body, media_type="application/json", headers=headers)
@@ -0,0 +1,41 @@
+# Conditional GETs: ETags built from collection versions, so an unchanged poll is answered with a 304
+# without reading or serializing any records
+
+import hashlib
+from typing import Optional, Sequence
+
+from fastapi import Request, Response
+
+from abstract_classes.storage_base import StorageBase
+from utils.concurrency import AsyncDispatcher
+
+
+async def make_etag(request: Request, io: AsyncDispatcher, stores: Sequence[StorageBase], params: str = "") -> str:
+    # the same versions mean the same answer only for the same route, query, body and representation.
+    # A version is a stat while the collection is cached, but a reload or a query otherwise: those go to `io`
+    versions = [await io.read(store.version) for store in stores]
+    key = "\n".join([
+        request.url.path, request.url.query, params, request.headers.get("accept", ""), *versions,
+    ])
+    return '"' + hashlib.blake2b(key.encode(), digest_size=12).hexdigest() + '"'
+
+
+def _matches(if_none_match: str, etag: str) -> bool:
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    # weak comparison, as RFC 9110 asks for If-None-Match
+    return "*" in tags or etag in tags or f"W/{etag}" in tags
+
+
+async def check_etag(request: Request, response: Response, io: AsyncDispatcher, stores: Sequence[StorageBase],
+                     params: str = "") -> Optional[Response]:
+    """
+    Returns a 304 response when the client's If-None-Match still matches,
+    otherwise sets the ETag on `response` and returns None so the handler carries on.
+    `stores` are the collections the endpoint reads, `params` anything in the body that selects the data.
+    """
+    etag = await make_etag(request, io, stores, params)
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None and _matches(if_none_match, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+    return None
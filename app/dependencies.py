@@ -1,17 +1,68 @@
+from contextlib import asynccontextmanager
+from typing import Any, Dict, List, Optional
+
+from fastapi import FastAPI, Query, Request, Response
+
 from impl.user_manager import UserManager
 from impl.team_manager import TeamManager
 from impl.board_manager import BoardManager
+from utils.concurrency import AsyncDispatcher
+from utils.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from utils.response_cache import ResponseCache
+
+# Managers (and the storage behind them) are built once in the app lifespan and shared by every request,
+# so their caches and indexes survive between requests.
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # one response cache, so a write through any manager invalidates what the others cached
+    app.state.response_cache = ResponseCache()
+    app.state.user_manager = UserManager(cache=app.state.response_cache)
+    app.state.team_manager = TeamManager(cache=app.state.response_cache)
+    app.state.board_manager = BoardManager(cache=app.state.response_cache)
+    # async handlers run blocking storage calls here instead of the server's threadpool
+    app.state.io = AsyncDispatcher()
+    yield
+    # let in-flight storage calls finish, then flush pending writes before the process exits
+    app.state.io.shutdown()
+    for manager in [app.state.board_manager, app.state.team_manager, app.state.user_manager]:
+        manager.close()
 
 # Dependency providers
 """
-Provides a new instance of Manager.
+Provides the shared instance of Manager.
 Later, if you want to switch to a DB instead of JSON, you just update here without touching routers.
+Providers are async so FastAPI resolves them on the event loop instead of the threadpool.
 """
-def get_user_manager() -> UserManager:
-    return UserManager()
+async def get_user_manager(request: Request) -> UserManager:
+    return request.app.state.user_manager
+
+async def get_team_manager(request: Request) -> TeamManager:
+    return request.app.state.team_manager
+
+async def get_board_manager(request: Request) -> BoardManager:
+    return request.app.state.board_manager
+
+async def get_io(request: Request) -> AsyncDispatcher:
+    return request.app.state.io
+
+
+# Pagination query parameters for the list endpoints
+class PageParams:
+    def __init__(self, cursor: Optional[str], limit: Optional[int]):
+        self.cursor = cursor
+        self.limit = limit or DEFAULT_PAGE_SIZE
+        # without either parameter the endpoint returns the whole collection, as before
+        self.requested = cursor is not None or limit is not None
+
+    # the body stays a plain list, the cursor of the next page goes in a header
+    def items(self, response: Response, page: Dict[str, Any]) -> List[Dict[str, Any]]:
+        if page["next_cursor"] is not None:
+            response.headers["X-Next-Cursor"] = page["next_cursor"]
+        return page["items"]
 
-def get_team_manager() -> TeamManager:
-    return TeamManager()
 
-def get_board_manager() -> BoardManager:
-    return BoardManager()
+async def get_page(
+    cursor: Optional[str] = Query(default=None, description="next_cursor from the previous page"),
+    limit: Optional[int] = Query(default=None, ge=1, le=MAX_PAGE_SIZE),
+) -> PageParams:
+    return PageParams(cursor, limit)
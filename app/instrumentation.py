@@ -0,0 +1,211 @@
+# Request instrumentation: the metrics and profiling middlewares and the route class that times the handlers
+
+import asyncio
+import functools
+from time import perf_counter
+from typing import Any, AsyncIterable, AsyncIterator, Awaitable, Callable
+
+from fastapi import Request, Response
+from fastapi.responses import StreamingResponse
+from fastapi.routing import APIRoute
+from starlette._exception_handler import wrap_app_handling_exceptions
+from starlette.routing import Route
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from utils.metrics import (
+    ERROR_KEY, METRICS_ENABLED, Metrics, PHASES_KEY, RESPONSE_KEY, ROUTE, SERVER_TIMING, STREAMED_KEY, UNMATCHED,
+    current_timer, note_error, start_timer, stop_timer
+)
+from utils.profiling import Profiler
+
+class ProfilingMiddleware:
+    """
+    Runs the requests `profiler` picks under cProfile, from routing to the end of the response, and has it
+    dump the stats once the route and the duration are known. Storage calls the request makes in the
+    executor threads are profiled there by utils.profiling.profiled().
+    """
+    def __init__(self, app: Any, profiler: Profiler) -> None:
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope: Any, receive: Any, send: Any) -> None:
+        if scope["type"] == "http" and self.profiler.wanted(scope["headers"]):
+            await self.profile(scope, receive, send)
+        else:
+            await self.app(scope, receive, send)
+
+    async def profile(self, scope: Any, receive: Any, send: Any) -> None:
+        # the request under cProfile, or as it is if another request holds the profiler
+        started = self.profiler.start()
+        if started is None:
+            await self.app(scope, receive, send)
+            return
+
+        start = perf_counter()
+        status = 0
+
+        async def send_status(message: Any) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_status)
+        finally:
+            route = scope.get("route")
+            self.profiler.finish(*started, scope["method"], route.path if route is not None else UNMATCHED,
+                                 status or 500, perf_counter() - start)
+
+
+class MetricsMiddleware(ProfilingMiddleware):
+    """
+    Plain ASGI middleware: times each request and records it in `metrics` once the response is sent.
+    The routes (TimedRoute, and FastAPI's own ones after note_routes()) and the exception handlers leave the
+    Response in the scope (see note_error()), which gives the status and the size without watching the messages
+    go by. Only with `server_timing` is send() wrapped, to split the request into phases and add the
+    Server-Timing header.
+    It runs the profiler's requests itself rather than in a ProfilingMiddleware of its own, inside the timing
+    so the metrics show what profiling costs a request: every layer costs each request a coroutine.
+    Unhandled exceptions are answered here with the app's catch-all handler, so their 500s are timed and
+    counted like any other response; Starlette's ServerErrorMiddleware then only re-raises them for the log.
+    """
+    def __init__(self, app: Any, metrics: Metrics, profiler: Profiler,
+                 error_handler: Callable[[Request, Exception], Awaitable[Response]],
+                 server_timing: bool = SERVER_TIMING) -> None:
+        super().__init__(app, profiler)
+        self.metrics = metrics
+        self.error_handler = error_handler
+        self.server_timing = server_timing
+
+    async def __call__(self, scope: Any, receive: Any, send: Any) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        if self.server_timing:
+            await self._call_watched(scope, receive, send)
+            return
+
+        start = perf_counter()
+        try:
+            if self.profiler.wanted(scope["headers"]):
+                await self.profile(scope, receive, send)
+            else:
+                await self.app(scope, receive, send)
+        except Exception as exc:
+            # every response is noted before it is sent: none noted, none sent
+            if RESPONSE_KEY not in scope:
+                response = await self.error_handler(Request(scope), exc)
+                await note_error(scope, exc, response)(scope, receive, send)
+            else:
+                scope[ERROR_KEY] = type(exc).__name__
+            raise
+        finally:
+            self.metrics.record(scope, perf_counter() - start)
+
+    async def _call_watched(self, scope: Any, receive: Any, send: Any) -> None:
+        # the request split into phases, with the Server-Timing header added to its response
+        start = perf_counter()
+        timer, token = start_timer()
+
+        # hands back send()'s awaitable instead of awaiting it, one coroutine less per message; no return
+        # annotation, a nested function's annotations are evaluated on every request and Awaitable[None] isn't free
+        def send_timed(message: Any):
+            if message["type"] == "http.response.start":
+                message["headers"] = [
+                    *message.get("headers", ()), (b"server-timing", timer.server_timing(perf_counter() - start))
+                ]
+            return send(message)
+
+        try:
+            if self.profiler.wanted(scope["headers"]):
+                await self.profile(scope, receive, send_timed)
+            else:
+                await self.app(scope, receive, send_timed)
+        except Exception as exc:
+            if RESPONSE_KEY not in scope:
+                response = await self.error_handler(Request(scope), exc)
+                await note_error(scope, exc, response)(scope, receive, send_timed)
+            else:
+                scope[ERROR_KEY] = type(exc).__name__
+            raise
+        finally:
+            seconds = perf_counter() - start
+            stop_timer(token)
+            scope[PHASES_KEY] = timer.close(seconds)
+            self.metrics.record(scope, seconds)
+
+
+async def _counted(scope: Any, chunks: AsyncIterable[Any]) -> AsyncIterator[Any]:
+    # a streamed body, its size added up in the scope as it is sent
+    scope[STREAMED_KEY] = 0
+    async for chunk in chunks:
+        scope[STREAMED_KEY] += len(chunk)
+        yield chunk
+
+
+def _timed_endpoint(endpoint: Callable[..., Any]) -> Callable[..., Any]:
+    # wraps() keeps the signature FastAPI reads the parameters from; sync handlers run in the threadpool as they are.
+    # include_router() builds the app's routes from the routers' ones, whose endpoints are already wrapped
+    if not asyncio.iscoroutinefunction(endpoint) or getattr(endpoint, "timed_route", False):
+        return endpoint
+
+    @functools.wraps(endpoint)
+    async def wrapper(*args: Any, **kwargs: Any) -> Any:
+        timer = current_timer()
+        if timer is None:
+            return await endpoint(*args, **kwargs)
+        timer.enter(ROUTE)
+        try:
+            return await endpoint(*args, **kwargs)
+        finally:
+            timer.exit()
+    wrapper.timed_route = True  # type: ignore[attr-defined]
+    return wrapper
+
+
+class TimedRoute(APIRoute):
+    """
+    Route class of the routers. Its handler leaves the response in the scope for the metrics middleware.
+    With FACTWISE_SERVER_TIMING on, the handler's own code is the "route" phase, and manager and storage calls
+    made from it are charged to their own phases. What FastAPI does around the handler (body parsing, request
+    and response model validation, encoding) isn't wrapped, it is the "validation" time the others leave over.
+    """
+    def __init__(self, path: str, endpoint: Callable[..., Any], **kwargs: Any) -> None:
+        super().__init__(path, _timed_endpoint(endpoint) if SERVER_TIMING else endpoint, **kwargs)
+        if METRICS_ENABLED:
+            self.app = _noted_request_response(self.get_route_handler())
+
+
+def note_routes(app: Any) -> None:
+    # FastAPI's own routes (/docs, /openapi.json) are plain Starlette ones, rebuilt to note their responses too;
+    # Starlette doesn't put those in the scope, so they are labelled by hand
+    for route in app.routes:
+        if isinstance(route, Route) and not isinstance(route, APIRoute) and asyncio.iscoroutinefunction(route.endpoint):
+            route.app = _labelled(route, _noted_request_response(route.endpoint))
+
+
+def _labelled(route: Route, app: ASGIApp) -> ASGIApp:
+    async def labelled(scope: Scope, receive: Receive, send: Send) -> None:
+        scope["route"] = route
+        await app(scope, receive, send)
+    return labelled
+
+
+def _noted_request_response(handler: Callable[[Request], Awaitable[Response]]) -> ASGIApp:
+    # starlette.routing.request_response() for an async handler, leaving the response in the scope for the metrics
+    # middleware before sending it; wrapping the handler instead would cost every request a coroutine.
+    # The inner app has no annotations, they would be evaluated on every request
+    async def app(scope: Scope, receive: Receive, send: Send) -> None:
+        request = Request(scope, receive, send)
+
+        async def app(scope, receive, send):  # type: ignore[no-untyped-def]
+            response = await handler(request)
+            if isinstance(response, StreamingResponse):
+                response.body_iterator = _counted(scope, response.body_iterator)
+            scope[RESPONSE_KEY] = response
+            await response(scope, receive, send)
+
+        await wrap_app_handling_exceptions(app, request)(scope, receive, send)
+
+    return app
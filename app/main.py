@@ -3,43 +3,73 @@ from fastapi.responses import JSONResponse
 from fastapi.exceptions import RequestValidationError
 from starlette.exceptions import HTTPException as StarletteHTTPException
 
-from app.routers import users, teams, boards
+from app.dependencies import lifespan
+from app.instrumentation import MetricsMiddleware, ProfilingMiddleware, note_routes
+from utils.concurrency import VersionConflict
+from utils.metrics import Metrics, METRICS_ENABLED, note_error
+from utils.profiling import Profiler
+from app.routers import users, teams, boards, admin, metrics
 
-app = FastAPI(title="Project Board API")
+app = FastAPI(title="Project Board API", lifespan=lifespan)
+# per-route request metrics, served at /metrics
+app.state.metrics = Metrics()
+# on-demand cProfile of requests, see /api/v1/admin/profiling
+app.state.profiler = Profiler()
 
 # Handle request validation errors (Pydantic + JSON parsing issues)
 @app.exception_handler(RequestValidationError)
 async def validation_exception_handler(request: Request, exc: RequestValidationError):
-    return JSONResponse(
+    return note_error(request.scope, exc, JSONResponse(
         status_code=422,
         content={
             "error": "Invalid request",
             "details": exc.errors(),  # you can trim this if too verbose
         },
-    )
+    ))
 
 # Handle generic HTTP exceptions
 @app.exception_handler(StarletteHTTPException)
 async def http_exception_handler(request: Request, exc: StarletteHTTPException):
-    return JSONResponse(
+    return note_error(request.scope, exc, JSONResponse(
         status_code=exc.status_code,
         content={
             "error": "HTTP Error",
             "message": exc.detail,
         },
-    )
+    ))
+
+# Optimistic concurrency: the record is not at the version the client sent, or kept changing under the update
+@app.exception_handler(VersionConflict)
+async def version_conflict_handler(request: Request, exc: VersionConflict):
+    return note_error(request.scope, exc, JSONResponse(
+        status_code=409,
+        content={
+            "error": "Conflict",
+            "message": str(exc),
+        },
+    ))
 
 # Catch-all for any unhandled exceptions
 @app.exception_handler(Exception)
 async def generic_exception_handler(request: Request, exc: Exception):
-    return JSONResponse(
+    return note_error(request.scope, exc, JSONResponse(
         status_code=500,
         content={
             "error": "Internal Server Error",
             "message": str(exc),  # ⚠️ careful, maybe hide this in prod
         },
-    )
+    ))
 
 app.include_router(users.router)
 app.include_router(teams.router)
 app.include_router(boards.router)
+app.include_router(admin.router)
+app.include_router(metrics.router)
+
+# the metrics middleware runs the profiler too, see MetricsMiddleware
+if METRICS_ENABLED:
+    note_routes(app)
+    app.add_middleware(MetricsMiddleware, metrics=app.state.metrics, profiler=app.state.profiler,
+                       error_handler=generic_exception_handler)
+else:
+    app.add_middleware(ProfilingMiddleware, profiler=app.state.profiler)
@@ -0,0 +1,30 @@
+# Streaming responses for the list endpoints
+
+import json
+from typing import Any, Dict, Iterable, Iterator, Mapping, Optional
+
+from fastapi import Request
+from fastapi.responses import StreamingResponse
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+
+def wants_ndjson(request: Request) -> bool:
+    return NDJSON_MEDIA_TYPE in request.headers.get("accept", "")
+
+
+def _lines(items: Iterable[Dict[str, Any]]) -> Iterator[bytes]:
+    for item in items:
+        yield json.dumps(item).encode() + b"\n"
+
+
+def ndjson_response(items: Iterable[Dict[str, Any]], headers: Optional[Mapping[str, str]] = None) -> StreamingResponse:
+    # one JSON document per line, encoded as the items are pulled from storage
+    # headers already set on the handler's Response (e.g. ETag) have to be carried over by hand
+    return StreamingResponse(_lines(items), media_type=NDJSON_MEDIA_TYPE, headers=_own_headers(headers))
+
+
+def _own_headers(headers: Optional[Mapping[str, str]]) -> Optional[Dict[str, str]]:
+    if headers is None:
+        return None
+    return {k: v for k, v in headers.items() if k.lower() not in ("content-length", "content-type")}
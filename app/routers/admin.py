@@ -0,0 +1,51 @@
+from typing import Literal
+
+from fastapi import APIRouter, Depends, Query, Request
+
+from app.dependencies import get_io
+from app.instrumentation import TimedRoute
+from app.schemas import admin_schemas as model
+from utils import file_db
+from utils.concurrency import AsyncDispatcher
+
+router = APIRouter(prefix="/api/v1/admin", tags=["Admin"], route_class=TimedRoute)
+
+@router.get("/response_cache")
+async def response_cache_stats(request: Request):
+    return request.app.state.response_cache.stats()
+
+# shared/exclusive acquisitions of each JSON file's cross-process lock and the time spent waiting for them
+@router.get("/storage_locks")
+async def storage_lock_stats():
+    return file_db.lock_info()
+
+# per JSON file: parses and writes with their bytes and json.load/json.dump time, cache hits, current size
+@router.get("/storage_files")
+async def storage_file_stats():
+    return file_db.io_info()
+
+@router.get("/profiling", response_model=model.ProfilingResponse)
+async def profiling_settings(request: Request):
+    return request.app.state.profiler.settings()
+
+# turn sampled profiling on or off (or the X-Profile header) without a restart
+@router.post("/profiling", response_model=model.ProfilingResponse)
+async def update_profiling(req: model.ProfilingRequest, request: Request):
+    profiler = request.app.state.profiler
+    if req.sample_rate is not None:
+        profiler.sample_rate = req.sample_rate
+    if req.header is not None:
+        profiler.header = req.header
+    return profiler.settings()
+
+# the most expensive functions of the latest profiles, newest first
+@router.get("/profiles")
+async def recent_profiles(
+    request: Request,
+    limit: int = Query(default=10, ge=1, le=100, description="profiles to summarise"),
+    functions: int = Query(default=20, ge=1, le=200, description="functions per profile"),
+    sort: Literal["cumulative", "tottime", "calls"] = "cumulative",
+    io: AsyncDispatcher = Depends(get_io),
+):
+    profiler = request.app.state.profiler
+    return {"profiles": await io.write(profiler.top, limit, functions, sort), **profiler.settings()}
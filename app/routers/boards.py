@@ -1,43 +1,100 @@
-import json
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Request, Response
 
-from app.dependencies import get_board_manager
+from app.cached import cached_json
+from app.conditional import check_etag
+from app.dependencies import get_board_manager, get_io, get_page, PageParams
+from app.instrumentation import TimedRoute
+from app.responses import ndjson_response, wants_ndjson
 from app.schemas import board_schemas as model
 from impl.board_manager import BoardManager
+from utils.concurrency import AsyncDispatcher
 
-router = APIRouter(prefix="/api/v1/board", tags=["Project Board"])
+router = APIRouter(prefix="/api/v1/board", tags=["Project Board"], route_class=TimedRoute)
 
 @router.post("/create", response_model=model.CreateBoardResponse)
-def create_board(req: model.CreateBoardRequest, manager: BoardManager = Depends(get_board_manager)):
-    res_json = manager.create_board(req.model_dump_json())
-    return json.loads(res_json)
+async def create_board(req: model.CreateBoardRequest, manager: BoardManager = Depends(get_board_manager),
+                       io: AsyncDispatcher = Depends(get_io)):
+    return await io.write(manager.create_board_dict, req.model_dump(mode="json"))
 
 @router.get("/")
-def list_all_boards(manager: BoardManager = Depends(get_board_manager)):
-    res_json = manager.list_all_boards()
-    return json.loads(res_json)
+async def list_all_boards(request: Request, response: Response, page: PageParams = Depends(get_page),
+                          manager: BoardManager = Depends(get_board_manager), io: AsyncDispatcher = Depends(get_io)):
+    not_modified = await check_etag(request, response, io, [manager.board_db])
+    if not_modified:
+        return not_modified
+    if wants_ndjson(request):
+        return ndjson_response(manager.iter_all_boards(), response.headers)
+    if not page.requested:
+        return await io.read(manager.list_all_boards_dict)
+    return page.items(response, await io.read(manager.list_all_boards_page, page.cursor, page.limit))
 
 @router.post("/close")
-def close_board(req: model.CloseBoardRequest, manager: BoardManager = Depends(get_board_manager)):
-    res_json = manager.close_board(req.model_dump_json())
-    return json.loads(res_json)
+async def close_board(req: model.CloseBoardRequest, manager: BoardManager = Depends(get_board_manager),
+                      io: AsyncDispatcher = Depends(get_io)):
+    return await io.write(manager.close_board_dict, req.model_dump(mode="json"))
 
 @router.post("/add_task", response_model=model.AddTaskResponse)
-def add_task(req: model.AddTaskRequest, manager: BoardManager = Depends(get_board_manager)):
-    res_json = manager.add_task(req.model_dump_json())
-    return json.loads(res_json)
+async def add_task(req: model.AddTaskRequest, manager: BoardManager = Depends(get_board_manager),
+                   io: AsyncDispatcher = Depends(get_io)):
+    return await io.write(manager.add_task_dict, req.model_dump(mode="json"))
+
+@router.post("/add_tasks", response_model=model.AddTasksResponse)
+async def add_tasks(req: model.AddTasksRequest, manager: BoardManager = Depends(get_board_manager),
+                    io: AsyncDispatcher = Depends(get_io)):
+    return await io.write(manager.add_tasks_dict, req.model_dump(mode="json"))
 
 @router.post("/update_task_status")
-def update_task_status(req: model.UpdateTaskStatusRequest, manager: BoardManager = Depends(get_board_manager)):
-    res_json = manager.update_task_status(req.model_dump_json())
-    return json.loads(res_json)
+async def update_task_status(req: model.UpdateTaskStatusRequest, manager: BoardManager = Depends(get_board_manager),
+                             io: AsyncDispatcher = Depends(get_io)):
+    return await io.write(manager.update_task_status_dict, req.model_dump(mode="json"))
+
+@router.post("/update_task_statuses", response_model=model.UpdateTaskStatusesResponse)
+async def update_task_statuses(req: model.UpdateTaskStatusesRequest, manager: BoardManager = Depends(get_board_manager),
+                               io: AsyncDispatcher = Depends(get_io)):
+    return await io.write(manager.update_task_statuses_dict, req.model_dump(mode="json"))
 
 @router.get("/team_boards", response_model=model.ListBoardsResponse)
-def list_boards(req: model.ListBoardsRequest, manager: BoardManager = Depends(get_board_manager)):
-    res_json = manager.list_boards(req.model_dump_json())
-    return json.loads(res_json)
-
-@router.get("/export", response_model=model.ExportBoardResponse)
-def export_board(req: model.ExportBoardRequest, manager: BoardManager = Depends(get_board_manager)):
-    res_json = manager.export_board(req.model_dump_json())
-    return json.loads(res_json)
+async def list_boards(req: model.ListBoardsRequest, request: Request, response: Response,
+                      manager: BoardManager = Depends(get_board_manager), io: AsyncDispatcher = Depends(get_io)):
+    not_modified = await check_etag(request, response, io, [manager.board_db], req.model_dump_json())
+    if not_modified:
+        return not_modified
+    return await cached_json(
+        request, response, io, manager.cache, {"boards": manager.board_db}, model.ListBoardsResponse,
+        lambda: io.read(manager.list_boards_dict, req.model_dump(mode="json")), [f"team_boards:{req.id}"],
+        req.model_dump_json()
+    )
+
+# tasks filtered by board, assignee, status and creation time, answered from the task indexes
+@router.get("/tasks", response_model=model.ListTasksResponse)
+async def list_tasks(req: model.ListTasksRequest, request: Request, response: Response,
+                     page: PageParams = Depends(get_page),
+                     manager: BoardManager = Depends(get_board_manager), io: AsyncDispatcher = Depends(get_io)):
+    not_modified = await check_etag(request, response, io, [manager.task_db], req.model_dump_json())
+    if not_modified:
+        return not_modified
+    if not page.requested:
+        return await io.read(manager.list_tasks_dict, req.model_dump(mode="json"))
+    return page.items(response, await io.read(
+        manager.list_tasks_page, req.model_dump(mode="json"), page.cursor, page.limit
+    ))
+
+# task and board counters for dashboards, read off the storage indexes instead of the records
+@router.get("/stats", response_model=model.StatsResponse)
+async def board_stats(req: model.StatsRequest, request: Request, response: Response,
+                      manager: BoardManager = Depends(get_board_manager), io: AsyncDispatcher = Depends(get_io)):
+    not_modified = await check_etag(request, response, io, [manager.board_db, manager.task_db], req.model_dump_json())
+    if not_modified:
+        return not_modified
+    return await io.read(manager.stats_dict, req.model_dump(mode="json"))
+
+# exports run on the manager's worker pool; poll /export/status for progress and the output path
+@router.get("/export", response_model=model.ExportJobResponse)
+async def export_board(req: model.ExportBoardRequest, manager: BoardManager = Depends(get_board_manager),
+                       io: AsyncDispatcher = Depends(get_io)):
+    return await io.write(manager.start_export_dict, req.model_dump(mode="json"))
+
+@router.get("/export/status", response_model=model.ExportJobResponse)
+async def export_status(req: model.ExportStatusRequest, manager: BoardManager = Depends(get_board_manager)):
+    # job status lives in memory
+    return manager.export_status_dict(req.model_dump(mode="json"))
@@ -0,0 +1,14 @@
+from fastapi import APIRouter, Request
+from fastapi.responses import PlainTextResponse
+
+from app.instrumentation import TimedRoute
+from utils import file_db
+from utils.metrics import render_files
+
+router = APIRouter(tags=["Metrics"], route_class=TimedRoute)
+
+# request counters and histograms, then the JSON files' parse/write counters, in the Prometheus text exposition format
+@router.get("/metrics", response_class=PlainTextResponse)
+async def metrics(request: Request):
+    text = request.app.state.metrics.render() + render_files(file_db.io_info())
+    return PlainTextResponse(text, media_type="text/plain; version=0.0.4")
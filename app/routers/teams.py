@@ -1,43 +1,75 @@
-import json
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Request, Response
 
-from app.dependencies import get_team_manager
+from app.cached import cached_json
+from app.conditional import check_etag
+from app.dependencies import get_team_manager, get_io, get_page, PageParams
+from app.instrumentation import TimedRoute
 from app.schemas import team_schemas as model
 from impl.team_manager import TeamManager
+from utils.concurrency import AsyncDispatcher
 
-router = APIRouter(prefix="/api/v1/teams", tags=["Teams"])
+router = APIRouter(prefix="/api/v1/teams", tags=["Teams"], route_class=TimedRoute)
 
 @router.post("/create", response_model=model.CreateTeamResponse)
-def create_team(req: model.CreateTeamRequest, manager: TeamManager = Depends(get_team_manager)):
-    res_json = manager.create_team(req.model_dump_json())
-    return json.loads(res_json)
+async def create_team(req: model.CreateTeamRequest, manager: TeamManager = Depends(get_team_manager),
+                      io: AsyncDispatcher = Depends(get_io)):
+    return await io.write(manager.create_team_dict, req.model_dump(mode="json"))
 
 @router.get("/", response_model=model.ListTeamsResponse)
-def list_teams(manager: TeamManager = Depends(get_team_manager)):
-    res_json = manager.list_teams()
-    return json.loads(res_json)
+async def list_teams(request: Request, response: Response, page: PageParams = Depends(get_page),
+                     manager: TeamManager = Depends(get_team_manager), io: AsyncDispatcher = Depends(get_io)):
+    not_modified = await check_etag(request, response, io, [manager.team_db])
+    if not_modified:
+        return not_modified
+    async def produce():
+        if not page.requested:
+            return await io.read(manager.list_teams_dict)
+        return page.items(response, await io.read(manager.list_teams_page, page.cursor, page.limit))
+    return await cached_json(request, response, io, manager.cache, {"teams": manager.team_db},
+                             model.ListTeamsResponse, produce, ["team_list"])
 
 @router.get("/describe", response_model=model.DescribeTeamResponse)
-def describe_team(req: model.DescribeTeamRequest, manager: TeamManager = Depends(get_team_manager)):
-    res_json = manager.describe_team(req.model_dump_json())
-    return json.loads(res_json)
+async def describe_team(req: model.DescribeTeamRequest, request: Request, response: Response,
+                        manager: TeamManager = Depends(get_team_manager), io: AsyncDispatcher = Depends(get_io)):
+    not_modified = await check_etag(request, response, io, [manager.team_db], req.model_dump_json())
+    if not_modified:
+        return not_modified
+    return await cached_json(
+        request, response, io, manager.cache, {"teams": manager.team_db}, model.DescribeTeamResponse,
+        lambda: io.read(manager.describe_team_dict, req.model_dump(mode="json")), [f"team:{req.id}"], req.model_dump_json()
+    )
 
 @router.post("/update", response_model=model.UpdateTeamResponse)
-def update_team(req: model.UpdateTeamRequest, manager: TeamManager = Depends(get_team_manager)):
-    res_json = manager.update_team(req.model_dump_json())
-    return json.loads(res_json)
+async def update_team(req: model.UpdateTeamRequest, manager: TeamManager = Depends(get_team_manager),
+                      io: AsyncDispatcher = Depends(get_io)):
+    return await io.write(manager.update_team_dict, req.model_dump(mode="json"))
 
 @router.post("/add_to_team")
-def add_users_to_team(req: model.AddUsersToTeamRequest, manager: TeamManager = Depends(get_team_manager)):
-    res_json = manager.add_users_to_team(req.model_dump_json())
-    return json.loads(res_json)
+async def add_users_to_team(req: model.AddUsersToTeamRequest, manager: TeamManager = Depends(get_team_manager),
+                            io: AsyncDispatcher = Depends(get_io)):
+    return await io.write(manager.add_users_to_team_dict, req.model_dump(mode="json"))
 
 @router.post("/remove_from_team")
-def remove_users_from_team(req: model.RemoveUsersFromTeamRequest, manager: TeamManager = Depends(get_team_manager)):
-    res_json = manager.remove_users_from_team(req.model_dump_json())
-    return json.loads(res_json)
+async def remove_users_from_team(req: model.RemoveUsersFromTeamRequest, manager: TeamManager = Depends(get_team_manager),
+                                 io: AsyncDispatcher = Depends(get_io)):
+    return await io.write(manager.remove_users_from_team_dict, req.model_dump(mode="json"))
 
 @router.get("/members", response_model=model.ListTeamUsersResponse)
-def list_team_users(req: model.ListTeamUsersRequest, manager: TeamManager = Depends(get_team_manager)):
-    res_json = manager.list_team_users(req.model_dump_json())
-    return json.loads(res_json)
+async def list_team_users(req: model.ListTeamUsersRequest, request: Request, response: Response,
+                          page: PageParams = Depends(get_page),
+                          manager: TeamManager = Depends(get_team_manager), io: AsyncDispatcher = Depends(get_io)):
+    not_modified = await check_etag(request, response, io, [manager.team_db, manager.user_db], req.model_dump_json())
+    if not_modified:
+        return not_modified
+    async def produce():
+        if not page.requested:
+            return await io.read(manager.list_team_users_dict, req.model_dump(mode="json"))
+        return page.items(response, await io.read(
+            manager.list_team_users_page, req.model_dump(mode="json"), page.cursor, page.limit
+        ))
+    # display names come from the user records
+    return await cached_json(
+        request, response, io, manager.cache, {"teams": manager.team_db, "users": manager.user_db},
+        model.ListTeamUsersResponse, produce,
+        lambda members: [f"team_users:{req.id}", *(f"user:{user['id']}" for user in members)], req.model_dump_json()
+    )
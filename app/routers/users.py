@@ -1,33 +1,60 @@
-import json
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Request, Response
 
-from app.dependencies import get_user_manager
+from app.cached import cached_json
+from app.conditional import check_etag
+from app.dependencies import get_user_manager, get_io, get_page, PageParams
+from app.instrumentation import TimedRoute
+from app.responses import ndjson_response, wants_ndjson
 from app.schemas import user_schemas as model
 from impl.user_manager import UserManager
+from utils.concurrency import AsyncDispatcher
 
-router = APIRouter(prefix="/api/v1/users", tags=["Users"])
+router = APIRouter(prefix="/api/v1/users", tags=["Users"], route_class=TimedRoute)
 
 @router.post("/create", response_model=model.CreateUserResponse)
-def create_user(req: model.CreateUserRequest, manager: UserManager = Depends(get_user_manager)):
-    response_json = manager.create_user(req.model_dump_json())
-    return json.loads(response_json)
+async def create_user(req: model.CreateUserRequest, manager: UserManager = Depends(get_user_manager),
+                      io: AsyncDispatcher = Depends(get_io)):
+    return await io.write(manager.create_user_dict, req.model_dump(mode="json"))
+
+@router.post("/create_users", response_model=model.CreateUsersResponse)
+async def create_users(req: model.CreateUsersRequest, manager: UserManager = Depends(get_user_manager),
+                       io: AsyncDispatcher = Depends(get_io)):
+    return await io.write(manager.create_users_dict, req.model_dump(mode="json"))
 
 @router.get("/", response_model=model.ListUsersResponse)
-def list_users(manager: UserManager = Depends(get_user_manager)):
-    response_json = manager.list_users()
-    return json.loads(response_json)
+async def list_users(request: Request, response: Response, page: PageParams = Depends(get_page),
+                     manager: UserManager = Depends(get_user_manager), io: AsyncDispatcher = Depends(get_io)):
+    not_modified = await check_etag(request, response, io, [manager.db])
+    if not_modified:
+        return not_modified
+    if wants_ndjson(request):
+        return ndjson_response(manager.iter_users(), response.headers)
+    if not page.requested:
+        return await io.read(manager.list_users_dict)
+    return page.items(response, await io.read(manager.list_users_page, page.cursor, page.limit))
 
 @router.get("/describe", response_model=model.DescribeUserResponse)
-def describe_user(req: model.DescribeUserRequest, manager: UserManager = Depends(get_user_manager)):
-    response_json = manager.describe_user(req.model_dump_json())
-    return json.loads(response_json)
+async def describe_user(req: model.DescribeUserRequest, request: Request, response: Response,
+                        manager: UserManager = Depends(get_user_manager), io: AsyncDispatcher = Depends(get_io)):
+    not_modified = await check_etag(request, response, io, [manager.db], req.model_dump_json())
+    if not_modified:
+        return not_modified
+    return await io.read(manager.describe_user_dict, req.model_dump(mode="json"))
 
 @router.post("/update")
-def update_user(req: model.UpdateUserRequest, manager: UserManager = Depends(get_user_manager)):
-    response_json = manager.update_user(req.model_dump_json())
-    return json.loads(response_json)
+async def update_user(req: model.UpdateUserRequest, manager: UserManager = Depends(get_user_manager),
+                      io: AsyncDispatcher = Depends(get_io)):
+    return await io.write(manager.update_user_dict, req.model_dump(mode="json"))
 
 @router.get("/get_user_teams", response_model=model.GetUserTeamsResponse)
-def get_user_teams(req: model.GetUserTeamsRequest, manager: UserManager = Depends(get_user_manager)):
-    response_json = manager.get_user_teams(req.model_dump_json())
-    return json.loads(response_json)
+async def get_user_teams(req: model.GetUserTeamsRequest, request: Request, response: Response,
+                         manager: UserManager = Depends(get_user_manager), io: AsyncDispatcher = Depends(get_io)):
+    not_modified = await check_etag(request, response, io, [manager.db, manager.team_db], req.model_dump_json())
+    if not_modified:
+        return not_modified
+    return await cached_json(
+        request, response, io, manager.cache, {"users": manager.db, "teams": manager.team_db},
+        model.GetUserTeamsResponse,
+        lambda: io.read(manager.get_user_teams_dict, req.model_dump(mode="json")), [f"user_teams:{req.id}"],
+        req.model_dump_json()
+    )
@@ -0,0 +1,16 @@
+# Schemas for the admin endpoints
+from pydantic import BaseModel, Field
+from typing import Optional
+
+class ProfilingRequest(BaseModel):
+    # fraction of all requests to profile, 0 turns sampling off and 1 profiles every request
+    sample_rate: Optional[float] = Field(default=None, ge=0, le=1)
+    # whether an X-Profile header profiles its request
+    header: Optional[bool] = None
+
+class ProfilingResponse(BaseModel):
+    directory: str
+    sample_rate: float
+    header: bool
+    profiled: int
+    skipped: int
@@ -1,6 +1,7 @@
 # Schemas for Project Board management
 from pydantic import BaseModel, Field, RootModel
-from typing import List, Optional
+from app.schemas.common_schemas import VersionedRequest
+from typing import Dict, List, Optional
 from enum import Enum
 
 class CreateBoardRequest(BaseModel):
@@ -12,7 +13,7 @@ class CreateBoardRequest(BaseModel):
 class CreateBoardResponse(BaseModel):
     id: str
 
-class CloseBoardRequest(BaseModel):
+class CloseBoardRequest(VersionedRequest):
     id: str
 
 class AddTaskRequest(BaseModel):
@@ -25,21 +26,99 @@ class AddTaskRequest(BaseModel):
 class AddTaskResponse(BaseModel):
     id: str
 
+# no length limits here: the manager checks them per item, so one bad title doesn't reject the whole batch
+class AddTasksItem(BaseModel):
+    board_id: str
+    title: str
+    description: Optional[str]
+    user_id: str
+    creation_time: str
+
+class AddTasksRequest(BaseModel):
+    tasks: List[AddTasksItem]
+
+class AddTaskResult(BaseModel):
+    id: Optional[str] = None
+    error: Optional[str] = None
+
+class AddTasksResponse(BaseModel):
+    results: List[AddTaskResult]
+
 class TaskStatus(str, Enum):
     OPEN = "OPEN"
     IN_PROGRESS = "IN_PROGRESS"
     COMPLETE = "COMPLETE"
 
-class UpdateTaskStatusRequest(BaseModel):
+class UpdateTaskStatusRequest(VersionedRequest):
     id: str
     status: TaskStatus
 
+class ListTasksRequest(BaseModel):
+    board_id: Optional[str] = None
+    user_id: Optional[str] = None
+    status: Optional[TaskStatus] = None
+    # creation_time range, from inclusive and to exclusive
+    creation_time_from: Optional[str] = None
+    creation_time_to: Optional[str] = None
+
+class Task(BaseModel):
+    id: str
+    title: str
+    description: Optional[str] = None
+    board_id: str
+    user_id: Optional[str] = None
+    creation_time: Optional[str] = None
+    status: TaskStatus
+    version: int
+
+class ListTasksResponse(RootModel[List[Task]]):
+    pass
+
+class StatsRequest(BaseModel):
+    board_ids: List[str] = []
+    team_ids: List[str] = []
+    user_ids: List[str] = []
+
+class BoardStats(BaseModel):
+    OPEN: int
+    IN_PROGRESS: int
+    COMPLETE: int
+
+class TeamStats(BaseModel):
+    open_boards: int
+    closed_boards: int
+
+class UserStats(BaseModel):
+    open_tasks: int
+
+class StatsResponse(BaseModel):
+    boards: Dict[str, BoardStats]
+    teams: Dict[str, TeamStats]
+    users: Dict[str, UserStats]
+
+# status is a plain string here: the manager checks it per item, so one bad status doesn't reject the whole batch
+class UpdateTaskStatusesItem(VersionedRequest):
+    id: str
+    status: str
+
+class UpdateTaskStatusesRequest(BaseModel):
+    updates: List[UpdateTaskStatusesItem]
+
+class UpdateTaskStatusResult(BaseModel):
+    id: Optional[str] = None
+    status: Optional[TaskStatus] = None
+    error: Optional[str] = None
+
+class UpdateTaskStatusesResponse(BaseModel):
+    results: List[UpdateTaskStatusResult]
+
 class ListBoardsRequest(BaseModel):
     id: str
 
 class Board(BaseModel):
     id: str
     name: str
+    version: int
 
 class ListBoardsResponse(RootModel[List[Board]]):
     pass
@@ -47,5 +126,13 @@ class ListBoardsResponse(RootModel[List[Board]]):
 class ExportBoardRequest(BaseModel):
     id: str
 
-class ExportBoardResponse(BaseModel):
-    out_file: str
+class ExportJobResponse(BaseModel):
+    job_id: str
+    board_id: str
+    status: str
+    progress: float
+    out_file: Optional[str] = None
+    error: Optional[str] = None
+
+class ExportStatusRequest(BaseModel):
+    job_id: str
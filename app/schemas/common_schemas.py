@@ -0,0 +1,9 @@
+# Schemas shared by the other schema modules
+from pydantic import BaseModel, Field
+from typing import Optional
+
+class VersionedRequest(BaseModel):
+    version: Optional[int] = Field(
+        default=None,
+        description="The version the change is based on; 409 Conflict if the record has moved on since",
+    )
@@ -1,5 +1,6 @@
 # Schemas for Team management
 from pydantic import BaseModel, Field, RootModel
+from app.schemas.common_schemas import VersionedRequest
 from typing import List, Optional
 
 class CreateTeamRequest(BaseModel):
@@ -26,24 +27,26 @@ class DescribeTeamResponse(BaseModel):
     description: str
     creation_time: str
     admin: str
+    version: int
 
 class UpdateTeamPayload(BaseModel):
     name: Optional[str] = Field(max_length=64)
     description: Optional[str] = Field(max_length=128)
     admin: Optional[str] = None
 
-class UpdateTeamRequest(BaseModel):
+class UpdateTeamRequest(VersionedRequest):
     id: str
     team: UpdateTeamPayload
 
 class UpdateTeamResponse(BaseModel):
     status: str
+    version: int
 
-class AddUsersToTeamRequest(BaseModel):
+class AddUsersToTeamRequest(VersionedRequest):
     id: str
     users: List[str]
 
-class RemoveUsersFromTeamRequest(BaseModel):
+class RemoveUsersFromTeamRequest(VersionedRequest):
     id: str
     users: List[str]
 
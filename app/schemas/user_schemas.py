@@ -1,4 +1,5 @@
 from pydantic import BaseModel, Field, RootModel
+from app.schemas.common_schemas import VersionedRequest
 from typing import List, Optional
 
 class CreateUserRequest(BaseModel):
@@ -8,6 +9,21 @@ class CreateUserRequest(BaseModel):
 class CreateUserResponse(BaseModel):
     id: str
 
+# no length limits here: the manager checks them per item, so one bad name doesn't reject the whole batch
+class CreateUsersItem(BaseModel):
+    name: str
+    display_name: str
+
+class CreateUsersRequest(BaseModel):
+    users: List[CreateUsersItem]
+
+class CreateUserResult(BaseModel):
+    id: Optional[str] = None
+    error: Optional[str] = None
+
+class CreateUsersResponse(BaseModel):
+    results: List[CreateUserResult]
+
 class User(BaseModel):
     name: str
     display_name: str
@@ -23,12 +39,13 @@ class DescribeUserResponse(BaseModel):
     name: str
     description: str
     creation_time: str
+    version: int
 
 class UpdateUserPayload(BaseModel):
     name: Optional[str] = Field(default=None, max_length=64)
     display_name: Optional[str] = Field(default=None, max_length=128)
 
-class UpdateUserRequest(BaseModel):
+class UpdateUserRequest(VersionedRequest):
     id: str
     user: UpdateUserPayload
 
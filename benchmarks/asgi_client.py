@@ -0,0 +1,69 @@
+# Minimal in-process ASGI client for the benchmarks: calls the app directly, no sockets and no extra dependencies
+
+import asyncio
+import json
+from typing import Any, Dict, NamedTuple, Optional, Sequence, Tuple
+
+
+class Response(NamedTuple):
+    status: int
+    headers: Dict[str, str]
+    body: bytes
+
+    def json(self) -> Any:
+        return json.loads(self.body)
+
+
+class ASGIClient:
+    """
+    async with ASGIClient(app) as client:
+        response = await client.request("GET", "/api/v1/users/describe", {"id": user_id})
+    Entering runs the app's lifespan, so app.state is set up exactly as under uvicorn.
+    """
+    def __init__(self, app: Any) -> None:
+        self.app = app
+        self._lifespan = None
+
+    async def __aenter__(self) -> "ASGIClient":
+        self._lifespan = self.app.router.lifespan_context(self.app)
+        await self._lifespan.__aenter__()
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        await self._lifespan.__aexit__(*exc_info)
+
+    async def request(self, method: str, path: str, body: Optional[Any] = None, query: str = "",
+                      headers: Sequence[Tuple[str, str]] = ()) -> Response:
+        raw = json.dumps(body).encode() if body is not None else b""
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+            "method": method, "scheme": "http", "path": path, "raw_path": path.encode(),
+            "query_string": query.encode(), "root_path": "",
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(raw)).encode())]
+                       + [(k.lower().encode(), v.encode()) for k, v in headers],
+            "client": ("127.0.0.1", 50000), "server": ("testserver", 80), "app": self.app,
+        }
+        messages = [{"type": "http.request", "body": raw, "more_body": False}]
+        status, response_headers, chunks = 0, {}, []
+
+        async def receive() -> Dict[str, Any]:
+            if messages:
+                return messages.pop(0)
+            # like a real client, stay connected until the response is done
+            await asyncio.Event().wait()
+
+        async def send(message: Dict[str, Any]) -> None:
+            nonlocal status, response_headers
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                response_headers = {k.decode(): v.decode() for k, v in message.get("headers", [])}
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+
+        try:
+            await self.app(scope, receive, send)
+        except Exception:
+            # Starlette re-raises unhandled errors after sending the 500, for the server to log
+            if not status:
+                raise
+        return Response(status, response_headers, b"".join(chunks))
@@ -0,0 +1,124 @@
+# Latency under concurrent load: async handlers with the storage dispatcher against the old
+# behaviour where every handler ran in Starlette's shared threadpool.
+# Each client sends requests back to back; roughly 90% reads and 10% task status updates.
+# Latencies are reported for reads and writes apart, the writes make the tail.
+#
+#   python -m benchmarks.bench_async_load --clients 100 1000 --requests 20
+
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import tempfile
+import time
+from typing import Any, Dict, List
+
+from starlette.concurrency import run_in_threadpool
+
+from app.main import app
+from benchmarks.asgi_client import ASGIClient
+
+
+class ThreadpoolDispatcher:
+    # what sync `def` handlers did: every call, read or write, takes a slot in the shared threadpool
+    async def read(self, method, *args):
+        return await run_in_threadpool(method, *args)
+
+    write = read
+
+    def shutdown(self) -> None:
+        pass
+
+
+def seed(state: Any, users: int, teams: int, tasks: int, batch: int = 50000) -> Dict[str, List[str]]:
+    results = state.user_manager.create_users_dict(
+        {"users": [{"name": f"user{i}", "display_name": f"User {i}"} for i in range(users)]}
+    )["results"]
+    user_ids = [r["id"] for r in results]
+    team_ids, board_ids = [], []
+    for t in range(teams):
+        members = user_ids[t * 10 % users:t * 10 % users + 10]
+        team_id = state.team_manager.create_team_dict({"name": f"team{t}", "description": "", "admin": members[0]})["id"]
+        state.team_manager.add_users_to_team_dict({"id": team_id, "users": members})
+        board = {"name": f"board{t}", "description": "", "team_id": team_id, "creation_time": "2024-01-01T00:00:00"}
+        team_ids.append(team_id)
+        board_ids.append(state.board_manager.create_board_dict(board)["id"])
+    task_ids: List[str] = []
+    # in batches, so a million tasks don't sit in one request dict
+    for first in range(0, tasks, batch):
+        results = state.board_manager.add_tasks_dict({"tasks": [
+            {"board_id": board_ids[i % teams], "title": f"task{i}", "description": "", "user_id": user_ids[i % users],
+             "creation_time": "2024-01-01T00:00:00"}
+            for i in range(first, min(first + batch, tasks))
+        ]})["results"]
+        task_ids.extend(r["id"] for r in results)
+    return {"users": user_ids, "teams": team_ids, "boards": board_ids, "tasks": task_ids}
+
+
+async def client(api: ASGIClient, ids: Dict[str, List[str]], requests: int, latencies: Dict[str, List[float]]) -> None:
+    rng = random.Random()
+    for _ in range(requests):
+        roll = rng.random()
+        kind = "read"
+        if roll < 0.3:
+            call = ("GET", "/api/v1/users/describe", {"id": rng.choice(ids["users"])})
+        elif roll < 0.5:
+            call = ("GET", "/api/v1/teams/members", {"id": rng.choice(ids["teams"])})
+        elif roll < 0.7:
+            call = ("GET", "/api/v1/users/get_user_teams", {"id": rng.choice(ids["users"])})
+        elif roll < 0.9:
+            call = ("GET", "/api/v1/board/team_boards", {"id": rng.choice(ids["teams"])})
+        else:
+            status = rng.choice(["OPEN", "IN_PROGRESS", "COMPLETE"])
+            call = ("POST", "/api/v1/board/update_task_status", {"id": rng.choice(ids["tasks"]), "status": status})
+            kind = "write"
+        start = time.perf_counter()
+        # a request arriving on a socket waits its turn on the event loop. Without this, a client whose requests
+        # are answered inline would send them back to back without ever yielding, leaving the completed writes of
+        # the other clients waiting: the reads would be timed without their queueing and the writes with all of it
+        await asyncio.sleep(0)
+        response = await api.request(*call)
+        latencies[kind].append(time.perf_counter() - start)
+        assert response.status == 200, response.body
+
+
+async def run(mode: str, clients: int, args: argparse.Namespace) -> None:
+    os.chdir(tempfile.mkdtemp())
+    async with ASGIClient(app) as api:
+        ids = seed(app.state, args.users, args.teams, args.tasks)
+        if mode == "threadpool":
+            app.state.io.shutdown()
+            app.state.io = ThreadpoolDispatcher()
+
+        latencies: Dict[str, List[float]] = {"read": [], "write": []}
+        start = time.perf_counter()
+        await asyncio.gather(*(client(api, ids, args.requests, latencies) for _ in range(clients)))
+        elapsed = time.perf_counter() - start
+
+    q = statistics.quantiles(latencies["read"] + latencies["write"], n=100)
+    reads = statistics.quantiles(latencies["read"], n=100)
+    writes = statistics.quantiles(latencies["write"], n=100)
+    requests = len(latencies["read"]) + len(latencies["write"])
+    print(f"{mode:<12}{clients:>8}{requests / elapsed:>12.0f}{q[49] * 1e3:>10.1f}{q[98] * 1e3:>10.1f}"
+          f"{reads[98] * 1e3:>12.1f}{writes[49] * 1e3:>12.1f}{writes[98] * 1e3:>12.1f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, nargs="+", default=[100, 1000])
+    parser.add_argument("--requests", type=int, default=20, help="requests per client")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--teams", type=int, default=100)
+    parser.add_argument("--tasks", type=int, default=2000)
+    args = parser.parse_args()
+
+    print(f"{'mode':<12}{'clients':>8}{'req/s':>12}{'p50 ms':>10}{'p99 ms':>10}"
+          f"{'read p99':>12}{'write p50':>12}{'write p99':>12}")
+    for clients in args.clients:
+        for mode in ["threadpool", "async"]:
+            asyncio.run(run(mode, clients, args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+# Cost of the request instrumentation (metrics middleware, Server-Timing phases, storage and manager timers):
+# the request mix of bench_async_load (90% reads, 10% task status updates) against two copies of the API
+# loaded into one process, one built with FACTWISE_METRICS=0 and one with metrics on, each on its own data.
+# Every request goes to both copies back to back, in alternating order, and is compared on CPU time (fsync
+# waits would otherwise swamp the difference). Separate processes differ by more than the 1% limit from
+# memory layout alone, which this comparison doesn't suffer from; --same loads two uninstrumented copies,
+# showing how far apart identical code measures.
+# The 1% limit applies to every endpoint on its own: the mix is dominated by the writes' fsyncs and would hide
+# a read whose instrumentation costs more than the read. Each read is sent --samples times to both copies and
+# the fastest of each counts, a preemption or a GC pause only ever adds time; writes are sent once, repeating
+# them would change the record, and their fsyncs dwarf the instrumentation either way.
+#
+#   python -m benchmarks.bench_metrics --requests 3000 --repeat 5
+
+import argparse
+import asyncio
+import importlib
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from contextlib import AsyncExitStack
+from typing import Any, Dict, List, Tuple
+
+MAX_OVERHEAD = 0.01
+
+# the first-party packages, imported afresh for each copy of the app
+PACKAGES = ("abstract_classes", "app", "impl", "utils", "benchmarks.bench_async_load")
+
+
+def load_app(metrics: bool) -> Tuple[Any, Any]:
+    # (app, seed) from a fresh import, so module-level instrumentation follows FACTWISE_METRICS
+    for name in [name for name in sys.modules if name.startswith(PACKAGES)]:
+        del sys.modules[name]
+    os.environ["FACTWISE_METRICS"] = "1" if metrics else "0"
+    bench = importlib.import_module("benchmarks.bench_async_load")
+    return bench.app, bench.seed
+
+
+async def workload(args: argparse.Namespace) -> Dict[str, Dict[str, List[float]]]:
+    from benchmarks.asgi_client import ASGIClient
+
+    modes = {"off": load_app(False), "on": load_app(not args.same)}
+    async with AsyncExitStack() as stack:
+        apis, dirs, ids = {}, {}, {}
+        for mode, (app, seed) in modes.items():
+            # storage paths are relative (db/...): each copy works in its own directory
+            dirs[mode] = tempfile.mkdtemp()
+            os.chdir(dirs[mode])
+            apis[mode] = await stack.enter_async_context(ASGIClient(app))
+            ids[mode] = seed(app.state, args.users, args.teams, args.tasks)
+
+        # the same requests for both copies; the ids differ between them, so a call names its record by position
+        rng = random.Random(1)
+        calls = []
+        for _ in range(args.requests):
+            roll = rng.random()
+            if roll < 0.3:
+                calls.append(("describe_user", "GET", "/api/v1/users/describe", "users", rng.randrange(args.users), {}))
+            elif roll < 0.5:
+                calls.append(("team_members", "GET", "/api/v1/teams/members", "teams", rng.randrange(args.teams), {}))
+            elif roll < 0.7:
+                calls.append(("user_teams", "GET", "/api/v1/users/get_user_teams", "users", rng.randrange(args.users), {}))
+            elif roll < 0.9:
+                calls.append(("team_boards", "GET", "/api/v1/board/team_boards", "teams", rng.randrange(args.teams), {}))
+            else:
+                status = rng.choice(["OPEN", "IN_PROGRESS", "COMPLETE"])
+                calls.append(("update_status", "POST", "/api/v1/board/update_task_status", "tasks",
+                              rng.randrange(args.tasks), {"status": status}))
+
+        # CPU seconds of every request, by mode and endpoint
+        spent: Dict[str, Dict[str, List[float]]] = {mode: {} for mode in modes}
+        # which copy goes first alternates per endpoint, not per request: the second of a pair runs warmer, and
+        # an endpoint that happened to get more odd than even turns would carry that as a difference
+        orders = {name: list(modes) for name, *_ in calls}
+        for _ in range(args.repeat):
+            for name, method, path, kind, position, fields in calls:
+                fastest: Dict[str, float] = {}
+                for _ in range(args.samples if method == "GET" else 1):
+                    for mode in orders[name]:
+                        os.chdir(dirs[mode])
+                        body = {"id": ids[mode][kind][position], **fields}
+                        start = time.process_time()
+                        response = await apis[mode].request(method, path, body)
+                        elapsed = time.process_time() - start
+                        assert response.status == 200, response.body
+                        fastest[mode] = min(fastest.get(mode, elapsed), elapsed)
+                    orders[name].reverse()
+                for mode, elapsed in fastest.items():
+                    spent[mode].setdefault(name, []).append(elapsed)
+    return spent
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=3000)
+    parser.add_argument("--repeat", type=int, default=5, help="passes over the requests")
+    parser.add_argument("--samples", type=int, default=3, help="times each read is sent, the fastest counts")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--teams", type=int, default=100)
+    parser.add_argument("--tasks", type=int, default=2000)
+    parser.add_argument("--same", action="store_true", help="instrument neither copy, to see the noise floor")
+    args = parser.parse_args()
+
+    spent = asyncio.run(workload(args))
+
+    # each request against its twin in the other copy, which read the same record right before or after it:
+    # the median of those differences, so neither a GC pause or a preemption nor the records' different sizes
+    # decide a 1% difference; the mix is the mean, it is what the whole workload costs
+    def cost(mode: str, name: str) -> float:
+        if name == "mix":
+            times = [t for times in spent[mode].values() for t in times]
+            return sum(times) / len(times)
+        return statistics.median(spent[mode][name])
+
+    def overhead_of(name: str) -> float:
+        if name == "mix":
+            return cost("on", name) / cost("off", name) - 1
+        differences = [on - off for on, off in zip(spent["on"][name], spent["off"][name])]
+        return statistics.median(differences) / cost("off", name)
+
+    print(f"{'endpoint':<16}{'off cpu us':>12}{'on cpu us':>12}{'overhead':>10}")
+    over = []
+    for name in [*sorted(spent["off"]), "mix"]:
+        off, on = cost("off", name), cost("on", name)
+        overhead = overhead_of(name)
+        verdict = "" if name == "mix" else "  OK" if overhead < MAX_OVERHEAD else "  OVER"
+        print(f"{name:<16}{off * 1e6:>12.1f}{on * 1e6:>12.1f}{overhead:>+10.2%}{verdict}")
+        if verdict == "  OVER":
+            over.append(name)
+    print(f"limit {MAX_OVERHEAD:.0%} per endpoint: {'OK' if not over else 'OVER on ' + ', '.join(over)}")
+    sys.exit(0 if not over else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+# Peak memory of list_users as one JSON array against the NDJSON stream,
+# measured on top of what the storage already holds.
+#
+#   python -m benchmarks.bench_streaming --users 10000 20000 40000 --backend sqlite
+
+import argparse
+import json
+import os
+import tempfile
+import tracemalloc
+
+from app.responses import _lines
+from impl.user_manager import UserManager
+
+
+def peak_kib(consume) -> float:
+    tracemalloc.start()
+    consume()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak / 1024
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, nargs="+", default=[10000, 20000, 40000])
+    parser.add_argument("--backend", choices=["json", "sqlite"], default="json")
+    args = parser.parse_args()
+
+    print(f"{'users':>8}{'array (KiB)':>14}{'ndjson (KiB)':>14}")
+    for count in args.users:
+        tmp = tempfile.mkdtemp()
+        users = UserManager(user_db_path=os.path.join(tmp, "users.json"),
+                            team_db_path=os.path.join(tmp, "teams.json"), backend=args.backend)
+        users.db.write({
+            f"{i:08}": {"id": f"{i:08}", "name": f"user{i}", "display_name": f"User {i}",
+                        "description": f"User {i}", "creation_time": "2024-01-01T00:00:00"}
+            for i in range(count)
+        })
+        # warm the cache so only the response path is measured
+        users.db.values()
+
+        array = peak_kib(lambda: json.dumps(users.list_users_dict()).encode())
+        stream = peak_kib(lambda: sum(len(line) for line in _lines(users.iter_users())))
+        print(f"{count:>8}{array:>14.0f}{stream:>14.0f}")
+        users.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,268 @@
+# Throughput and latency of every endpoint under a mixed workload, driven in-process over ASGI (no sockets).
+# Each dataset size is seeded in a fresh process and temp directory, then every concurrency level replays
+# the same seeded request mix against it: user/team/board/task creation, status updates, listings, lookups,
+# statistics and exports. Results go to a JSON file; --compare prints the change against an earlier one.
+#
+#   python -m benchmarks.bench_suite --tasks 1000 100000 --concurrency 1 16 64 --requests 5000
+#   FILEDB_JOURNAL=1 python -m benchmarks.bench_suite --tasks 1000000 --compare bench_results/<earlier>.json
+#
+# Storage settings (FACTWISE_STORAGE, FILEDB_JOURNAL, FILEDB_FSYNC, ...) are taken from the environment
+# and recorded in the results.
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# name -> relative weight, per workload
+WORKLOADS: Dict[str, Dict[str, int]] = {
+    "mixed": {
+        "describe_user": 15, "list_users": 5, "get_user_teams": 10, "describe_team": 10, "team_members": 10,
+        "team_boards": 10, "list_tasks": 10, "board_stats": 5,
+        "create_user": 3, "create_team": 1, "create_board": 2, "add_task": 6, "update_task_status": 10, "export": 1,
+    },
+    "read_heavy": {
+        "describe_user": 20, "list_users": 5, "get_user_teams": 15, "describe_team": 15, "team_members": 15,
+        "team_boards": 10, "list_tasks": 10, "board_stats": 5,
+        "add_task": 1, "update_task_status": 2,
+    },
+    "write_heavy": {
+        "describe_user": 5, "list_tasks": 5, "team_boards": 5,
+        "create_user": 10, "create_team": 3, "create_board": 5, "add_task": 30, "update_task_status": 35, "export": 2,
+    },
+}
+
+# environment that changes what is measured, copied into the results
+SETTINGS = ["FACTWISE_STORAGE", "FILEDB_JOURNAL", "FILEDB_FSYNC", "FILEDB_GROUP_COMMIT_MS", "FACTWISE_IO_WORKERS",
+            "FACTWISE_METRICS", "FACTWISE_RESPONSE_CACHE_BYTES"]
+
+# (method, path, body, query, collection a successful call adds an id to)
+Call = Tuple[str, str, Optional[Dict[str, Any]], str, Optional[str]]
+CREATED = "2024-01-01T00:00:00"
+
+
+def operations(ids: Dict[str, List[str]], unique: Callable[[], int]) -> Dict[str, Callable[[random.Random], Call]]:
+    # builds one request of each kind; creations use `unique` for names the validation accepts
+    return {
+        "describe_user": lambda rng: ("GET", "/api/v1/users/describe", {"id": rng.choice(ids["users"])}, "", None),
+        "list_users": lambda rng: ("GET", "/api/v1/users/", None, "limit=100", None),
+        "get_user_teams": lambda rng: ("GET", "/api/v1/users/get_user_teams", {"id": rng.choice(ids["users"])}, "", None),
+        "describe_team": lambda rng: ("GET", "/api/v1/teams/describe", {"id": rng.choice(ids["teams"])}, "", None),
+        "team_members": lambda rng: ("GET", "/api/v1/teams/members", {"id": rng.choice(ids["teams"])}, "", None),
+        "team_boards": lambda rng: ("GET", "/api/v1/board/team_boards", {"id": rng.choice(ids["teams"])}, "", None),
+        "list_tasks": lambda rng: ("GET", "/api/v1/board/tasks", {"board_id": rng.choice(ids["boards"])}, "limit=50", None),
+        "board_stats": lambda rng: ("GET", "/api/v1/board/stats", {
+            "board_ids": [rng.choice(ids["boards"])], "team_ids": [rng.choice(ids["teams"])],
+            "user_ids": [rng.choice(ids["users"])],
+        }, "", None),
+        "create_user": lambda rng: ("POST", "/api/v1/users/create", {
+            "name": f"bench-user{unique()}", "display_name": "Bench User",
+        }, "", "users"),
+        "create_team": lambda rng: ("POST", "/api/v1/teams/create", {
+            "name": f"bench-team{unique()}", "description": "", "admin": rng.choice(ids["users"]),
+        }, "", "teams"),
+        "create_board": lambda rng: ("POST", "/api/v1/board/create", {
+            "name": f"bench-board{unique()}", "description": "", "team_id": rng.choice(ids["teams"]),
+            "creation_time": CREATED,
+        }, "", "boards"),
+        "add_task": lambda rng: ("POST", "/api/v1/board/add_task", {
+            "board_id": rng.choice(ids["boards"]), "title": f"bench-task{unique()}", "description": "",
+            "user_id": rng.choice(ids["users"]), "creation_time": CREATED,
+        }, "", "tasks"),
+        "update_task_status": lambda rng: ("POST", "/api/v1/board/update_task_status", {
+            "id": rng.choice(ids["tasks"]), "status": rng.choice(["OPEN", "IN_PROGRESS", "COMPLETE"]),
+        }, "", None),
+        "export": lambda rng: ("GET", "/api/v1/board/export", {"id": rng.choice(ids["boards"])}, "", None),
+    }
+
+
+def dataset(tasks: int) -> Tuple[int, int]:
+    # users and teams for `tasks` tasks: 10 members per team, one board per team
+    users = min(max(tasks // 20, 100), 10000)
+    return users, users // 10
+
+
+def summary(latencies: List[float], errors: int, elapsed: float) -> Dict[str, Any]:
+    ordered = sorted(latencies)
+    if len(ordered) > 1:
+        q = statistics.quantiles(ordered, n=100, method="inclusive")
+        p50, p95, p99 = q[49], q[94], q[98]
+    else:
+        p50 = p95 = p99 = ordered[0] if ordered else 0.0
+    return {
+        "count": len(ordered), "errors": errors, "ops_per_sec": round(len(ordered) / elapsed, 1),
+        "mean_ms": round(statistics.fmean(ordered) * 1e3, 3) if ordered else 0.0,
+        "p50_ms": round(p50 * 1e3, 3), "p95_ms": round(p95 * 1e3, 3), "p99_ms": round(p99 * 1e3, 3),
+    }
+
+
+async def level(api: Any, ids: Dict[str, List[str]], weights: Dict[str, int], concurrency: int, requests: int,
+                rng_seed: str, unique: Callable[[], int]) -> Dict[str, Any]:
+    # `requests` calls shared out between `concurrency` clients sending back to back
+    ops = operations(ids, unique)
+    names, cumulative = list(weights), list(itertools.accumulate(weights.values()))
+    latencies: Dict[str, List[float]] = {name: [] for name in names}
+    errors: Dict[str, int] = {name: 0 for name in names}
+    remaining = requests
+
+    async def client(index: int) -> None:
+        nonlocal remaining
+        rng = random.Random(f"{rng_seed}-{index}")
+        while remaining > 0:
+            remaining -= 1
+            name = rng.choices(names, cum_weights=cumulative)[0]
+            method, path, body, query, adds = ops[name](rng)
+            start = time.perf_counter()
+            response = await api.request(method, path, body, query)
+            latencies[name].append(time.perf_counter() - start)
+            if response.status >= 400:
+                errors[name] += 1
+            elif adds is not None:
+                ids[adds].append(response.json()["id"])
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client(i) for i in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    return {
+        "concurrency": concurrency, "requests": requests, "elapsed_seconds": round(elapsed, 3),
+        "total": summary([x for name in names for x in latencies[name]], sum(errors.values()), elapsed),
+        "endpoints": {name: summary(latencies[name], errors[name], elapsed) for name in names if latencies[name]},
+    }
+
+
+async def run_dataset(args: argparse.Namespace) -> Dict[str, Any]:
+    # imported here, the storage settings are read when the app is built
+    from app.main import app
+    from benchmarks.asgi_client import ASGIClient
+    from benchmarks.bench_async_load import seed
+    from utils import file_db
+
+    [tasks] = args.tasks
+    users, teams = dataset(tasks)
+    cwd = os.getcwd()
+    workdir = tempfile.mkdtemp(prefix="factwise-bench-")
+    os.chdir(workdir)
+    try:
+        async with ASGIClient(app) as api:
+            # seeding isn't measured and needs no durability
+            fsync, file_db.FSYNC = file_db.FSYNC, False
+            start = time.perf_counter()
+            ids = seed(app.state, users, teams, tasks)
+            seed_seconds = time.perf_counter() - start
+            file_db.FSYNC = fsync
+
+            counter = itertools.count()
+            unique = lambda: next(counter)
+            weights = WORKLOADS[args.workload]
+            # warm the caches with the same mix, then measure each concurrency level
+            await level(api, ids, weights, min(args.concurrency), args.warmup, f"{args.seed}-{tasks}-warmup", unique)
+            levels = [
+                await level(api, ids, weights, concurrency, args.requests, f"{args.seed}-{tasks}-{concurrency}", unique)
+                for concurrency in args.concurrency
+            ]
+    finally:
+        # the lifespan has flushed and closed the storage by now, the data is of no further use
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+    return {"tasks": tasks, "users": users, "teams": teams, "seed_seconds": round(seed_seconds, 3), "levels": levels}
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results: Dict[str, Any]) -> None:
+    print(f"{'tasks':>8}{'clients':>8}  {'endpoint':<20}{'ops/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>8}")
+    for run in results["runs"]:
+        for lvl in run["levels"]:
+            for name, stats in list(lvl["endpoints"].items()) + [("TOTAL", lvl["total"])]:
+                print(f"{run['tasks']:>8}{lvl['concurrency']:>8}  {name:<20}{stats['ops_per_sec']:>10.1f}"
+                      f"{stats['p50_ms']:>10.2f}{stats['p95_ms']:>10.2f}{stats['p99_ms']:>10.2f}{stats['errors']:>8}")
+
+
+def compare(baseline: Dict[str, Any], results: Dict[str, Any]) -> None:
+    # ops/s and p99 change for every (tasks, clients, endpoint) both files have
+    def flatten(data: Dict[str, Any]) -> Dict[Tuple[int, int, str], Dict[str, Any]]:
+        return {
+            (run["tasks"], lvl["concurrency"], name): stats
+            for run in data["runs"] for lvl in run["levels"]
+            for name, stats in list(lvl["endpoints"].items()) + [("TOTAL", lvl["total"])]
+        }
+
+    old, new = flatten(baseline), flatten(results)
+    print(f"\ncompared with {baseline['meta'].get('commit') or 'baseline'} ({baseline['meta']['started']})")
+    print(f"{'tasks':>8}{'clients':>8}  {'endpoint':<20}{'ops/s':>10}{'change':>9}{'p99 ms':>10}{'change':>9}")
+    for key in sorted(old.keys() & new.keys()):
+        before, after = old[key], new[key]
+        if not before["ops_per_sec"] or not before["p99_ms"]:
+            continue
+        print(f"{key[0]:>8}{key[1]:>8}  {key[2]:<20}{after['ops_per_sec']:>10.1f}"
+              f"{after['ops_per_sec'] / before['ops_per_sec'] - 1:>+9.1%}"
+              f"{after['p99_ms']:>10.2f}{after['p99_ms'] / before['p99_ms'] - 1:>+9.1%}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tasks", type=int, nargs="+", default=[1000, 100000], help="dataset sizes, in tasks")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 16, 64], help="concurrent clients")
+    parser.add_argument("--requests", type=int, default=5000, help="requests per concurrency level")
+    parser.add_argument("--warmup", type=int, default=500, help="unmeasured requests before the first level")
+    parser.add_argument("--workload", choices=sorted(WORKLOADS), default="mixed")
+    parser.add_argument("--seed", type=int, default=1, help="seed of the request mix")
+    parser.add_argument("--out", default=None, help="results file, bench_results/<time>.json by default")
+    parser.add_argument("--compare", default=None, help="earlier results file to compare with")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(asyncio.run(run_dataset(args))))
+        return
+
+    started = time.strftime("%Y-%m-%dT%H:%M:%S")
+    out = args.out or os.path.join("bench_results", time.strftime("%Y%m%dT%H%M%S") + ".json")
+    results: Dict[str, Any] = {
+        "meta": {
+            "started": started, "commit": git_commit(), "python": platform.python_version(),
+            "platform": platform.platform(), "cpus": os.cpu_count(),
+            "workload": args.workload, "weights": WORKLOADS[args.workload], "seed": args.seed,
+            "requests": args.requests, "warmup": args.warmup,
+            "settings": {name: os.environ[name] for name in SETTINGS if name in os.environ},
+        },
+        "runs": [],
+    }
+    for tasks in args.tasks:
+        # a process per dataset, so one size's caches and indexes don't weigh on the next
+        child_args = [sys.executable, "-m", "benchmarks.bench_suite", "--child", f"--tasks={tasks}",
+                      f"--requests={args.requests}", f"--warmup={args.warmup}", f"--workload={args.workload}",
+                      f"--seed={args.seed}", "--concurrency"] + [str(c) for c in args.concurrency]
+        env = dict(os.environ, PYTHONHASHSEED="0")
+        output = subprocess.run(child_args, env=env, check=True, capture_output=True, text=True).stdout
+        # the last line, in case anything else wrote to stdout
+        results["runs"].append(json.loads(output.strip().splitlines()[-1]))
+        print(f"seeded {tasks} tasks in {results['runs'][-1]['seed_seconds']:.1f}s", file=sys.stderr)
+
+    os.makedirs(os.path.dirname(out) or ".", exist_ok=True)
+    with open(out, "w") as f:
+        json.dump(results, f, indent=4)
+    print_results(results)
+    print(f"\nresults written to {out}")
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), results)
+
+
+if __name__ == "__main__":
+    main()
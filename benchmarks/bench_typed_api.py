@@ -0,0 +1,63 @@
+# Per-request cost of the old router path (model -> JSON string -> manager -> JSON string -> dict)
+# against the typed manager API the routers call now.
+#
+#   python -m benchmarks.bench_typed_api --users 2000 --repeat 500
+
+import argparse
+import json
+import os
+import tempfile
+import timeit
+
+from app.schemas import team_schemas, user_schemas
+from impl.team_manager import TeamManager
+from impl.user_manager import UserManager
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=500)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    user_path, team_path = os.path.join(tmp, "users.json"), os.path.join(tmp, "teams.json")
+    users = UserManager(user_db_path=user_path, team_db_path=team_path)
+    teams = TeamManager(team_db_path=team_path, user_db_path=user_path)
+
+    # one bulk write keeps setup fast
+    users.db.write({
+        str(i): {"id": str(i), "name": f"user{i}", "display_name": f"User {i}",
+                 "description": f"User {i}", "creation_time": "2024-01-01T00:00:00"}
+        for i in range(args.users)
+    })
+    team_id = teams.create_team_dict({"name": "team", "description": "", "admin": "0"})["id"]
+    teams.add_users_to_team_dict({"id": team_id, "users": [str(i) for i in range(1, 50)]})
+
+    describe = user_schemas.DescribeUserRequest(id="1")
+    members = team_schemas.ListTeamUsersRequest(id=team_id)
+    cases = {
+        "list_users": (
+            lambda: json.loads(users.list_users()),
+            lambda: users.list_users_dict(),
+        ),
+        "describe_user": (
+            lambda: json.loads(users.describe_user(describe.model_dump_json())),
+            lambda: users.describe_user_dict(describe.model_dump(mode="json")),
+        ),
+        "list_team_users": (
+            lambda: json.loads(teams.list_team_users(members.model_dump_json())),
+            lambda: teams.list_team_users_dict(members.model_dump(mode="json")),
+        ),
+    }
+
+    print(f"{'endpoint':<18}{'string (us)':>14}{'typed (us)':>14}{'saving':>10}")
+    for name, (string_path, typed_path) in cases.items():
+        assert string_path() == typed_path()
+        string_us = min(timeit.repeat(string_path, number=args.repeat, repeat=3)) / args.repeat * 1e6
+        typed_us = min(timeit.repeat(typed_path, number=args.repeat, repeat=3)) / args.repeat * 1e6
+        print(f"{name:<18}{string_us:>14.1f}{typed_us:>14.1f}{1 - typed_us / string_us:>10.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,16 +2,44 @@ import json
 import uuid
 import datetime
 import os
+import threading
+from typing import Dict, Any, Callable, Iterable, Iterator, List, Optional, Set, Tuple
 
 from abstract_classes.project_board_base import ProjectBoardBase
-from utils.file_db import FileDB
+from utils.storage import open_storage, USER_INDEXES, TEAM_INDEXES, BOARD_INDEXES, TASK_INDEXES
+from utils.concurrency import synchronized, cas_update, cas_update_many, check_version, VersionConflict
+from utils.export_cache import ExportCache
+from utils.jobs import JobPool, Progress
+from utils.pagination import iterate, paginate, paginate_find, DEFAULT_PAGE_SIZE
+from utils.response_cache import CachedCollections, ResponseCache
+
+# exports go through one large buffer instead of a write per line
+EXPORT_BUFFER_SIZE = 1 << 20
+
+TASK_STATUSES = ("OPEN", "IN_PROGRESS", "COMPLETE")
+
+class BoardManager(CachedCollections, ProjectBoardBase):
+    def __init__(self, boards_db_path="db/boards.json", tasks_db_path="db/tasks.json", team_db_path="db/teams.json", user_db_path="db/users.json", backend=None,
+                 cache: Optional[ResponseCache] = None):
+        self.board_db = open_storage(boards_db_path, BOARD_INDEXES, backend)
+        self.task_db = open_storage(tasks_db_path, TASK_INDEXES, backend)
+        self.team_db = open_storage(team_db_path, TEAM_INDEXES, backend)
+        self.user_db = open_storage(user_db_path, USER_INDEXES, backend)
+        # one instance serves every request, writes go through this lock
+        self._lock = threading.RLock()
+        self.export_jobs = JobPool()
+        self.exports = ExportCache()
+        # encoded responses of the read endpoints, shared with the other managers
+        self.cache = cache or ResponseCache()
+        self._collections = {
+            "boards": self.board_db, "tasks": self.task_db, "teams": self.team_db, "users": self.user_db,
+        }
+        self._written = "boards"
 
-class BoardManager(ProjectBoardBase):
-    def __init__(self, boards_db_path="db/boards.json", tasks_db_path="db/tasks.json", team_db_path="db/teams.json", user_db_path="db/users.json"):
-        self.board_db = FileDB(boards_db_path)
-        self.task_db = FileDB(tasks_db_path)
-        self.team_db = FileDB(team_db_path)
-        self.user_db = FileDB(user_db_path)
+    def close(self) -> None:
+        self.export_jobs.shutdown()
+        for db in [self.board_db, self.task_db, self.team_db, self.user_db]:
+            db.close()
 
     def _validate_name(self, name: str, max_len: int):
         if not name or len(name) > max_len:
@@ -21,10 +49,26 @@ class BoardManager(ProjectBoardBase):
         if desc and len(desc) > max_len:
             raise ValueError(f"Description must be less than {max_len} characters.")
 
-
-
-    def create_board(self, request: str) -> str:
-        data = json.loads(request)
+    def _open_board(self, board_id: str) -> Dict[str, Any]:
+        board = self._get_board({"id": board_id})
+        if board["status"] == "CLOSED":
+            raise ValueError(f"Board id:{board_id} is closed")
+        return board
+
+    # a change to a board's tasks is a change to the board: storing it unchanged through compare_and_put()
+    # bumps its version, and retries against concurrent bumps instead of overwriting them.
+    # Called after the task write, see close_board_dict(); returns board id -> error for the boards it
+    # couldn't bump (closed meanwhile, or kept changing), whose task writes the caller must undo
+    def _bump_versions(self, board_ids: Iterable[str]) -> Dict[str, ValueError]:
+        self._sync()
+        bumped = cas_update_many(self.board_db, self._open_board, board_ids)
+        # the team_boards lists carry the versions
+        teams = {board["team_id"] for board in bumped.values() if not isinstance(board, ValueError)}
+        self._invalidate(*(f"team_boards:{team_id}" for team_id in teams))
+        return {board_id: error for board_id, error in bumped.items() if isinstance(error, ValueError)}
+
+    @synchronized
+    def create_board_dict(self, data: Dict[str, Any]) -> Dict[str, Any]:
         board_name = data.get("name")
         description = data.get("description")
         team_id = data.get("team_id")
@@ -35,11 +79,7 @@ class BoardManager(ProjectBoardBase):
         self._validate_description(description, 128)
 
         # board name must be unique for a team
-        boards = self.board_db.read()
-        if any(
-            board["name"] == board_name and board["team_id"] == team_id
-            for board in boards.values()
-        ):
+        if self.board_db.find(team_id=team_id, name=board_name):
             raise ValueError(f"Board with name '{board_name}' already exists for team:[{team_id}].")
 
         board_id = str(uuid.uuid4())
@@ -51,35 +91,52 @@ class BoardManager(ProjectBoardBase):
             "creation_time": creation_time,
             "status": "OPEN",
             "end_time": None,
+            # bumped by every change to the board or its tasks, keys the export cache
+            "version": 0,
             # "tasks": []
         }
-        boards[board_id] = board
-        self.board_db.write(boards)
+        self._sync()
+        self.board_db.put(board_id, board)
+        self._invalidate(f"team_boards:{team_id}")
 
-        return json.dumps({"id":board_id})
+        return {"id":board_id}
 
-    def close_board(self, request: str) -> str:
-        data = json.loads(request)
+    def close_board_dict(self, data: Dict[str, Any]) -> Dict[str, Any]:
         board_id = data.get("id")
         if not board_id:
             raise ValueError("Board ID is required.")
 
-        boards = self.board_db.read()
-        if board_id not in boards:
-            raise ValueError(f"Board with ID:[{board_id}] not found.")
-
-        board = boards[board_id]
-        if board["status"] == "CLOSED":
-            raise ValueError(f"Board with ID [{board_id}] is already closed.")
-
-        board["status"] = "CLOSED"
-        board["end_time"] = datetime.datetime.now().isoformat()
-        self.board_db.write(boards)
-
-        return json.dumps({"id":board_id, "status": f"{board["status"]} on {board["end_time"]}"})
-
-    def add_task(self, request: str) -> str:
-        data = json.loads(request)
+        def update() -> Dict[str, Any]:
+            board = self.board_db.get(board_id)
+            if board is None:
+                raise ValueError(f"Board with ID:[{board_id}] not found.")
+            check_version(board, data.get("version"))
+
+            if board["status"] == "CLOSED":
+                raise ValueError(f"Board with ID [{board_id}] is already closed.")
+
+            # only boards with all tasks marked as COMPLETE can be closed. Task writes bump the board's version
+            # after storing the task, so one stored after this count bumps it after the count too: before the
+            # compare-and-set below it makes that fail and the count is taken again, after it the bump finds
+            # the board closed and the writer undoes its task write
+            pending = self.task_db.count(board_id=board_id) - self.task_db.count(board_id=board_id, status="COMPLETE")
+            if pending:
+                raise ValueError(f"Board with ID [{board_id}] still has {pending} incomplete task(s).")
+
+            board["status"] = "CLOSED"
+            board["end_time"] = datetime.datetime.now().isoformat()
+            return board
+
+        self._sync()
+        board = cas_update(self.board_db, update)
+        self._invalidate(f"team_boards:{board['team_id']}")
+
+        return {"id":board_id, "status": f"{board['status']} on {board['end_time']}"}
+
+    # validated new task record; `boards` caches the boards a batch touches, `pending_titles`
+    # holds the (board_id, title) pairs of tasks in the same batch that are not stored yet
+    def _new_task(self, data: Dict[str, Any], boards: Dict[str, Dict[str, Any]],
+                  pending_titles: Set[Tuple[str, str]]) -> Dict[str, Any]:
         board_id = data.get("board_id")
         task_title = data.get("title")
         description = data.get("description")
@@ -90,115 +147,340 @@ class BoardManager(ProjectBoardBase):
         self._validate_name(task_title, 64)
         self._validate_description(description, 128)
 
-        boards = self.board_db.read()
-        tasks = self.task_db.read()
-
-        board = boards.get(board_id)
+        board = boards.get(board_id) or self.board_db.get(board_id)
         if not board:
             raise ValueError(f"Board id:{board_id} not found")
         if board["status"] == "CLOSED":
             raise ValueError("Cannot add task to closed board")
 
         # task title must be unique for board
-        if any(
-            task["title"] == task_title and task["board_id"] == board_id for task in tasks.values()
-        ): raise ValueError(f"Task with title '{task_title}' already exist under Board:{board_id}")
+        if (board_id, task_title) in pending_titles or self.task_db.find(board_id=board_id, title=task_title):
+            raise ValueError(f"Task with title '{task_title}' already exist under Board:{board_id}")
 
-        task_id = str(uuid.uuid4())
-        task = {
-            "id": task_id,
+        boards[board_id] = board
+        return {
+            "id": str(uuid.uuid4()),
             "title": task_title,
             "description": description,
             "board_id": board_id,
             "user_id": user_id,
             "creation_time": creation_time,
             "status": "OPEN",
+            # bumped by every update, see cas_update()
+            "version": 0,
         }
-        tasks[task_id] = task
-
-        self.task_db.write(tasks)
-        return json.dumps({"id": task_id})
 
-
-    def update_task_status(self, request: str) -> str:
-        data = json.loads(request)
+    @synchronized
+    def add_task_dict(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        boards: Dict[str, Dict[str, Any]] = {}
+        task = self._new_task(data, boards, set())
+        self.task_db.put(task["id"], task)
+        failed = self._bump_versions([task["board_id"]])
+        if failed:
+            self.task_db.delete_many([task["id"]])
+            raise failed[task["board_id"]]
+        return {"id": task["id"]}
+
+    @synchronized
+    def add_tasks_dict(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        # every item is checked on its own; the valid ones are stored in one write
+        boards: Dict[str, Dict[str, Any]] = {}
+        tasks: Dict[str, Dict[str, Any]] = {}
+        titles: Set[Tuple[str, str]] = set()
+        results = []
+        for item in data.get("tasks", []):
+            try:
+                task = self._new_task(item, boards, titles)
+            except ValueError as exc:
+                results.append({"id": None, "error": str(exc)})
+                continue
+            tasks[task["id"]] = task
+            titles.add((task["board_id"], task["title"]))
+            results.append({"id": task["id"], "error": None})
+        self.task_db.put_many(tasks)
+        failed = self._bump_versions(task["board_id"] for task in tasks.values())
+        if failed:
+            undone = {task_id for task_id, task in tasks.items() if task["board_id"] in failed}
+            self.task_db.delete_many(list(undone))
+            for result in results:
+                if result["id"] in undone:
+                    result.update(id=None, error=str(failed[tasks[result["id"]]["board_id"]]))
+        return {"results": results}
+
+    # `previous` collects the status each task had before the change
+    def _set_task_status(self, data: Dict[str, Any], previous: Dict[str, str]) -> Dict[str, Any]:
         task_id = data.get("id")
         updated_status = data.get("status")
 
         if not task_id:
             raise ValueError("Task id is required")
+        if updated_status not in TASK_STATUSES:
+            raise ValueError(f"Invalid status <{updated_status}>, must be one of {', '.join(TASK_STATUSES)}")
 
-        tasks = self.task_db.read()
-        if task_id not in tasks:
+        task = self.task_db.get(task_id)
+        if task is None:
             raise ValueError(f"Task id:{task_id} not found")
+        check_version(task, data.get("version"))
+        board = self.board_db.get(task["board_id"])
+        if board is not None and board["status"] == "CLOSED":
+            raise ValueError(f"Board id:{task['board_id']} is closed")
+
+        previous[task_id] = task["status"]
+        task["status"] = updated_status
+        return task
+
+    # undoes status changes whose board couldn't be bumped: a closed board had every task COMPLETE when it
+    # closed, on one that kept changing the task gets its previous status back. Tasks changed again since are
+    # left to the later writer
+    def _revert_statuses(self, tasks: List[Dict[str, Any]], previous: Dict[str, str],
+                         failed: Dict[str, ValueError]) -> None:
+        self.task_db.compare_and_put({
+            task["id"]: dict(task, status=previous[task["id"]]
+                             if isinstance(failed[task["board_id"]], VersionConflict) else "COMPLETE")
+            for task in tasks
+        })
+
+    # status changes are compare-and-set on the task record: no lock, so updates to different tasks run
+    # in parallel, and concurrent updates to one task (from any worker process) are retried, never lost
+    def update_task_status_dict(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        previous: Dict[str, str] = {}
+        task = cas_update(self.task_db, lambda: self._set_task_status(data, previous))
+        failed = self._bump_versions([task["board_id"]])
+        if failed:
+            self._revert_statuses([task], previous, failed)
+            raise failed[task["board_id"]]
+        return {"id": task["id"], "status": task["status"], "version": task["version"]}
+
+    def update_task_statuses_dict(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        # every item is checked on its own, its status too; the valid ones are stored in one write per round.
+        # A task listed again fails that item: only its first status is applied
+        updates = data.get("updates", [])
+        items: Dict[str, Dict[str, Any]] = {}
+        for item in updates:
+            items.setdefault(item.get("id"), item)
+        previous: Dict[str, str] = {}
+        stored = cas_update_many(self.task_db, lambda task_id: self._set_task_status(items[task_id], previous), items)
+        changed = [task for task in stored.values() if not isinstance(task, ValueError)]
+        failed = self._bump_versions(task["board_id"] for task in changed)
+        if failed:
+            undone = [task for task in changed if task["board_id"] in failed]
+            self._revert_statuses(undone, previous, failed)
+            stored.update((task["id"], failed[task["board_id"]]) for task in undone)
+        results = []
+        for item in updates:
+            task_id = item.get("id")
+            task = stored[task_id]
+            if items[task_id] is not item:
+                results.append({"id": task_id, "status": None, "error": f"Task id:{task_id} is listed more than once"})
+            elif isinstance(task, ValueError):
+                results.append({"id": task_id, "status": None, "error": str(task)})
+            else:
+                results.append({"id": task["id"], "status": task["status"], "error": None})
+        return {"results": results}
+
+    @staticmethod
+    def _list_item(board: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "id": board["id"],
+            "name": board["name"],
+            "team_id": board["team_id"],
+            "creation_time": board["creation_time"],
+            "status": board["status"],
+            "end_time": board["end_time"],
+            "version": board.get("version", 0)
+        }
 
-        tasks[task_id]["status"] = updated_status
-        self.task_db.write(tasks)
-        return json.dumps({"id": task_id, "status": tasks[task_id]["status"]})
+    def list_all_boards_dict(self) -> List[Dict[str, Any]]:
+        return [self._list_item(board) for board in self.board_db.values()]
 
-    def list_all_boards(self) -> str:
-        boards = self.board_db.read()
-        all_boards = [
-            {
-                "id": board["id"],
-                "name": board["name"],
-                "team_id": board["team_id"],
-                "creation_time": board["creation_time"],
-                "status": board["status"],
-                "end_time": board["end_time"]
-            }
-            for board in boards.values()
-        ]
+    def list_all_boards_page(self, cursor: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE) -> Dict[str, Any]:
+        boards, next_cursor = paginate(self.board_db, cursor, limit)
+        return {"items": [self._list_item(board) for board in boards], "next_cursor": next_cursor}
 
-        return json.dumps(all_boards, indent=4)
+    def iter_all_boards(self) -> Iterator[Dict[str, Any]]:
+        # list_all_boards_dict() one board at a time, in id order
+        return (self._list_item(board) for board in iterate(self.board_db))
 
-    def list_boards(self, request: str) -> str:
-        team_id = json.loads(request).get("id")
+    def list_boards_dict(self, data: Dict[str, Any]) -> List[Dict[str, Any]]:
+        team_id = data.get("id")
         if not team_id:
             raise ValueError("Team id is required")
 
-        boards = self.board_db.read()
         team_open_boards = [
             {
-                "id": board["id"], "name": board["name"]
+                "id": board["id"], "name": board["name"], "version": board.get("version", 0)
             }
-            for board in boards.values()
-            if board["team_id"] == team_id and board["status"] == 'OPEN'
+            for board in self.board_db.find(team_id=team_id)
+            if board["status"] == 'OPEN'
         ]
 
-        return json.dumps(team_open_boards, indent=4)
+        return team_open_boards
+
+    @staticmethod
+    def _task_item(task: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "id": task["id"],
+            "title": task["title"],
+            "description": task["description"],
+            "board_id": task["board_id"],
+            "user_id": task["user_id"],
+            "creation_time": task["creation_time"],
+            "status": task["status"],
+            "version": task.get("version", 0)
+        }
 
-    def export_board(self, request: str) -> str:
-        board_id = json.loads(request).get("id")
+    # the equality filters of a task query, answered by the task indexes, and the creation_time range,
+    # checked record by record
+    @staticmethod
+    def _task_query(data: Dict[str, Any]) -> Tuple[Dict[str, Any], Callable[[Dict[str, Any]], bool]]:
+        filters = {field: data[field] for field in ("board_id", "user_id", "status") if data.get(field) is not None}
+        if not filters:
+            raise ValueError("At least one of board_id, user_id and status is required")
+        # from is inclusive, to exclusive; ISO timestamps compare as strings
+        start = data.get("creation_time_from")
+        end = data.get("creation_time_to")
+
+        def in_range(task: Dict[str, Any]) -> bool:
+            return ((start is None or (task["creation_time"] or "") >= start)
+                    and (end is None or (task["creation_time"] or "") < end))
+        return filters, in_range
+
+    def list_tasks_dict(self, data: Dict[str, Any]) -> List[Dict[str, Any]]:
+        filters, in_range = self._task_query(data)
+        tasks = [task for task in self.task_db.find(**filters) if in_range(task)]
+        return [self._task_item(task) for task in sorted(tasks, key=lambda task: task["id"])]
+
+    def list_tasks_page(self, data: Dict[str, Any], cursor: Optional[str] = None,
+                        limit: int = DEFAULT_PAGE_SIZE) -> Dict[str, Any]:
+        # walks the index in id order from the cursor instead of loading every matching task
+        filters, in_range = self._task_query(data)
+        tasks, next_cursor = paginate_find(self.task_db, cursor, limit, filters, in_range)
+        return {"items": [self._task_item(task) for task in tasks], "next_cursor": next_cursor}
+
+    def stats_dict(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Dashboard counters for the given boards, teams and users. Each one is the size of an index bucket
+        (tasks per board and status, boards per team and status, tasks per user and status).
+        On FileDB that size is kept up to date by every create_board, close_board, add_task and
+        update_task_status, so nothing here depends on how many records the collections hold.
+        On SQLite each counter is a COUNT(*) over its index range: no table scan, but O(bucket size),
+        e.g. a board with 100k tasks walks 100k index entries per status asked for.
+        """
+        boards = {
+            board_id: {status: self.task_db.count(board_id=board_id, status=status) for status in TASK_STATUSES}
+            for board_id in data.get("board_ids") or []
+        }
+        teams = {
+            team_id: {
+                "open_boards": self.board_db.count(team_id=team_id, status="OPEN"),
+                "closed_boards": self.board_db.count(team_id=team_id, status="CLOSED")
+            }
+            for team_id in data.get("team_ids") or []
+        }
+        # a task is open until it is COMPLETE
+        users = {
+            user_id: {
+                "open_tasks": self.task_db.count(user_id=user_id, status="OPEN")
+                + self.task_db.count(user_id=user_id, status="IN_PROGRESS")
+            }
+            for user_id in data.get("user_ids") or []
+        }
+        return {"boards": boards, "teams": teams, "users": users}
+
+    def _get_board(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        board_id = data.get("id")
         if not board_id:
             raise ValueError("Board id is required")
 
-        boards = self.board_db.read()
-        tasks = self.task_db.read()
-
-        if board_id not in boards:
+        board = self.board_db.get(board_id)
+        if board is None:
             raise ValueError(f"Board id:{board_id} not found")
+        return board
 
-        board = boards[board_id]
-        board_tasks = [task for task in tasks.values() if task["board_id"] == board_id]
-
+    def _write_export(self, board: Dict[str, Any], board_tasks: List[Dict[str, Any]],
+                      progress: Optional[Progress] = None) -> str:
         # Generating output file
-        os.makedirs("out", exist_ok=True)
-        output_file = f"out/{board_id}_{board['name'].replace(' ', '_')}.txt"
-
-        with open(output_file, 'w') as file:
-            file.write(f"Project Board: {board['name']}\n")
-            file.write(f"Description: {board['description']}\n")
-            file.write(f"Team ID: {board['team_id']}\n")
-            file.write(f"Status: {board['status']}\n")
-            file.write(f"Created: {board['creation_time']}\n")
-            file.write(f"Closed: {board.get('end_time', 'N/A')}\n")
-            file.write("\nTasks:\n")
-            for t in board_tasks:
-                file.write(f"  - {t['title']} [{t['status']}]\n")
-                file.write(f"    Assigned to: {t['user_id']}\n")
-                file.write(f"    Created: {t['creation_time']}\n")
-                file.write(f"    Description: {t['description']}\n\n")
-
-
-        return json.dumps({"out_file": output_file})
+        os.makedirs(self.exports.directory, exist_ok=True)
+        output_file = self.exports.path_for(board)
+
+        # written under a private name and renamed, so a finished export never shows a half-written file
+        tmp_file = f"{output_file}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(tmp_file, 'w', buffering=EXPORT_BUFFER_SIZE) as file:
+                file.write(
+                    f"Project Board: {board['name']}\n"
+                    f"Description: {board['description']}\n"
+                    f"Team ID: {board['team_id']}\n"
+                    f"Status: {board['status']}\n"
+                    f"Created: {board['creation_time']}\n"
+                    f"Closed: {board.get('end_time', 'N/A')}\n"
+                    "\nTasks:\n"
+                )
+                for done, t in enumerate(board_tasks, 1):
+                    file.write(
+                        f"  - {t['title']} [{t['status']}]\n"
+                        f"    Assigned to: {t['user_id']}\n"
+                        f"    Created: {t['creation_time']}\n"
+                        f"    Description: {t['description']}\n\n"
+                    )
+                    if progress is not None and done % 1000 == 0:
+                        progress(done, len(board_tasks))
+            os.replace(tmp_file, output_file)
+        except Exception:
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+            raise
+
+        self.exports.add(board, output_file)
+        return output_file
+
+    def _export_work(self, board: Dict[str, Any]) -> Callable[[Optional[Progress]], str]:
+        # an artifact for the board's current version is reused as is
+        cached = self.exports.lookup(board)
+        if cached is not None:
+            return lambda progress=None: cached
+        # the board is read before its tasks, so the snapshot is never older than the version it is filed under
+        board_tasks = self.task_db.find(board_id=board["id"])
+        return lambda progress=None: self._write_export(board, board_tasks, progress)
+
+    def export_board_dict(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        work = self._export_work(self._get_board(data))
+        return {"out_file": work()}
+
+    def start_export_dict(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        # the board is checked and its tasks snapshotted now, the file is written on the export pool
+        board = self._get_board(data)
+        work = self._export_work(board)
+        return self.export_jobs.submit(
+            lambda progress: {"out_file": work(progress)},
+            board_id=board["id"], out_file=None
+        )
+
+    def export_status_dict(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        job_id = data.get("job_id")
+        if not job_id:
+            raise ValueError("Job id is required")
+        return self.export_jobs.status(job_id)
+
+    # ProjectBoardBase interface: JSON string wrappers around the typed API above
+
+    def create_board(self, request: str) -> str:
+        return json.dumps(self.create_board_dict(json.loads(request)))
+
+    def close_board(self, request: str) -> str:
+        return json.dumps(self.close_board_dict(json.loads(request)))
+
+    def add_task(self, request: str) -> str:
+        return json.dumps(self.add_task_dict(json.loads(request)))
+
+    def update_task_status(self, request: str) -> str:
+        return json.dumps(self.update_task_status_dict(json.loads(request)))
+
+    def list_all_boards(self) -> str:
+        return json.dumps(self.list_all_boards_dict(), indent=4)
+
+    def list_boards(self, request: str) -> str:
+        return json.dumps(self.list_boards_dict(json.loads(request)), indent=4)
+
+    def export_board(self, request: str) -> str:
+        return json.dumps(self.export_board_dict(json.loads(request)))
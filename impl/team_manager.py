@@ -1,14 +1,31 @@
 import json
 import uuid
 import datetime
+import threading
+from typing import Dict, Any, List, Optional
 
 from abstract_classes.team_base import TeamBase
-from utils.file_db import FileDB
+from utils.storage import open_storage, USER_INDEXES, TEAM_INDEXES
+from utils.concurrency import synchronized, cas_update, check_version
+from utils.pagination import paginate, paginate_ids, DEFAULT_PAGE_SIZE
+from utils.response_cache import CachedCollections, ResponseCache
+
+class TeamManager(CachedCollections, TeamBase):
+    def __init__(self, team_db_path="db/teams.json", user_db_path="db/users.json", backend=None,
+                 cache: Optional[ResponseCache] = None):
+        self.team_db = open_storage(team_db_path, TEAM_INDEXES, backend)
+        self.user_db = open_storage(user_db_path, USER_INDEXES, backend)
+        # one instance serves every request, writes go through this lock
+        self._lock = threading.RLock()
+        # encoded responses of the read endpoints, shared with the other managers
+        self.cache = cache or ResponseCache()
+        self._collections = {"teams": self.team_db, "users": self.user_db}
+        self._written = "teams"
+
+    def close(self) -> None:
+        self.team_db.close()
+        self.user_db.close()
 
-class TeamManager(TeamBase):
-    def __init__(self, team_db_path="db/teams.json", user_db_path="db/users.json"):
-        self.team_db = FileDB(team_db_path)
-        self.user_db = FileDB(user_db_path)
     # TODO: Extract validate_name and validate_description to utils
     def _validate_name(self, name: str, max_len: int):
         if not name or len(name) > max_len:
@@ -21,25 +38,22 @@ class TeamManager(TeamBase):
 
 
 
-    def create_team(self, request: str) -> str:
-        data = json.loads(request)
+    @synchronized
+    def create_team_dict(self, data: Dict[str, Any]) -> Dict[str, Any]:
         name = data.get("name")
         description = data.get("description", "")
         admin_id = data.get("admin")    # user id
 
-        teams = self.team_db.read()
-        users = self.user_db.read()
-
         # enforce constraints
         self._validate_name(name, 64)
         self._validate_description(description, 128)
 
         # Team name must be unique
-        if any(team["name"] == name for team in teams.values()):
+        if self.team_db.find(name=name):
             raise ValueError(f"Team with name '{name}' already exists")
 
         # Team Admin must be a existing user
-        if admin_id not in users:
+        if admin_id not in self.user_db:
             raise ValueError(f"Admin user with id: [{admin_id}] does not exist")
 
         team_id = str(uuid.uuid4())
@@ -49,141 +63,185 @@ class TeamManager(TeamBase):
             "description": description,
             "admin": admin_id,
             "users": [admin_id],    # admin always first member of team
-            "creation_time": datetime.datetime.now().isoformat()
+            "creation_time": datetime.datetime.now().isoformat(),
+            # bumped by every update, see cas_update()
+            "version": 0
         }
 
-        teams[team_id] = team
-        self.team_db.write(teams)
+        self._sync()
+        self.team_db.put(team_id, team)
+        self._invalidate("team_list", f"user_teams:{admin_id}")
 
-        return json.dumps({"id": team_id})
+        return {"id": team_id}
 
-    def list_teams(self) -> str:
-        teams = self.team_db.read()
-        result = [{
+    @staticmethod
+    def _list_item(team: Dict[str, Any]) -> Dict[str, Any]:
+        return {
             "name": team["name"],
             "description": team["description"],
             "admin": team["admin"],
             "creation_time": team["creation_time"]
-        } for team in teams.values()]
-        return json.dumps(result)
+        }
 
-    def describe_team(self, request: str) -> str:
-        data = json.loads(request)
+    def list_teams_dict(self) -> List[Dict[str, Any]]:
+        return [self._list_item(team) for team in self.team_db.values()]
+
+    def list_teams_page(self, cursor: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE) -> Dict[str, Any]:
+        teams, next_cursor = paginate(self.team_db, cursor, limit)
+        return {"items": [self._list_item(team) for team in teams], "next_cursor": next_cursor}
+
+    def describe_team_dict(self, data: Dict[str, Any]) -> Dict[str, Any]:
         team_id = data.get("id")
         if not team_id:
             raise ValueError("Team id is required")
 
-        teams = self.team_db.read()
-        if team_id not in teams:
+        team = self.team_db.get(team_id)
+        if team is None:
             raise ValueError(f"Team with id:{team_id} does not exist")
 
-        team = teams[team_id]
-        return json.dumps({
+        return {
             "name": team["name"],
             "description": team["description"],
             "admin": team["admin"],
-            "creation_time": team["creation_time"]
-        })
+            "creation_time": team["creation_time"],
+            "version": team.get("version", 0)
+        }
 
-    def update_team(self, request: str) -> str:
-        data = json.loads(request)
+    # the team to update, at the version the client expects if it sent one
+    def _team_for_update(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        team = self._get_team(data)
+        check_version(team, data.get("version"))
+        return team
+
+    # still under the manager lock, for the name uniqueness check
+    @synchronized
+    def update_team_dict(self, data: Dict[str, Any]) -> Dict[str, Any]:
         team_id = data.get("id")
         updated_data = data.get("team", {})
-        teams = self.team_db.read()
 
-        if not team_id:
-            raise ValueError("Team id is required")
-        if team_id not in teams:
-            raise ValueError(f"Team with id:{team_id} not found")
-
-        # enforce constraints
+        # validate once, the checks below depend on other records and are repeated on every attempt
         if "name" in updated_data:
             self._validate_name(updated_data["name"], 64)
-            if any(team["name"] == updated_data["name"] and tid != team_id for tid, team in teams.items()):
-                raise ValueError("Team name must be unique")
-            teams[team_id]["name"] = updated_data["name"]
-
         if "description" in updated_data:
             self._validate_description(updated_data["description"], 128)
-            teams[team_id]["description"] = updated_data["description"]
-
-        if "admin" in updated_data:
-            users = self.user_db.read()
-            if updated_data["admin"] not in users:
-                raise ValueError(f"Admin user with id:{updated_data['admin']} not found")
-            teams[team_id]["admin"] = updated_data["admin"]
-
-            # making sure new admin is part of team
-            if updated_data["admin"] not in teams[team_id]["users"]:
-                teams[team_id]["users"].append(updated_data["admin"])
 
-        self.team_db.write(teams)
-        return json.dumps({"status": "success"})
-
-    def add_users_to_team(self, request: str) -> str:
-        data = json.loads(request)
+        def update() -> Dict[str, Any]:
+            team = self._team_for_update(data)
+
+            # enforce constraints
+            if "name" in updated_data:
+                if any(t["id"] != team_id for t in self.team_db.find(name=updated_data["name"])):
+                    raise ValueError("Team name must be unique")
+                team["name"] = updated_data["name"]
+
+            if "description" in updated_data:
+                team["description"] = updated_data["description"]
+
+            if "admin" in updated_data:
+                if updated_data["admin"] not in self.user_db:
+                    raise ValueError(f"Admin user with id:{updated_data['admin']} not found")
+                team["admin"] = updated_data["admin"]
+
+                # making sure new admin is part of team
+                if updated_data["admin"] not in team["users"]:
+                    team["users"].append(updated_data["admin"])
+            return team
+
+        self._sync()
+        team = cas_update(self.team_db, update)
+        # name and description show in every member's team list
+        self._invalidate("team_list", f"team:{team_id}", f"team_users:{team_id}",
+                         *(f"user_teams:{uid}" for uid in team["users"]))
+        return {"status": "success", "version": team["version"]}
+
+    # membership changes are compare-and-set on the team record: no lock, so changes to different teams
+    # run in parallel, and concurrent changes to one team (from any worker process) are retried, never lost
+    def add_users_to_team_dict(self, data: Dict[str, Any]) -> Dict[str, Any]:
         team_id = data.get("id")
         new_users = data.get("users", [])
-        teams = self.team_db.read()
-
-        if not team_id:
-            raise ValueError("Team id is required")
-
-        if team_id not in teams:
-            raise ValueError(f"Team with id:{team_id} not found")
 
-        users = self.user_db.read()
         for uid in new_users:
-            if uid not in users:
+            if uid not in self.user_db:
                 raise ValueError(f"User id:[{uid}] not found")
 
-        team = teams[team_id]
+        def update() -> Dict[str, Any]:
+            team = self._team_for_update(data)
+            combined_users = list(set(team["users"] + new_users))
+            if len(combined_users) > 50:
+                raise ValueError("Team cannot have more than 50 users")
+            team["users"] = combined_users
+            return team
+
+        self._sync()
+        team = cas_update(self.team_db, update)
+        # the version is part of describe_team
+        self._invalidate(f"team:{team_id}", f"team_users:{team_id}", *(f"user_teams:{uid}" for uid in new_users))
+        return {"status": "success", "users": list(team["users"]), "version": team["version"]}
+
+    def remove_users_from_team_dict(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        remove_users = data.get("users", [])
+        team_id = data.get("id")
 
-        combined_users = list(set(team["users"] + new_users))
-        if len(combined_users) > 50:
-            raise ValueError("Team cannot have more than 50 users")
+        def update() -> Dict[str, Any]:
+            team = self._team_for_update(data)
+            # update the users list
+            team["users"] = [user for user in team["users"] if user not in remove_users]
+            return team
 
-        teams[team_id]["users"] = combined_users
-        self.team_db.write(teams)
-        return json.dumps({"status": "success", "users": team["users"]})
+        self._sync()
+        team = cas_update(self.team_db, update)
+        self._invalidate(f"team:{team_id}", f"team_users:{team_id}", *(f"user_teams:{uid}" for uid in remove_users))
+        return {"status": "success", "users": list(team["users"]), "version": team["version"]}
 
-    def remove_users_from_team(self, request: str) -> str:
-        data = json.loads(request)
-        remove_users = data.get("users", [])
+    def _get_team(self, data: Dict[str, Any]) -> Dict[str, Any]:
         team_id = data.get("id")
+
         if not team_id:
             raise ValueError("Team id is required")
 
-        teams = self.team_db.read()
-        if team_id not in teams:
+        team = self.team_db.get(team_id)
+        if team is None:
             raise ValueError(f"Team with id:{team_id} not found")
+        return team
 
+    def _members(self, user_ids: List[str]) -> List[Dict[str, Any]]:
+        members = [self.user_db.get(uid) for uid in user_ids]
+        return [
+            {
+                "id": user["id"],
+                "name": user["name"],
+                "display_name": user["display_name"]
+            } for user in members if user is not None
+        ]
 
-        # update the users list
-        teams[team_id]["users"] = [user for user in teams[team_id]["users"] if user not in remove_users]
+    def list_team_users_dict(self, data: Dict[str, Any]) -> List[Dict[str, Any]]:
+        # user_ids stored in team['users']
+        return self._members(self._get_team(data)["users"])
 
-        self.team_db.write(teams)
-        return json.dumps({"status": "success", "users": teams[team_id]["users"]})
+    def list_team_users_page(self, data: Dict[str, Any], cursor: Optional[str] = None,
+                             limit: int = DEFAULT_PAGE_SIZE) -> Dict[str, Any]:
+        user_ids, next_cursor = paginate_ids(self._get_team(data)["users"], cursor, limit)
+        return {"items": self._members(user_ids), "next_cursor": next_cursor}
 
-    def list_team_users(self, request: str) -> str:
-        data = json.loads(request)
-        team_id = data.get("id")
+    # TeamBase interface: JSON string wrappers around the typed API above
 
-        if not team_id:
-            raise ValueError("Team id is required")
+    def create_team(self, request: str) -> str:
+        return json.dumps(self.create_team_dict(json.loads(request)))
 
-        teams = self.team_db.read()
-        if team_id not in teams:
-            raise ValueError(f"Team with id:{team_id} not found")
+    def list_teams(self) -> str:
+        return json.dumps(self.list_teams_dict())
 
-        team = teams[team_id]
-        users = self.user_db.read()
-        results = [
-            {
-                "id": uid,
-                "name": users[uid]["name"],
-                "display_name": users[uid]["display_name"]
-            } for uid in team["users"] if uid in users  # user_ids stored in team['users']
-        ]
+    def describe_team(self, request: str) -> str:
+        return json.dumps(self.describe_team_dict(json.loads(request)))
+
+    def update_team(self, request: str) -> str:
+        return json.dumps(self.update_team_dict(json.loads(request)))
+
+    def add_users_to_team(self, request: str) -> str:
+        return json.dumps(self.add_users_to_team_dict(json.loads(request)))
 
-        return json.dumps(results)
+    def remove_users_from_team(self, request: str) -> str:
+        return json.dumps(self.remove_users_from_team_dict(json.loads(request)))
+
+    def list_team_users(self, request: str) -> str:
+        return json.dumps(self.list_team_users_dict(json.loads(request)))
@@ -1,21 +1,37 @@
 import json
 import uuid
 import datetime
+import threading
+from typing import Dict, Any, Iterator, List, Optional, Set
 
 from abstract_classes.user_base import UserBase
-from utils.file_db import FileDB
-
-class UserManager(UserBase):
-    def __init__(self, user_db_path='db/users.json', team_db_path='db/teams.json'):
-        self.db = FileDB(user_db_path)
-        self.team_db = FileDB(team_db_path)
+from utils.storage import open_storage, USER_INDEXES, TEAM_INDEXES
+from utils.concurrency import synchronized, cas_update, check_version
+from utils.pagination import iterate, paginate, DEFAULT_PAGE_SIZE
+from utils.response_cache import CachedCollections, ResponseCache
+
+class UserManager(CachedCollections, UserBase):
+    def __init__(self, user_db_path='db/users.json', team_db_path='db/teams.json', backend=None,
+                 cache: Optional[ResponseCache] = None):
+        self.db = open_storage(user_db_path, USER_INDEXES, backend)
+        self.team_db = open_storage(team_db_path, TEAM_INDEXES, backend)
+        # one instance serves every request, writes go through this lock
+        self._lock = threading.RLock()
+        # encoded responses of the read endpoints, shared with the other managers
+        self.cache = cache or ResponseCache()
+        self._collections = {"users": self.db, "teams": self.team_db}
+        self._written = "users"
+
+    def close(self) -> None:
+        self.db.close()
+        self.team_db.close()
 
     def _validate_name(self, name: str, max_len: int):
         if not name or len(name) > max_len:
             raise ValueError(f"Name must be 1-{max_len} characters\nGiven name length: {len(name)}")
 
-    def create_user(self, request: str) -> str:
-        data = json.loads(request)
+    # validated new user record; `pending_names` are taken by users of the same batch not stored yet
+    def _new_user(self, data: Dict[str, Any], pending_names: Set[str]) -> Dict[str, Any]:
         name = data.get("name")
         display_name = data.get("display_name")
 
@@ -23,92 +39,143 @@ class UserManager(UserBase):
         self._validate_name(name, 64)
         self._validate_name(display_name, 64)
 
-        users = self.db.read()
-
         # username must be unique
-        if any(user["name"] == name for user in users.values()):
+        if name in pending_names or self.db.find(name=name):
             raise ValueError(f"username <{name}> already exists")
 
-        user_id = str(uuid.uuid4())
-        user = {
-            "id": user_id,
+        return {
+            "id": str(uuid.uuid4()),
             "name": name,
             "display_name": display_name,
             "description": f"User {display_name}",
-            "creation_time": datetime.datetime.now().isoformat()
+            "creation_time": datetime.datetime.now().isoformat(),
+            # bumped by every update, see cas_update()
+            "version": 0
         }
-        users[user_id] = user
-        self.db.write(users)
 
-        return json.dumps({"id": user_id})
+    @synchronized
+    def create_user_dict(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        user = self._new_user(data, set())
+        self._sync()
+        self.db.put(user["id"], user)
+        self._invalidate()
+
+        return {"id": user["id"]}
+
+    @synchronized
+    def create_users_dict(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        # every item is checked on its own; the valid ones are stored in one write
+        users: Dict[str, Dict[str, Any]] = {}
+        names: Set[str] = set()
+        results = []
+        for item in data.get("users", []):
+            try:
+                user = self._new_user(item, names)
+            except ValueError as exc:
+                results.append({"id": None, "error": str(exc)})
+                continue
+            users[user["id"]] = user
+            names.add(user["name"])
+            results.append({"id": user["id"], "error": None})
+        self._sync()
+        self.db.put_many(users)
+        self._invalidate()
+
+        return {"results": results}
+
+    @staticmethod
+    def _list_item(user: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "name": user["name"],
+            "display_name": user["display_name"],
+            "creation_time": user["creation_time"]
+        }
 
-    def list_users(self) -> str:
-        users = self.db.read()
-        results = [
-            {
-                "name": user["name"],
-                "display_name": user["display_name"],
-                "creation_time": user["creation_time"]
-            } for user in users.values()
-        ]
-        return json.dumps(results)
+    def list_users_dict(self) -> List[Dict[str, Any]]:
+        return [self._list_item(user) for user in self.db.values()]
+
+    def list_users_page(self, cursor: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE) -> Dict[str, Any]:
+        users, next_cursor = paginate(self.db, cursor, limit)
+        return {"items": [self._list_item(user) for user in users], "next_cursor": next_cursor}
+
+    def iter_users(self) -> Iterator[Dict[str, Any]]:
+        # list_users_dict() one user at a time, in id order
+        return (self._list_item(user) for user in iterate(self.db))
 
 
     # TODO: Check this param name mismatch
-    def describe_user(self, request: str) -> str:
-        data = json.loads(request)
+    def describe_user_dict(self, data: Dict[str, Any]) -> Dict[str, Any]:
         user_id = data.get("id")
         if not user_id:
             raise ValueError("<user_id> is required")
 
-        users = self.db.read()
-        if user_id not in users:
+        user = self.db.get(user_id)
+        if user is None:
             raise ValueError(f"User with id:{user_id} not found")
 
-        user = users[user_id]
-        return json.dumps({
+        return {
             "name": user['name'],
             "description": user['description'],
-            "creation_time": user['creation_time']
-        })
+            "creation_time": user['creation_time'],
+            "version": user.get('version', 0)
+        }
 
-    def update_user(self, request: str) -> str:
-        data = json.loads(request)
+    def update_user_dict(self, data: Dict[str, Any]) -> Dict[str, Any]:
         user_id = data.get("id")
         updated_data = data.get("user", {})
         if not user_id:
             raise ValueError("<user_id> is required")
 
-        users = self.db.read()
-        if user_id not in users:
-            raise ValueError(f"User with id:{user_id} not found")
-
-        # Constraints check
-        if "name" in updated_data and updated_data["name"] != users[user_id]["name"]:
-            raise ValueError("username cannot be updated")
-        if "display_name" in updated_data:
-            self._validate_name(updated_data["display_name"], 128)
-            users[user_id]["display_name"] = updated_data["display_name"]
-
-        self.db.write(users)
-        return json.dumps({"status": "success"})
-
-    def get_user_teams(self, request: str) -> str:
-        data = json.loads(request)
+        def update() -> Dict[str, Any]:
+            user = self.db.get(user_id)
+            if user is None:
+                raise ValueError(f"User with id:{user_id} not found")
+            check_version(user, data.get("version"))
+
+            # Constraints check
+            if "name" in updated_data and updated_data["name"] != user["name"]:
+                raise ValueError("username cannot be updated")
+            if "display_name" in updated_data:
+                self._validate_name(updated_data["display_name"], 128)
+                user["display_name"] = updated_data["display_name"]
+            return user
+
+        self._sync()
+        user = cas_update(self.db, update)
+        # the display name shows in the member lists of the user's teams
+        self._invalidate(f"user:{user_id}")
+        return {"status": "success", "version": user["version"]}
+
+    def get_user_teams_dict(self, data: Dict[str, Any]) -> List[Dict[str, Any]]:
         user_id = data.get("id")
         if not user_id:
             raise ValueError("<user_id> is required")
 
-        users = self.db.read()
-        if user_id not in users:
+        if user_id not in self.db:
             raise ValueError(f"User with id:{user_id} not found")
 
-        teams = self.team_db.read()
         user_teams = [
             {
                 "name": team["name"],
                 "description": team["description"],
                 "creation_time": team["creation_time"]
-            } for team in teams.values() if user_id in team["users"]
+            } for team in self.team_db.find(users=user_id)
         ]
-        return json.dumps(user_teams)
+        return user_teams
+
+    # UserBase interface: JSON string wrappers around the typed API above
+
+    def create_user(self, request: str) -> str:
+        return json.dumps(self.create_user_dict(json.loads(request)))
+
+    def list_users(self) -> str:
+        return json.dumps(self.list_users_dict())
+
+    def describe_user(self, request: str) -> str:
+        return json.dumps(self.describe_user_dict(json.loads(request)))
+
+    def update_user(self, request: str) -> str:
+        return json.dumps(self.update_user_dict(json.loads(request)))
+
+    def get_user_teams(self, request: str) -> str:
+        return json.dumps(self.get_user_teams_dict(json.loads(request)))
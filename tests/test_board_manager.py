@@ -1,12 +1,19 @@
 import unittest
+import glob
 import json
 import os
 import datetime
+import multiprocessing
+from unittest import mock
 from impl.board_manager import BoardManager
 from impl.team_manager import TeamManager
 from impl.user_manager import UserManager
+from utils import file_db
+from utils.export_cache import ExportCache
 
 class TestBoardManager(unittest.TestCase):
+    backend = "json"
+
     @classmethod
     def setUpClass(cls):
         print("Setting up TestBoardManager Class...")
@@ -17,13 +24,14 @@ class TestBoardManager(unittest.TestCase):
 
         os.makedirs(os.path.dirname(cls.user_db_path), exist_ok=True)
 
-        cls.user_manager = UserManager(user_db_path=cls.user_db_path)
-        cls.team_manager = TeamManager(team_db_path=cls.team_db_path, user_db_path=cls.user_db_path)
+        cls.user_manager = UserManager(user_db_path=cls.user_db_path, team_db_path=cls.team_db_path, backend=cls.backend)
+        cls.team_manager = TeamManager(team_db_path=cls.team_db_path, user_db_path=cls.user_db_path, backend=cls.backend)
         cls.board_manager = BoardManager(
             boards_db_path=cls.board_db_path,
             tasks_db_path=cls.task_db_path,
             team_db_path=cls.team_db_path,
-            user_db_path=cls.user_db_path
+            user_db_path=cls.user_db_path,
+            backend=cls.backend
         )
 
     @classmethod
@@ -32,6 +40,9 @@ class TestBoardManager(unittest.TestCase):
         for path in [cls.user_db_path, cls.team_db_path, cls.board_db_path, cls.task_db_path]:
             if os.path.exists(path):
                 os.remove(path)
+        # leftovers of the journaled and sqlite storage modes, and the lock files
+        for path in glob.glob("tests/tmp/*.journal") + glob.glob("tests/tmp/*.lock") + glob.glob("tests/tmp/storage.sqlite3*"):
+            os.remove(path)
         if os.path.exists("tests/tmp"):
             os.rmdir("tests/tmp")
         if os.path.exists("out"):
@@ -41,9 +52,8 @@ class TestBoardManager(unittest.TestCase):
 
 
     def setUp(self):
-        for path in [self.user_db_path, self.team_db_path, self.board_db_path, self.task_db_path]:
-            with open(path, "w") as f:
-                json.dump({}, f)
+        for db in [self.board_manager.user_db, self.board_manager.team_db, self.board_manager.board_db, self.board_manager.task_db]:
+            db.write({})
 
         self.admin_user = json.loads(self.user_manager.create_user(json.dumps({"name": "admin", "display_name": "Admin User"})))
         self.team = json.loads(self.team_manager.create_team(json.dumps({"name": "Test Team", "description": "A test team", "admin": self.admin_user['id']})))
@@ -88,6 +98,98 @@ class TestBoardManager(unittest.TestCase):
 
         print("close_board OK")
 
+    def test_close_board_with_incomplete_tasks(self):
+        # Create a board with a task
+        board_request = json.dumps({
+            "name": "Test Board",
+            "description": "A test board",
+            "team_id": self.team['id'],
+            "creation_time": datetime.datetime.now().isoformat()
+        })
+        board = json.loads(self.board_manager.create_board(board_request))
+        task = json.loads(self.board_manager.add_task(json.dumps({
+            "board_id": board["id"],
+            "title": "Test Task",
+            "description": "A test task",
+            "user_id": self.admin_user["id"],
+            "creation_time": datetime.datetime.now().isoformat()
+        })))
+
+        # Boards can only be closed once every task is COMPLETE
+        close_request = json.dumps({"id": board["id"]})
+        with self.assertRaises(ValueError):
+            self.board_manager.close_board(close_request)
+
+        self.board_manager.update_task_status(json.dumps({"id": task["id"], "status": "IN_PROGRESS"}))
+        with self.assertRaises(ValueError):
+            self.board_manager.close_board(close_request)
+
+        self.board_manager.update_task_status(json.dumps({"id": task["id"], "status": "COMPLETE"}))
+        data = json.loads(self.board_manager.close_board(close_request))
+        self.assertIn("CLOSED", data["status"])
+
+        print("close_board_with_incomplete_tasks OK")
+
+    def test_close_board_racing_task_writes(self):
+        board = self.board_manager.create_board_dict({
+            "name": "Test Board", "description": "A test board", "team_id": self.team['id'],
+            "creation_time": datetime.datetime.now().isoformat()
+        })
+        task = self.board_manager.add_task_dict({
+            "board_id": board["id"], "title": "Done", "description": "", "user_id": None,
+            "creation_time": datetime.datetime.now().isoformat()
+        })
+        self.board_manager.update_task_status_dict({"id": task["id"], "status": "COMPLETE"})
+        board_db, task_db = self.board_manager.board_db, self.board_manager.task_db
+
+        def closed_after(method):
+            # the task write lands, then a close that counted the tasks before it wins its compare-and-set
+            calls = []
+            def write(*args):
+                result = method(*args)
+                if not calls:
+                    calls.append(args)
+                    stored = board_db.get(board["id"])
+                    board_db.compare_and_put({board["id"]: dict(stored, status="CLOSED")})
+                return result
+            return write
+
+        def reopen():
+            stored = board_db.get(board["id"])
+            board_db.compare_and_put({board["id"]: dict(stored, status="OPEN")})
+
+        # a task added meanwhile is removed again
+        with mock.patch.object(task_db, "put", closed_after(task_db.put)):
+            with self.assertRaises(ValueError):
+                self.board_manager.add_task_dict({
+                    "board_id": board["id"], "title": "Late", "description": "", "user_id": None,
+                    "creation_time": datetime.datetime.now().isoformat()
+                })
+        self.assertEqual([t["id"] for t in task_db.find(board_id=board["id"])], [task["id"]])
+
+        reopen()
+        with mock.patch.object(task_db, "put_many", closed_after(task_db.put_many)):
+            results = self.board_manager.add_tasks_dict({"tasks": [{
+                "board_id": board["id"], "title": "Late", "description": "", "user_id": None,
+                "creation_time": datetime.datetime.now().isoformat()
+            }]})["results"]
+        self.assertEqual(results[0]["id"], None)
+        self.assertEqual(task_db.count(board_id=board["id"]), 1)
+
+        # a task reopened meanwhile is set back to COMPLETE
+        reopen()
+        with mock.patch.object(task_db, "compare_and_put", closed_after(task_db.compare_and_put)):
+            with self.assertRaises(ValueError):
+                self.board_manager.update_task_status_dict({"id": task["id"], "status": "OPEN"})
+        self.assertEqual(task_db.get(task["id"])["status"], "COMPLETE")
+
+        # and once closed, task writes are refused up front
+        with self.assertRaises(ValueError):
+            self.board_manager.update_task_status_dict({"id": task["id"], "status": "OPEN"})
+        self.assertEqual(board_db.get(board["id"])["status"], "CLOSED")
+
+        print("close_board_racing_task_writes OK")
+
 
     def test_add_task(self):
         # Create a board
@@ -117,6 +219,40 @@ class TestBoardManager(unittest.TestCase):
 
         print("add_task OK")
 
+    def test_add_task_from_many_processes(self):
+        # worker processes on the same files: every task must survive the concurrent read-modify-writes
+        board = self.board_manager.create_board_dict({
+            "name": "Test Board", "description": "A test board", "team_id": self.team['id'],
+            "creation_time": datetime.datetime.now().isoformat()
+        })
+        paths = (self.board_db_path, self.task_db_path, self.team_db_path, self.user_db_path)
+        processes, per_process = 4, 25
+        # (journal, group commit ms): rewrites, appends, and rewrites deferred to a group commit
+        modes = [(False, 0), (True, 0), (False, 2)]
+        for journal, group_commit_ms in modes:
+            self.board_manager.task_db.write({})
+            context = multiprocessing.get_context("spawn")
+            workers = [
+                context.Process(target=_add_tasks,
+                                args=(self.backend, journal, group_commit_ms, paths, board["id"], n, per_process))
+                for n in range(processes)
+            ]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+            self.assertEqual([worker.exitcode for worker in workers], [0] * processes)
+
+            tasks = self.board_manager.task_db.find(board_id=board["id"])
+            expected = {f"worker{n} task{i}" for n in range(processes) for i in range(per_process)}
+            self.assertEqual(len(tasks), processes * per_process)
+            self.assertEqual({task["title"] for task in tasks}, expected)
+
+        # each task bumped the board's version once, through compare-and-set
+        self.assertEqual(self.board_manager.board_db.get(board["id"])["version"], len(modes) * processes * per_process)
+
+        print("add_task_from_many_processes OK")
+
 
     def test_update_task_status(self):
         # Create a board and a task
@@ -161,9 +297,139 @@ class TestBoardManager(unittest.TestCase):
         data = json.loads(response)
         self.assertEqual(len(data), 1)
         self.assertEqual(data[0]["name"], "Test Board")
+        self.assertEqual(data[0]["version"], 0)
 
         print("list_team_boards OK")
 
+    def test_list_tasks(self):
+        boards = [
+            self.board_manager.create_board_dict({
+                "name": f"Board {i}", "description": "A test board", "team_id": self.team['id'],
+                "creation_time": datetime.datetime.now().isoformat()
+            })["id"] for i in range(2)
+        ]
+        other_user = self.user_manager.create_user_dict({"name": "other", "display_name": "Other User"})["id"]
+        users = [self.admin_user["id"], other_user]
+        added = self.board_manager.add_tasks_dict({"tasks": [
+            {"board_id": boards[i % 2], "title": f"Task {i}", "description": "", "user_id": users[i // 4],
+             "creation_time": f"2024-01-0{i + 1}T00:00:00"}
+            for i in range(8)
+        ]})["results"]
+        ids = [r["id"] for r in added]
+        self.board_manager.update_task_statuses_dict({"updates": [{"id": ids[i], "status": "COMPLETE"} for i in (0, 1, 5)]})
+
+        def titles(**query):
+            return sorted(task["title"] for task in self.board_manager.list_tasks_dict(query))
+
+        self.assertEqual(titles(board_id=boards[0]), ["Task 0", "Task 2", "Task 4", "Task 6"])
+        self.assertEqual(titles(user_id=other_user), ["Task 4", "Task 5", "Task 6", "Task 7"])
+        self.assertEqual(titles(status="COMPLETE"), ["Task 0", "Task 1", "Task 5"])
+        self.assertEqual(titles(board_id=boards[1], user_id=other_user, status="OPEN"), ["Task 7"])
+        # from inclusive, to exclusive
+        self.assertEqual(
+            titles(board_id=boards[0], creation_time_from="2024-01-03T00:00:00", creation_time_to="2024-01-07T00:00:00"),
+            ["Task 2", "Task 4"]
+        )
+        with self.assertRaises(ValueError):
+            self.board_manager.list_tasks_dict({})
+
+        first = self.board_manager.list_tasks_page({"user_id": self.admin_user["id"]}, limit=3)
+        second = self.board_manager.list_tasks_page({"user_id": self.admin_user["id"]}, first["next_cursor"], limit=3)
+        self.assertEqual(len(first["items"]), 3)
+        self.assertIsNone(second["next_cursor"])
+        self.assertEqual([t["id"] for t in first["items"] + second["items"]], sorted(ids[:4]))
+
+        # one task a page, through a query no index matches exactly and a range, and a status change in between
+        def all_pages(query):
+            items, cursor = [], None
+            while True:
+                page = self.board_manager.list_tasks_page(query, cursor, limit=1)
+                items += [task["id"] for task in page["items"]]
+                cursor = page["next_cursor"]
+                if cursor is None:
+                    return items
+        query = {"board_id": boards[1], "status": "OPEN", "creation_time_from": "2024-01-04T00:00:00"}
+        self.assertEqual(all_pages(query), sorted([ids[3], ids[7]]))
+        self.board_manager.update_task_status_dict({"id": ids[3], "status": "COMPLETE"})
+        self.assertEqual(all_pages(query), [ids[7]])
+        self.assertEqual(all_pages({"board_id": boards[1], "user_id": other_user}), sorted([ids[5], ids[7]]))
+
+        print("list_tasks OK")
+
+
+    def test_stats(self):
+        boards = [
+            self.board_manager.create_board_dict({
+                "name": f"Board {i}", "description": "A test board", "team_id": self.team['id'],
+                "creation_time": datetime.datetime.now().isoformat()
+            })["id"] for i in range(2)
+        ]
+        added = self.board_manager.add_tasks_dict({"tasks": [
+            {"board_id": boards[i % 2], "title": f"Task {i}", "description": "", "user_id": self.admin_user["id"],
+             "creation_time": datetime.datetime.now().isoformat()}
+            for i in range(5)
+        ]})["results"]
+        ids = [r["id"] for r in added]
+        self.board_manager.update_task_status_dict({"id": ids[0], "status": "IN_PROGRESS"})
+        self.board_manager.update_task_statuses_dict({"updates": [{"id": ids[i], "status": "COMPLETE"} for i in (1, 3)]})
+        self.board_manager.close_board_dict({"id": boards[1]})
+
+        stats = self.board_manager.stats_dict({
+            "board_ids": boards, "team_ids": [self.team["id"], "missing"], "user_ids": [self.admin_user["id"]]
+        })
+        self.assertEqual(stats["boards"][boards[0]], {"OPEN": 2, "IN_PROGRESS": 1, "COMPLETE": 0})
+        self.assertEqual(stats["boards"][boards[1]], {"OPEN": 0, "IN_PROGRESS": 0, "COMPLETE": 2})
+        self.assertEqual(stats["teams"][self.team["id"]], {"open_boards": 1, "closed_boards": 1})
+        self.assertEqual(stats["teams"]["missing"], {"open_boards": 0, "closed_boards": 0})
+        self.assertEqual(stats["users"][self.admin_user["id"]], {"open_tasks": 3})
+
+        print("stats OK")
+
+
+    def test_bulk_tasks(self):
+        board = self.board_manager.create_board_dict({
+            "name": "Test Board",
+            "description": "A test board",
+            "team_id": self.team['id'],
+            "creation_time": datetime.datetime.now().isoformat()
+        })
+
+        def task(board_id, title):
+            return {"board_id": board_id, "title": title, "description": "A test task",
+                    "user_id": self.admin_user["id"], "creation_time": datetime.datetime.now().isoformat()}
+
+        added = self.board_manager.add_tasks_dict({"tasks": [
+            task(board["id"], "Task 1"),
+            task("missing", "Task 2"),
+            task(board["id"], "Task 1"),
+            task(board["id"], "Task 3"),
+        ]})["results"]
+        self.assertEqual([r["error"] is None for r in added], [True, False, False, True])
+        self.assertEqual(self.board_manager.task_db.count(board_id=board["id"]), 2)
+        # one version bump for the whole batch
+        self.assertEqual(self.board_manager.board_db.get(board["id"])["version"], 1)
+
+        updated = self.board_manager.update_task_statuses_dict({"updates": [
+            {"id": added[0]["id"], "status": "COMPLETE"},
+            {"id": "missing", "status": "COMPLETE"},
+            {"id": added[3]["id"], "status": "DONE"},
+        ]})["results"]
+        self.assertEqual([r["error"] is None for r in updated], [True, False, False])
+        self.assertIn("Invalid status <DONE>", updated[2]["error"])
+        self.assertEqual(self.board_manager.task_db.count(board_id=board["id"], status="COMPLETE"), 1)
+        self.assertEqual(self.board_manager.task_db.get(added[3]["id"])["status"], "OPEN")
+        self.assertEqual(self.board_manager.board_db.get(board["id"])["version"], 2)
+
+        # a task listed twice fails the repeat, the result reports the status stored
+        updated = self.board_manager.update_task_statuses_dict({"updates": [
+            {"id": added[3]["id"], "status": "IN_PROGRESS"},
+            {"id": added[3]["id"], "status": "COMPLETE"},
+        ]})["results"]
+        self.assertEqual([r["status"] for r in updated], ["IN_PROGRESS", None])
+        self.assertIn("listed more than once", updated[1]["error"])
+        self.assertEqual(self.board_manager.task_db.get(added[3]["id"])["status"], "IN_PROGRESS")
+
+        print("bulk_tasks OK")
 
     def test_export_board(self):
         # Create a board and a task
@@ -192,6 +458,119 @@ class TestBoardManager(unittest.TestCase):
 
         print("export_board OK")
 
+    def test_export_job(self):
+        board = self.board_manager.create_board_dict({
+            "name": "Test Board",
+            "description": "A test board",
+            "team_id": self.team['id'],
+            "creation_time": datetime.datetime.now().isoformat()
+        })
+        for i in range(3):
+            self.board_manager.add_task_dict({
+                "board_id": board["id"],
+                "title": f"Task {i}",
+                "description": "A test task",
+                "user_id": self.admin_user["id"],
+                "creation_time": datetime.datetime.now().isoformat()
+            })
+
+        # the job id comes back before the file is written
+        job = self.board_manager.start_export_dict({"id": board["id"]})
+        self.assertIn(job["status"], ["PENDING", "RUNNING", "DONE"])
+        self.board_manager.export_jobs.wait(job["job_id"], timeout=10)
+
+        status = self.board_manager.export_status_dict({"job_id": job["job_id"]})
+        self.assertEqual(status["status"], "DONE")
+        self.assertEqual(status["progress"], 1.0)
+        with open(status["out_file"]) as f:
+            self.assertEqual(f.read().count("Assigned to:"), 3)
+
+        # unknown boards fail before a job is queued
+        with self.assertRaises(ValueError):
+            self.board_manager.start_export_dict({"id": "missing"})
+        with self.assertRaises(ValueError):
+            self.board_manager.export_status_dict({"job_id": "missing"})
+
+        print("export_job OK")
+
+    def test_export_reuses_artifact(self):
+        board = self.board_manager.create_board_dict({
+            "name": "Test Board",
+            "description": "A test board",
+            "team_id": self.team['id'],
+            "creation_time": datetime.datetime.now().isoformat()
+        })
+        first = self.board_manager.export_board_dict({"id": board["id"]})["out_file"]
+        hits = self.board_manager.exports.cache_info()["hits"]
+
+        # an unchanged board is served from the existing file
+        self.assertEqual(self.board_manager.export_board_dict({"id": board["id"]})["out_file"], first)
+        self.assertEqual(self.board_manager.exports.cache_info()["hits"], hits + 1)
+
+        # every write bumps the version, the stale artifact is replaced
+        task = self.board_manager.add_task_dict({
+            "board_id": board["id"],
+            "title": "Test Task",
+            "description": "A test task",
+            "user_id": self.admin_user["id"],
+            "creation_time": datetime.datetime.now().isoformat()
+        })
+        second = self.board_manager.export_board_dict({"id": board["id"]})["out_file"]
+        self.assertNotEqual(second, first)
+        self.assertFalse(os.path.exists(first))
+
+        self.board_manager.update_task_status_dict({"id": task["id"], "status": "COMPLETE"})
+        third = self.board_manager.export_board_dict({"id": board["id"]})["out_file"]
+        with open(third) as f:
+            self.assertIn("[COMPLETE]", f.read())
+
+        self.board_manager.close_board_dict({"id": board["id"]})
+        self.assertNotEqual(self.board_manager.export_board_dict({"id": board["id"]})["out_file"], third)
+
+        print("export_reuses_artifact OK")
+
+    def test_export_cache_budget(self):
+        cache = ExportCache(directory="tests/tmp/out", budget=25)
+        os.makedirs(cache.directory, exist_ok=True)
+        paths = []
+        for board_id in ["a", "b", "c"]:
+            board = {"id": board_id, "name": "board", "version": 0}
+            path = cache.path_for(board)
+            with open(path, "w") as f:
+                f.write("x" * 10)
+            cache.add(board, path)
+            paths.append(path)
+            if board_id == "b":
+                # touching "a" makes "b" the least recently used
+                self.assertEqual(cache.lookup({"id": "a", "name": "board", "version": 0}), paths[0])
+
+        self.assertEqual([os.path.exists(p) for p in paths], [True, False, True])
+        self.assertEqual(cache.cache_info()["bytes"], 20)
+
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
+        os.rmdir(cache.directory)
+
+        print("export_cache_budget OK")
+
+
+def _add_tasks(backend, journal, group_commit_ms, paths, board_id, worker, count):
+    # runs in a separate process, like a uvicorn worker
+    file_db.JOURNAL_MODE = journal
+    file_db.GROUP_COMMIT_MS = group_commit_ms
+    board_manager = BoardManager(*paths, backend=backend)
+    for i in range(count):
+        board_manager.add_task_dict({
+            "board_id": board_id, "title": f"worker{worker} task{i}", "description": "",
+            "user_id": None, "creation_time": datetime.datetime.now().isoformat()
+        })
+    board_manager.close()
+
+
+class TestBoardManagerSqlite(TestBoardManager):
+    backend = "sqlite"
+
 
 if __name__ == '__main__':
     unittest.main()
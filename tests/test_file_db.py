@@ -0,0 +1,442 @@
+import unittest
+import json
+import os
+import threading
+from unittest import mock
+from utils import file_db, metrics
+from utils.file_db import FileDB
+from utils.pagination import paginate_find
+
+class TestFileDB(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        print("Setting up TestFileDB Class...")
+        cls.db_path = "tests/tmp/test_file_db.json"
+        os.makedirs(os.path.dirname(cls.db_path), exist_ok=True)
+
+    @classmethod
+    def tearDownClass(cls):
+        print("Tearing down TestFileDB Class...")
+        for path in [cls.db_path, cls.db_path + ".journal", cls.db_path + ".lock"]:
+            if os.path.exists(path):
+                os.remove(path)
+        if os.path.exists("tests/tmp") and not os.listdir("tests/tmp"):
+            os.rmdir("tests/tmp")
+
+    def setUp(self):
+        with open(self.db_path, "w") as f:
+            json.dump({}, f)
+        if os.path.exists(self.db_path + ".journal"):
+            os.remove(self.db_path + ".journal")
+        self.db = FileDB(self.db_path, journal=False, group_commit_ms=0)
+
+    def test_cache_hits(self):
+        self.db.put("a", {"id": "a", "name": "first"})
+        before = self.db.cache_info()
+
+        # repeated reads of an unchanged file are served from memory
+        for _ in range(3):
+            self.assertEqual(self.db.get("a")["name"], "first")
+        after = self.db.cache_info()
+        self.assertEqual(after["misses"], before["misses"])
+        self.assertEqual(after["hits"], before["hits"] + 3)
+
+        print("cache_hits OK")
+
+    def test_external_change_reloads(self):
+        self.db.put("a", {"id": "a", "name": "first"})
+        misses = self.db.cache_info()["misses"]
+
+        # another process rewrites the file behind our back
+        with open(self.db_path, "w") as f:
+            json.dump({"b": {"id": "b", "name": "second"}}, f)
+
+        self.assertNotIn("a", self.db)
+        self.assertEqual(self.db.get("b")["name"], "second")
+        self.assertEqual(self.db.cache_info()["misses"], misses + 1)
+
+        print("external_change_reloads OK")
+
+    def test_shared_between_instances(self):
+        other = FileDB(self.db_path)
+        self.db.put("a", {"id": "a", "name": "first"})
+        self.assertEqual(other.get("a")["name"], "first")
+
+        print("shared_between_instances OK")
+
+    def test_returned_records_are_copies(self):
+        self.db.put("a", {"id": "a", "users": ["u1"]})
+        record = self.db.get("a")
+        record["users"].append("u2")
+        data = self.db.read()
+        data["a"]["name"] = "changed"
+
+        self.assertEqual(self.db.get("a"), {"id": "a", "users": ["u1"]})
+
+        print("returned_records_are_copies OK")
+
+    def test_journal_appends(self):
+        db = FileDB(self.db_path, journal=True, compact_records=100)
+        db.put("a", {"id": "a", "status": "OPEN"})
+        snapshot_size = os.path.getsize(self.db_path)
+
+        db.put("a", {"id": "a", "status": "COMPLETE"})
+        db.put("b", {"id": "b", "status": "OPEN"})
+
+        # the snapshot is untouched, mutations only go to the journal
+        self.assertEqual(os.path.getsize(self.db_path), snapshot_size)
+        with open(self.db_path + ".journal") as f:
+            self.assertEqual(len(f.readlines()), 3)
+
+        # a fresh process replays the journal over the snapshot
+        file_db._entries.clear()
+        fresh = FileDB(self.db_path)
+        self.assertEqual(fresh.get("a")["status"], "COMPLETE")
+        self.assertIn("b", fresh)
+
+        print("journal_appends OK")
+
+    def test_journal_compaction(self):
+        db = FileDB(self.db_path, journal=True, compact_records=5)
+        for i in range(5):
+            db.put(str(i), {"id": str(i)})
+        db._entry.compactor.join()
+
+        with open(self.db_path) as f:
+            self.assertEqual(len(json.load(f)), 5)
+        self.assertEqual(os.path.getsize(self.db_path + ".journal"), 0)
+
+        # writes after compaction still land on top of the new snapshot
+        db.put("5", {"id": "5"})
+        file_db._entries.clear()
+        self.assertEqual(len(FileDB(self.db_path).values()), 6)
+
+        print("journal_compaction OK")
+
+    def test_delete_many(self):
+        db = FileDB(self.db_path, journal=False, group_commit_ms=0, indexes=[("team_id",)])
+        db.put_many({key: {"id": key, "team_id": "t1"} for key in ["a", "b", "c"]})
+        db.delete_many(["b", "missing"])
+        self.assertNotIn("b", db)
+        self.assertEqual([r["id"] for r in db.page(None, 10)], ["a", "c"])
+        self.assertEqual(db.count(team_id="t1"), 2)
+
+        # journaled, a delete is a record with a null value, dropped again on replay
+        db = FileDB(self.db_path, journal=True, compact_records=100, indexes=[("team_id",)])
+        db.delete_many(["a"])
+        file_db._entries.clear()
+        self.assertEqual([r["id"] for r in FileDB(self.db_path).values()], ["c"])
+
+        print("delete_many OK")
+
+    def test_atomic_write(self):
+        inode = os.stat(self.db_path).st_ino
+        self.db.put("a", {"id": "a"})
+
+        # the file is replaced, never truncated in place, and no temp files are left behind
+        self.assertNotEqual(os.stat(self.db_path).st_ino, inode)
+        leftovers = [f for f in os.listdir("tests/tmp") if f.startswith("test_file_db") and not f.endswith(".lock")]
+        self.assertEqual(leftovers, ["test_file_db.json"])
+
+        print("atomic_write OK")
+
+    def test_group_commit(self):
+        db = FileDB(self.db_path, journal=False, group_commit_ms=50)
+        start = threading.Barrier(10)
+
+        def writer(i):
+            start.wait()
+            db.put(str(i), {"id": str(i)})
+
+        with mock.patch.object(file_db, "_atomic_write", wraps=file_db._atomic_write) as atomic_write:
+            threads = [threading.Thread(target=writer, args=(i,)) for i in range(10)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+
+        # every put returned only after its data was on disk, with far fewer flushes than writes
+        with open(self.db_path) as f:
+            self.assertEqual(len(json.load(f)), 10)
+        self.assertLess(atomic_write.call_count, 10)
+
+        print("group_commit OK")
+
+    def test_group_commit_keeps_other_writes(self):
+        db = FileDB(self.db_path, journal=False, group_commit_ms=200)
+        writer = threading.Thread(target=db.put, args=("a", {"id": "a"}))
+        writer.start()
+        while not db._entry.dirty:
+            pass
+
+        # the file is replaced while "a" waits for its flush, by a writer that ignores the lock file
+        with open(self.db_path, "w") as f:
+            json.dump({"b": {"id": "b"}}, f)
+        self.assertIn("b", db)
+        self.assertIn("a", db)
+        writer.join()
+
+        # the flush kept the other write
+        with open(self.db_path) as f:
+            self.assertEqual(set(json.load(f)), {"a", "b"})
+
+        print("group_commit_keeps_other_writes OK")
+
+    def test_secondary_index(self):
+        db = FileDB(self.db_path, journal=False, group_commit_ms=0, indexes=[("team_id", "name")])
+        db.put("b1", {"id": "b1", "team_id": "t1", "name": "x"})
+        db.put("b2", {"id": "b2", "team_id": "t1", "name": "y"})
+        self.assertEqual([b["id"] for b in db.find(team_id="t1", name="x")], ["b1"])
+
+        # updates move the record between index entries
+        db.put("b1", {"id": "b1", "team_id": "t1", "name": "z"})
+        self.assertEqual(db.find(name="x", team_id="t1"), [])
+        self.assertEqual([b["id"] for b in db.find(team_id="t1", name="z")], ["b1"])
+        self.assertEqual(db._entry.indexes[("team_id", "name")][("t1", "z")], {"b1": None})
+
+        # the index is rebuilt when another process replaces the file
+        with open(self.db_path, "w") as f:
+            json.dump({"b3": {"id": "b3", "team_id": "t1", "name": "x"}}, f)
+        self.assertEqual([b["id"] for b in db.find(team_id="t1", name="x")], ["b3"])
+        self.assertEqual(db.find(team_id="t1", name="z"), [])
+
+        print("secondary_index OK")
+
+    def test_find_page(self):
+        db = FileDB(self.db_path, journal=False, group_commit_ms=0, indexes=[("team_id",)])
+        for key in ["d", "b", "a", "c"]:
+            db.put(key, {"id": key, "team_id": "t1", "name": key})
+        db.put("e", {"id": "e", "team_id": "t2", "name": "e"})
+
+        # pages in id order from the index bucket, whatever the insertion order was
+        self.assertEqual([r["id"] for r in db.find_page(None, 3, team_id="t1")], ["a", "b", "c"])
+        self.assertEqual([r["id"] for r in db.find_page("c", 3, team_id="t1")], ["d"])
+        # fields the index doesn't cover are checked record by record
+        self.assertEqual([r["id"] for r in db.find_page("a", 1, team_id="t1", name="d")], ["d"])
+
+        # the sorted bucket follows records moving in and out of it, and full reloads
+        db.put("b", {"id": "b", "team_id": "t2", "name": "b"})
+        db.put("aa", {"id": "aa", "team_id": "t1", "name": "aa"})
+        self.assertEqual([r["id"] for r in db.find_page(None, 10, team_id="t1")], ["a", "aa", "c", "d"])
+        with open(self.db_path, "w") as f:
+            json.dump({"z": {"id": "z", "team_id": "t1", "name": "z"}}, f)
+        self.assertEqual([r["id"] for r in db.find_page(None, 10, team_id="t1")], ["z"])
+
+        print("find_page OK")
+
+    def test_paginate_find_with_filter(self):
+        db = FileDB(self.db_path, journal=False, group_commit_ms=0, indexes=[("team_id",)])
+        db.put_many({f"{i:03}": {"id": f"{i:03}", "team_id": "t1", "n": i} for i in range(100)})
+
+        # a filter rejecting most of the bucket: one walk of it from the cursor, not a find_page() per page
+        def pages(where):
+            ids, cursor = [], None
+            while True:
+                records, cursor = paginate_find(db, cursor, 2, {"team_id": "t1"}, where)
+                ids += [record["id"] for record in records]
+                if cursor is None:
+                    return ids
+
+        with mock.patch.object(db, "_load", wraps=db._load) as load:
+            self.assertEqual(pages(lambda record: record["n"] % 30 == 7), ["007", "037", "067", "097"])
+        # one per page asked for
+        self.assertEqual(load.call_count, 2)
+        self.assertEqual(len(pages(None)), 100)
+
+        print("paginate_find_with_filter OK")
+
+    def test_page(self):
+        for key in ["c", "a", "d", "b"]:
+            self.db.put(key, {"id": key})
+
+        # pages are in id order whatever the insertion order was
+        self.assertEqual([r["id"] for r in self.db.page(None, 3)], ["a", "b", "c"])
+        self.assertEqual([r["id"] for r in self.db.page("c", 3)], ["d"])
+        self.assertEqual([r["id"] for r in self.db.page("bb", 1)], ["c"])
+
+        # the sorted keys follow inserts and full reloads
+        self.db.put("aa", {"id": "aa"})
+        self.assertEqual([r["id"] for r in self.db.page("a", 1)], ["aa"])
+        with open(self.db_path, "w") as f:
+            json.dump({"z": {"id": "z"}}, f)
+        self.assertEqual([r["id"] for r in self.db.page(None, 10)], ["z"])
+
+        print("page OK")
+
+    def test_put_many(self):
+        with mock.patch.object(file_db, "_atomic_write", wraps=file_db._atomic_write) as atomic_write:
+            self.db.put_many({str(i): {"id": str(i)} for i in range(5)})
+        self.assertEqual(atomic_write.call_count, 1)
+        self.assertEqual(len(self.db.values()), 5)
+
+        # journaled, the batch is one record: a torn batch is dropped whole
+        db = FileDB(self.db_path, journal=True, compact_records=100)
+        db.put_many({"a": {"id": "a"}, "b": {"id": "b"}})
+        with open(self.db_path + ".journal", "rb") as f:
+            self.assertEqual(len(f.readlines()), 1)
+        with open(self.db_path + ".journal", "ab") as f:
+            f.write(b'{"batch": [{"key": "c", "value": {"id": "c"}}, {"key": "d"')
+        file_db._entries.clear()
+        fresh = FileDB(self.db_path)
+        self.assertIn("b", fresh)
+        self.assertNotIn("c", fresh)
+
+        print("put_many OK")
+
+    def test_in_memory(self):
+        self.db.put("a", {"id": "a"})
+        self.assertTrue(self.db.in_memory())
+
+        # a change by another process means the next read has to go to disk
+        with open(self.db_path, "w") as f:
+            json.dump({"b": {"id": "b"}}, f)
+        self.assertFalse(self.db.in_memory())
+        self.assertIn("b", self.db)
+        self.assertTrue(self.db.in_memory())
+
+        print("in_memory OK")
+
+    def test_version(self):
+        self.db.put("a", {"id": "a"})
+        version = self.db.version()
+        self.db.get("a")
+        self.assertEqual(self.db.version(), version)
+
+        # changes made by another process count too
+        with open(self.db_path, "w") as f:
+            json.dump({"b": {"id": "b"}}, f)
+        self.assertNotEqual(self.db.version(), version)
+
+        print("version OK")
+
+    @unittest.skipIf(file_db.fcntl is None, "no fcntl on this platform")
+    def test_reader_waits_for_writer_lock(self):
+        self.db.put("a", {"id": "a"})
+        before = self.db.lock_info()
+        self.assertGreaterEqual(before["exclusive_acquired"], 1)
+
+        # another process holds the write lock while it changes the file
+        with open(self.db_path + ".lock", "a") as lock_file:
+            file_db.fcntl.flock(lock_file.fileno(), file_db.fcntl.LOCK_EX)
+            with open(self.db_path, "w") as f:
+                json.dump({"b": {"id": "b"}}, f)
+            release = threading.Timer(0.1, file_db.fcntl.flock, (lock_file.fileno(), file_db.fcntl.LOCK_UN))
+            release.start()
+            # the reload has to wait for the writer to finish, then sees its change
+            self.assertIn("b", self.db)
+            release.join()
+
+        after = self.db.lock_info()
+        self.assertEqual(after["shared_acquired"], before["shared_acquired"] + 1)
+        self.assertGreaterEqual(after["shared_wait_seconds"] - before["shared_wait_seconds"], 0.05)
+
+        print("reader_waits_for_writer_lock OK")
+
+    def test_reads_during_own_write(self):
+        db = FileDB(self.db_path, journal=True, group_commit_ms=0)
+        db.put("a", {"id": "a"})
+        syncing, release = threading.Event(), threading.Event()
+        fsync = os.fsync
+
+        def slow_fsync(fd):
+            syncing.set()
+            release.wait(5)
+            fsync(fd)
+
+        with mock.patch.object(file_db.os, "fsync", slow_fsync):
+            writer = threading.Thread(target=db.put, args=("b", {"id": "b"}))
+            writer.start()
+            self.assertTrue(syncing.wait(5))
+            # the journal already has the record, but the write isn't done: readers keep the cached data
+            # instead of waiting for the writer's lock to reload (and then finding "b")
+            self.assertTrue(db.in_memory())
+            self.assertEqual(db.get("a"), {"id": "a"})
+            self.assertNotIn("b", db)
+            release.set()
+            writer.join()
+
+        self.assertIn("b", db)
+        self.assertTrue(db.in_memory())
+
+        print("reads_during_own_write OK")
+
+    def test_snapshot_write_visible_once_on_disk(self):
+        self.db.put("a", {"id": "a"})
+        seen = []
+        atomic_write = file_db._atomic_write
+
+        def checked_write(path, write, **kwargs):
+            # a lock-free reader in the middle of the rewrite still gets the cached data, without "b"
+            seen.append((self.db.in_memory(), "b" in self.db, self.db.find(id="b")))
+            atomic_write(path, write, **kwargs)
+
+        with mock.patch.object(file_db, "_atomic_write", checked_write):
+            self.db.put("b", {"id": "b"})
+        self.assertEqual(seen, [(True, False, [])])
+        self.assertEqual(self.db.get("b"), {"id": "b"})
+
+        # a failed write leaves nothing behind, in memory or on disk
+        with mock.patch.object(file_db, "_atomic_write", side_effect=OSError("disk full")):
+            with self.assertRaises(OSError):
+                self.db.put("c", {"id": "c"})
+        self.assertNotIn("c", self.db)
+        self.assertEqual(self.db.get("b"), {"id": "b"})
+
+        print("snapshot_write_visible_once_on_disk OK")
+
+    def test_io_info(self):
+        before = self.db.io_info()
+        self.db.put("a", {"id": "a"})
+        self.db.get("a")
+        after = self.db.io_info()
+        size = os.path.getsize(self.db_path)
+
+        # one snapshot written, the read after it served from memory
+        self.assertEqual(after["writes"], before["writes"] + 1)
+        self.assertEqual(after["bytes_written"], before["bytes_written"] + size)
+        self.assertEqual(after["reads"], before["reads"])
+        self.assertGreater(after["cache_hits"], before["cache_hits"])
+        self.assertEqual(after["file_bytes"], size)
+
+        # another process' write makes the next read parse the whole file again
+        with open(self.db_path, "w") as f:
+            json.dump({"b": {"id": "b"}}, f)
+        self.assertIn("b", self.db)
+        reloaded = file_db.io_info()[os.path.abspath(self.db_path)]
+        self.assertEqual(reloaded["reads"], after["reads"] + 1)
+        self.assertEqual(reloaded["bytes_parsed"], after["bytes_parsed"] + os.path.getsize(self.db_path))
+        self.assertGreater(reloaded["load_seconds"], 0)
+
+        # journaled writes only serialize the record
+        db = FileDB(self.db_path, journal=True, compact_records=100)
+        written = db.io_info()["bytes_written"]
+        db.put("c", {"id": "c"})
+        self.assertEqual(db.io_info()["bytes_written"] - written, os.path.getsize(self.db_path + ".journal"))
+
+        print("io_info OK")
+
+    @unittest.skipUnless(metrics.METRICS_ENABLED, "instrumentation turned off")
+    def test_storage_phase(self):
+        timer, token = metrics.start_timer()
+        try:
+            metrics.timed(metrics.MANAGER, lambda: (self.db.put("a", {"id": "a"}), self.db.get("a")))
+        finally:
+            metrics.stop_timer(token)
+
+        # the storage calls made by the manager are charged to storage, not to both
+        self.assertGreater(timer.spent[metrics.STORAGE], 0)
+        self.assertGreater(timer.spent[metrics.MANAGER], 0)
+        self.assertEqual(timer.spent[metrics.ROUTE], 0)
+        header = timer.server_timing(1.0).decode()
+        self.assertRegex(header, r"^validation;dur=[0-9.]+, route;dur=0\.000, manager;dur=")
+        self.assertTrue(header.endswith("total;dur=1000.000"))
+
+        # outside a request nothing is timed
+        self.assertIsNone(metrics.current_timer())
+        self.db.get("a")
+
+        print("storage_phase OK")
+
+
+if __name__ == '__main__':
+    unittest.main()
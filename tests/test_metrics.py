@@ -0,0 +1,143 @@
+import unittest
+import asyncio
+import os
+import re
+import shutil
+from benchmarks.asgi_client import ASGIClient
+from utils import metrics
+
+if metrics.METRICS_ENABLED:
+    from app.instrumentation import MetricsMiddleware
+    from app.main import app, generic_exception_handler
+
+# name{labels} value, one series per line of the exposition format
+SERIES = re.compile(r"^(\w+)(\{.*\})? (\S+)$")
+
+
+@unittest.skipUnless(metrics.METRICS_ENABLED, "instrumentation turned off")
+class TestMetrics(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        print("Setting up TestMetrics Class...")
+        # the app keeps its files under db/, relative to the working directory
+        cls.cwd = os.getcwd()
+        cls.workdir = os.path.join(cls.cwd, "tests/tmp/test_metrics")
+        os.makedirs(cls.workdir, exist_ok=True)
+        os.chdir(cls.workdir)
+        cls.loop = asyncio.new_event_loop()
+        cls.client = ASGIClient(app)
+        cls.loop.run_until_complete(cls.client.__aenter__())
+        cls.user_id = cls.request("POST", "/api/v1/users/create", {"name": "metrics", "display_name": "M"}).json()["id"]
+
+    @classmethod
+    def tearDownClass(cls):
+        print("Tearing down TestMetrics Class...")
+        cls.loop.run_until_complete(cls.client.__aexit__(None, None, None))
+        cls.loop.close()
+        os.chdir(cls.cwd)
+        shutil.rmtree("tests/tmp", ignore_errors=True)
+
+    @classmethod
+    def request(cls, method, path, body=None, headers=(), client=None):
+        return cls.loop.run_until_complete((client or cls.client).request(method, path, body, headers=headers))
+
+    def scrape(self):
+        # series -> value of a GET /metrics
+        response = self.request("GET", "/metrics")
+        self.assertEqual(response.status, 200)
+        values = {}
+        for line in response.body.decode().splitlines():
+            match = SERIES.match(line)
+            if match:
+                values[match.group(1) + (match.group(2) or "")] = float(match.group(3))
+        return values
+
+    def test_requests_counted(self):
+        describe = 'method="GET",route="/api/v1/users/describe"'
+        listing = 'method="GET",route="/api/v1/users/"'
+        unmatched = 'method="GET",route="<unmatched>"'
+        before = self.scrape()
+
+        ok = self.request("GET", "/api/v1/users/describe", {"id": self.user_id})
+        missing = self.request("GET", "/api/v1/users/describe", {"id": "nope"})
+        invalid = self.request("GET", "/api/v1/users/describe", {})
+        not_found = self.request("GET", "/api/v1/nowhere")
+        streamed = self.request("GET", "/api/v1/users/", headers=[("accept", "application/x-ndjson")])
+        after = self.scrape()
+
+        def added(series):
+            return after.get(series, 0) - before.get(series, 0)
+
+        self.assertEqual([ok.status, missing.status, invalid.status, not_found.status, streamed.status],
+                         [200, 500, 422, 404, 200])
+        # statuses and exceptions by route template, whether a handler answered the error or the middleware did
+        self.assertEqual(added(f"factwise_http_requests_total{{{describe},status=\"200\"}}"), 1)
+        self.assertEqual(added(f"factwise_http_requests_total{{{describe},status=\"500\"}}"), 1)
+        self.assertEqual(added(f"factwise_http_requests_total{{{describe},status=\"422\"}}"), 1)
+        self.assertEqual(added(f"factwise_http_request_errors_total{{{describe},exception=\"ValueError\"}}"), 1)
+        self.assertEqual(
+            added(f"factwise_http_request_errors_total{{{describe},exception=\"RequestValidationError\"}}"), 1
+        )
+        self.assertEqual(added(f"factwise_http_requests_total{{{unmatched},status=\"404\"}}"), 1)
+        self.assertEqual(added(f"factwise_http_request_errors_total{{{unmatched},exception=\"HTTPException\"}}"), 1)
+        # histograms: sizes from the bodies sent, streamed ones added up chunk by chunk
+        self.assertEqual(added(f"factwise_http_request_duration_seconds_count{{{describe}}}"), 3)
+        self.assertEqual(added(f"factwise_http_response_size_bytes_sum{{{describe}}}"),
+                         len(ok.body) + len(missing.body) + len(invalid.body))
+        self.assertEqual(added(f"factwise_http_request_size_bytes_sum{{{describe}}}"),
+                         len(f'{{"id": "{self.user_id}"}}') + len('{"id": "nope"}') + len("{}"))
+        self.assertEqual(added(f"factwise_http_response_size_bytes_sum{{{listing}}}"), len(streamed.body))
+        self.assertGreater(len(streamed.body), 0)
+        # FastAPI's own routes are counted too, and the previous scrape
+        self.assertEqual(added('factwise_http_requests_total{method="GET",route="/metrics",status="200"}'), 1)
+        self.assertEqual(self.request("GET", "/openapi.json").status, 200)
+        openapi = 'factwise_http_requests_total{method="GET",route="/openapi.json",status="200"}'
+        self.assertEqual(self.scrape()[openapi] - after.get(openapi, 0), 1)
+
+        print("requests_counted OK")
+
+    def test_server_timing(self):
+        # off by default: no header, no phase counters
+        if not metrics.SERVER_TIMING:
+            plain = self.request("GET", "/api/v1/users/describe", {"id": self.user_id})
+            self.assertNotIn("server-timing", plain.headers)
+            self.assertFalse(any(name.startswith("factwise_http_request_phase_seconds") for name in self.scrape()))
+
+        phases = metrics.Metrics(phases=True)
+        timed = MetricsMiddleware(app, metrics=phases, profiler=app.state.profiler,
+                                  error_handler=generic_exception_handler, server_timing=True)
+        response = self.request("GET", "/api/v1/users/describe", {"id": self.user_id}, client=ASGIClient(timed))
+        self.assertEqual(response.status, 200)
+        header = response.headers["server-timing"]
+        self.assertEqual([part.split(";")[0] for part in header.split(", ")],
+                         ["validation", "route", "manager", "storage", "total"])
+        total = float(header.rsplit("dur=", 1)[1])
+        self.assertGreater(total, 0)
+
+        text = phases.render()
+        self.assertIn('factwise_http_requests_total{method="GET",route="/api/v1/users/describe",status="200"} 1', text)
+        validation = re.search(r'phase_seconds_total\{method="GET",route="/api/v1/users/describe",'
+                               r'phase="validation"\} (\S+)', text)
+        self.assertGreater(float(validation.group(1)), 0)
+
+        print("server_timing OK")
+
+    def test_batches_counted(self):
+        # requests are counted a batch at a time; the one that fills the batch counts all of them
+        stats = app.state.metrics.labels("GET", "/api/v1/users/describe")
+        self.scrape()
+        counted = stats.statuses.get(200, 0)
+        # the scrape itself is queued
+        sent = metrics.RECORD_BATCH - len(app.state.metrics._queued)
+        for _ in range(sent - 1):
+            self.request("GET", "/api/v1/users/describe", {"id": self.user_id})
+        self.assertEqual(stats.statuses.get(200, 0), counted)
+        self.request("GET", "/api/v1/users/describe", {"id": self.user_id})
+        self.assertEqual(stats.statuses[200], counted + sent)
+        self.assertEqual(app.state.metrics._queued, [])
+
+        print("batches_counted OK")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+import unittest
+import contextvars
+import os
+import shutil
+import threading
+from utils.file_db import FileDB
+from utils import profiling
+from utils.profiling import Profiler, profiled
+
+class TestProfiling(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        print("Setting up TestProfiling Class...")
+        cls.profile_dir = "tests/tmp/profiles"
+        cls.db = FileDB("tests/tmp/test_profiling.json", journal=False, group_commit_ms=0)
+
+    @classmethod
+    def tearDownClass(cls):
+        print("Tearing down TestProfiling Class...")
+        shutil.rmtree("tests/tmp", ignore_errors=True)
+
+    def test_profile_covers_worker_threads(self):
+        profiler = Profiler(directory=self.profile_dir, sample_rate=0, header=True)
+        session, token = profiler.start()
+
+        # only one request is profiled at a time
+        self.assertIsNone(profiler.start())
+        self.assertEqual(profiler.skipped, 1)
+
+        # storage work done in an executor thread lands in the same profile, the context carrying the session over
+        context = contextvars.copy_context()
+        worker = threading.Thread(target=context.run, args=(profiled, self.db.put, "a", {"id": "a"}))
+        worker.start()
+        worker.join()
+        path = profiler.finish(session, token, "POST", "/api/v1/users/create", 200, 0.0125)
+
+        self.assertEqual(os.path.basename(path).split("_", 2)[2], "POST_api_v1_users_create_12.500ms.prof")
+        self.assertTrue(os.path.exists(path))
+        [profile] = profiler.top(limit=5, functions=50, sort="cumulative")
+        functions = [f["function"] for f in profile["top"]]
+        self.assertTrue(any("file_db.py" in f and "(put_many)" in f for f in functions))
+        self.assertEqual(profile["route"], "/api/v1/users/create")
+
+        # the next request can be profiled again
+        self.assertFalse(profiler.active)
+
+        print("profile_covers_worker_threads OK")
+
+    def test_wanted(self):
+        profiler = Profiler(directory=self.profile_dir, sample_rate=0, header=True)
+        self.assertTrue(profiler.wanted([(b"x-profile", b"1")]))
+        self.assertFalse(profiler.wanted([(b"x-profile", b"0")]))
+        self.assertFalse(profiler.wanted([]))
+
+        # the admin toggles: no header, every request sampled
+        profiler.header = False
+        self.assertFalse(profiler.wanted([(b"x-profile", b"1")]))
+        profiler.sample_rate = 1
+        self.assertTrue(profiler.wanted([]))
+
+        print("wanted OK")
+
+    def test_old_dumps_deleted(self):
+        profiler = Profiler(directory=self.profile_dir, sample_rate=0, keep=2)
+        paths = []
+        for i in range(3):
+            session, token = profiler.start()
+            paths.append(profiler.finish(session, token, "GET", f"/api/v1/route{i}", 200, 0.001))
+
+        # only the newest `keep` dumps stay, on disk as in the listing
+        self.assertFalse(os.path.exists(paths[0]))
+        self.assertTrue(all(os.path.exists(path) for path in paths[1:]))
+        self.assertEqual([entry["file"] for entry in profiler.recent], paths[1:])
+
+        print("old_dumps_deleted OK")
+
+    @unittest.skipIf("FACTWISE_PROFILE_HEADER" in os.environ, "header setting given in the environment")
+    def test_header_off_by_default(self):
+        # clients can't ask for profiles until an admin allows it
+        self.assertFalse(profiling.PROFILE_HEADER)
+        self.assertFalse(Profiler(directory=self.profile_dir).wanted([(b"x-profile", b"1")]))
+
+        print("header_off_by_default OK")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+import unittest
+import asyncio
+import datetime
+import os
+import shutil
+from benchmarks.asgi_client import ASGIClient
+from app.main import app
+
+
+class TestRoutes(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        print("Setting up TestRoutes Class...")
+        # the app keeps its files under db/, relative to the working directory
+        cls.cwd = os.getcwd()
+        cls.workdir = os.path.join(cls.cwd, "tests/tmp/test_routes")
+        os.makedirs(cls.workdir, exist_ok=True)
+        os.chdir(cls.workdir)
+        cls.loop = asyncio.new_event_loop()
+        cls.client = ASGIClient(app)
+        cls.loop.run_until_complete(cls.client.__aenter__())
+        cls.user_id = cls.request("POST", "/api/v1/users/create", {"name": "routes", "display_name": "R"}).json()["id"]
+
+    @classmethod
+    def tearDownClass(cls):
+        print("Tearing down TestRoutes Class...")
+        cls.loop.run_until_complete(cls.client.__aexit__(None, None, None))
+        cls.loop.close()
+        os.chdir(cls.cwd)
+        shutil.rmtree("tests/tmp", ignore_errors=True)
+
+    @classmethod
+    def request(cls, method, path, body=None, headers=()):
+        return cls.loop.run_until_complete(cls.client.request(method, path, body, headers=headers))
+
+    def test_conditional_get(self):
+        describe = {"id": self.user_id}
+        first = self.request("GET", "/api/v1/users/describe", describe)
+        self.assertEqual(first.status, 200)
+        etag = first.headers["etag"]
+
+        # unchanged: a 304 with the same ETag and no body
+        again = self.request("GET", "/api/v1/users/describe", describe, headers=[("if-none-match", etag)])
+        self.assertEqual(again.status, 304)
+        self.assertEqual(again.headers["etag"], etag)
+        self.assertEqual(again.body, b"")
+        # the ETag is per request body, another user's doesn't match
+        other = self.request("GET", "/api/v1/users/describe", {"id": "nope"}, headers=[("if-none-match", etag)])
+        self.assertNotEqual(other.status, 304)
+
+        # a write moves the version on: a full answer with a new ETag
+        change = {"id": self.user_id, "user": {"name": "routes", "display_name": "R2"}}
+        updated = self.request("POST", "/api/v1/users/update", change)
+        self.assertEqual(updated.status, 200)
+        after = self.request("GET", "/api/v1/users/describe", describe, headers=[("if-none-match", etag)])
+        self.assertEqual(after.status, 200)
+        self.assertNotEqual(after.headers["etag"], etag)
+        self.assertEqual(after.json()["version"], updated.json()["version"])
+
+        print("conditional_get OK")
+
+    def test_etag_version_offloaded(self):
+        # a store that would have to reload or query for its version is asked off the event loop
+        io, db = app.state.io, app.state.user_manager.db
+        db.in_memory = lambda: False
+        try:
+            offloaded = io.offloaded
+            response = self.request("GET", "/api/v1/users/describe", {"id": self.user_id})
+        finally:
+            del db.in_memory
+        self.assertEqual(response.status, 200)
+        # the version for the ETag, then the read itself
+        self.assertEqual(io.offloaded, offloaded + 2)
+
+        print("etag_version_offloaded OK")
+
+    def test_cached_responses(self):
+        cache = app.state.response_cache
+        team_id = self.request("POST", "/api/v1/teams/create",
+                               {"name": "cached", "description": "first", "admin": self.user_id}).json()["id"]
+        describe = {"id": team_id}
+
+        # a miss builds and stores the response, the next request is served from the cache
+        hits, misses = cache.hits, cache.misses
+        first = self.request("GET", "/api/v1/teams/describe", describe)
+        self.assertEqual((cache.hits, cache.misses), (hits, misses + 1))
+        second = self.request("GET", "/api/v1/teams/describe", describe)
+        self.assertEqual((cache.hits, cache.misses), (hits + 1, misses + 1))
+        self.assertEqual(second.body, first.body)
+
+        # a write drops the entries built on the team: the next request rebuilds it with the change
+        change = {"id": team_id, "team": {"name": "cached", "description": "second", "admin": self.user_id}}
+        self.assertEqual(self.request("POST", "/api/v1/teams/update", change).status, 200)
+        third = self.request("GET", "/api/v1/teams/describe", describe)
+        self.assertEqual((cache.hits, cache.misses), (hits + 1, misses + 2))
+        self.assertEqual(third.json()["description"], "second")
+
+        print("cached_responses OK")
+
+    def test_update_task_statuses(self):
+        now = datetime.datetime.now().isoformat()
+        team_id = self.request("POST", "/api/v1/teams/create", {"name": "statuses", "admin": self.user_id}).json()["id"]
+        board_id = self.request("POST", "/api/v1/board/create", {"name": "statuses", "description": None,
+                                                                 "team_id": team_id, "creation_time": now}).json()["id"]
+        task = {"board_id": board_id, "description": None, "user_id": self.user_id, "creation_time": now}
+        added = self.request("POST", "/api/v1/board/add_tasks",
+                             {"tasks": [dict(task, title="one"), dict(task, title="two")]}).json()["results"]
+
+        # an unknown status fails its own item, not the request
+        response = self.request("POST", "/api/v1/board/update_task_statuses", {"updates": [
+            {"id": added[0]["id"], "status": "COMPLETE"},
+            {"id": added[1]["id"], "status": "DONE"},
+        ]})
+        self.assertEqual(response.status, 200)
+        results = response.json()["results"]
+        self.assertEqual(results[0], {"id": added[0]["id"], "status": "COMPLETE", "error": None})
+        self.assertIsNone(results[1]["status"])
+        self.assertIn("Invalid status <DONE>", results[1]["error"])
+        tasks = self.request("GET", "/api/v1/board/tasks", {"board_id": board_id}).json()
+        self.assertEqual(sorted(task["status"] for task in tasks), ["COMPLETE", "OPEN"])
+
+        print("update_task_statuses OK")
+
+    def test_board_versions(self):
+        now = datetime.datetime.now().isoformat()
+        team_id = self.request("POST", "/api/v1/teams/create", {"name": "versions", "admin": self.user_id}).json()["id"]
+        board_id = self.request("POST", "/api/v1/board/create", {"name": "versions", "description": None,
+                                                                 "team_id": team_id, "creation_time": now}).json()["id"]
+        team_boards = self.request("GET", "/api/v1/board/team_boards", {"id": team_id}).json()
+        self.assertEqual(team_boards, [{"id": board_id, "name": "versions", "version": 0}])
+
+        # a task write bumps the board: the cached team list is dropped and both lists show the new version
+        self.request("POST", "/api/v1/board/add_task", {"board_id": board_id, "title": "one", "description": None,
+                                                        "user_id": self.user_id, "creation_time": now})
+        team_boards = self.request("GET", "/api/v1/board/team_boards", {"id": team_id}).json()
+        self.assertEqual(team_boards[0]["version"], 1)
+        boards = {board["id"]: board for board in self.request("GET", "/api/v1/board/").json()}
+        self.assertEqual(boards[board_id]["version"], 1)
+
+        print("board_versions OK")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,10 +1,18 @@
 import unittest
+import glob
 import json
+import multiprocessing
 import os
+import threading
 from impl.team_manager import TeamManager
 from impl.user_manager import UserManager
+from utils.concurrency import VersionConflict
+from utils import response_cache
+from utils.response_cache import CachedResponse, ResponseCache
 
 class TestTeamManager(unittest.TestCase):
+    backend = "json"
+
     @classmethod
     def setUpClass(cls):
         print("Setting up TestTeamManager Class...")
@@ -17,11 +25,14 @@ class TestTeamManager(unittest.TestCase):
 
         # init managers once for all tests
         cls.user_manager = UserManager(
-            user_db_path=cls.user_db_path
+            user_db_path=cls.user_db_path,
+            team_db_path=cls.team_db_path,
+            backend=cls.backend
         )
         cls.team_manager = TeamManager(
             team_db_path=cls.team_db_path,
-            user_db_path=cls.user_db_path
+            user_db_path=cls.user_db_path,
+            backend=cls.backend
         )
 
     @classmethod
@@ -33,15 +44,16 @@ class TestTeamManager(unittest.TestCase):
             os.remove(cls.user_db_path)
         if os.path.exists(cls.team_db_path):
             os.remove(cls.team_db_path)
+        # leftovers of the journaled and sqlite storage modes, and the lock files
+        for path in glob.glob("tests/tmp/*.journal") + glob.glob("tests/tmp/*.lock") + glob.glob("tests/tmp/storage.sqlite3*"):
+            os.remove(path)
         if os.path.exists("tests/tmp"):
             os.rmdir("tests/tmp")
 
     def setUp(self):
         # Clean user and team dbs before each test
-        with open(self.user_db_path, "w") as f:
-            json.dump({}, f)
-        with open(self.team_db_path, "w") as f:
-            json.dump({}, f)
+        self.user_manager.db.write({})
+        self.team_manager.team_db.write({})
 
         # Create a dummy user for testing
         self.admin_user = json.loads(self.user_manager.create_user(json.dumps({"name": "admin", "display_name": "Admin User"})))
@@ -180,5 +192,174 @@ class TestTeamManager(unittest.TestCase):
 
         print("list_team_users OK")
 
+    def test_list_team_users_pagination(self):
+        request = json.dumps({"name": "Test Team", "description": "A test team", "admin": self.admin_user['id']})
+        team_id = json.loads(self.team_manager.create_team(request))["id"]
+        user_ids = [
+            self.user_manager.create_user_dict({"name": f"member{i}", "display_name": "Member"})["id"]
+            for i in range(4)
+        ]
+        self.team_manager.add_users_to_team_dict({"id": team_id, "users": user_ids})
+
+        first = self.team_manager.list_team_users_page({"id": team_id}, limit=3)
+        second = self.team_manager.list_team_users_page({"id": team_id}, first["next_cursor"], limit=3)
+        self.assertEqual(len(first["items"]), 3)
+        self.assertEqual(len(second["items"]), 2)
+        self.assertIsNone(second["next_cursor"])
+        ids = [u["id"] for u in first["items"] + second["items"]]
+        self.assertEqual(ids, sorted(user_ids + [self.admin_user["id"]]))
+
+        print("list_team_users_pagination OK")
+    def test_membership_index(self):
+        # Create a team and a user who is not a member yet
+        request = json.dumps({"name": "Test Team", "description": "A test team", "admin": self.admin_user['id']})
+        team_id = json.loads(self.team_manager.create_team(request))["id"]
+        new_user = json.loads(self.user_manager.create_user(json.dumps({"name": "newuser", "display_name": "New User"})))
+        get_teams = json.dumps({"id": new_user["id"]})
+        self.assertEqual(json.loads(self.user_manager.get_user_teams(get_teams)), [])
+
+        # membership changes are visible through get_user_teams right away
+        self.team_manager.add_users_to_team(json.dumps({"id": team_id, "users": [new_user["id"]]}))
+        self.assertEqual([t["name"] for t in json.loads(self.user_manager.get_user_teams(get_teams))], ["Test Team"])
+
+        self.team_manager.remove_users_from_team(json.dumps({"id": team_id, "users": [new_user["id"]]}))
+        self.assertEqual(json.loads(self.user_manager.get_user_teams(get_teams)), [])
+
+        # becoming admin makes the user a member
+        self.team_manager.update_team(json.dumps({"id": team_id, "team": {"admin": new_user["id"]}}))
+        self.assertEqual(len(json.loads(self.user_manager.get_user_teams(get_teams))), 1)
+
+        print("membership_index OK")
+
+    def test_concurrent_membership_changes(self):
+        request = json.dumps({"name": "Test Team", "description": "A test team", "admin": self.admin_user['id']})
+        team_id = json.loads(self.team_manager.create_team(request))["id"]
+        user_ids = [
+            self.user_manager.create_user_dict({"name": f"member{i}", "display_name": "Member"})["id"]
+            for i in range(8)
+        ]
+        # a second manager on the same files, like another worker, so no manager lock is shared
+        other = TeamManager(team_db_path=self.team_db_path, user_db_path=self.user_db_path, backend=self.backend)
+        start = threading.Barrier(len(user_ids))
+
+        def add(i, uid):
+            start.wait()
+            (self.team_manager if i % 2 else other).add_users_to_team_dict({"id": team_id, "users": [uid]})
+
+        threads = [threading.Thread(target=add, args=(i, uid)) for i, uid in enumerate(user_ids)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        # every read-modify-write landed: none of the concurrent additions was lost
+        team = self.team_manager.team_db.get(team_id)
+        self.assertEqual(sorted(team["users"]), sorted(user_ids + [self.admin_user["id"]]))
+        self.assertEqual(team["version"], len(user_ids))
+        other.close()
+
+        print("concurrent_membership_changes OK")
+
+    def test_expected_version(self):
+        request = json.dumps({"name": "Test Team", "description": "A test team", "admin": self.admin_user['id']})
+        team_id = json.loads(self.team_manager.create_team(request))["id"]
+        self.assertEqual(self.team_manager.describe_team_dict({"id": team_id})["version"], 0)
+
+        result = self.team_manager.update_team_dict({"id": team_id, "team": {"description": "v1"}, "version": 0})
+        self.assertEqual(result["version"], 1)
+
+        # a change based on version 0 no longer applies
+        with self.assertRaises(VersionConflict):
+            self.team_manager.update_team_dict({"id": team_id, "team": {"description": "stale"}, "version": 0})
+        with self.assertRaises(VersionConflict):
+            self.team_manager.remove_users_from_team_dict({"id": team_id, "users": [], "version": 0})
+        self.assertEqual(self.team_manager.describe_team_dict({"id": team_id})["description"], "v1")
+
+        print("expected_version OK")
+
+    def test_response_cache_invalidation(self):
+        request = json.dumps({"name": "Test Team", "description": "A test team", "admin": self.admin_user['id']})
+        team_id = json.loads(self.team_manager.create_team(request))["id"]
+        new_user = self.user_manager.create_user_dict({"name": "newuser", "display_name": "New User"})["id"]
+        cache = self.team_manager.cache
+        keys = {
+            "teams": "team_list",
+            "members": f"team_users:{team_id}",
+            "new_user_teams": f"user_teams:{new_user}",
+            "admin_teams": f"user_teams:{self.admin_user['id']}",
+        }
+        for key, tag in keys.items():
+            cache.put(key, CachedResponse(b"[]", {}), [tag], cache.token())
+
+        # only the members list and the new member's teams change
+        self.team_manager.add_users_to_team_dict({"id": team_id, "users": [new_user]})
+        self.assertIsNone(cache.get("members"))
+        self.assertIsNone(cache.get("new_user_teams"))
+        self.assertIsNotNone(cache.get("teams"))
+        self.assertIsNotNone(cache.get("admin_teams"))
+
+        # a response built before a write to its data is not stored
+        token = cache.token()
+        self.team_manager.remove_users_from_team_dict({"id": team_id, "users": [new_user]})
+        cache.put("members", CachedResponse(b"[]", {}), [f"team_users:{team_id}"], token)
+        self.assertIsNone(cache.get("members"))
+
+        # least recently used entries go first once the byte budget is exceeded
+        small = ResponseCache(max_bytes=10)
+        for key in ["a", "b", "c"]:
+            small.put(key, CachedResponse(b"xxxx", {}), [], small.token())
+        self.assertIsNone(small.get("a"))
+        self.assertEqual(small.get("c").body, b"xxxx")
+        stats = small.stats()
+        self.assertEqual((stats["entries"], stats["evictions"], stats["hits"], stats["misses"]), (2, 1, 1, 1))
+        self.assertEqual(stats["hit_rate"], 0.5)
+
+        print("response_cache_invalidation OK")
+
+    def test_response_cache_other_process_write(self):
+        team_id = self.team_manager.create_team_dict({"name": "Team X", "description": "", "admin": self.admin_user["id"]})["id"]
+        cache = self.team_manager.cache
+        cache.sync("teams", self.team_manager.team_db.version())
+        # tagged as cached_json() tags describe_team
+        cache.put("describe_x", CachedResponse(b"{}", {}), ["teams", f"team:{team_id}"], cache.token())
+
+        # another worker renames team X, then this one writes a different team
+        worker = multiprocessing.get_context("spawn").Process(
+            target=_rename_team, args=(self.backend, self.team_db_path, self.user_db_path, team_id, "Team X2")
+        )
+        worker.start()
+        worker.join()
+        self.assertEqual(worker.exitcode, 0)
+        self.team_manager.create_team_dict({"name": "Team Y", "description": "", "admin": self.admin_user["id"]})
+
+        # the next request's sync() still sees the other worker's write
+        cache.sync("teams", self.team_manager.team_db.version())
+        self.assertIsNone(cache.get("describe_x"))
+
+        # fills started before the invalidation record was cleared are not stored
+        small = ResponseCache()
+        token = small.token()
+        for n in range(response_cache.INVALIDATED_TAGS + 1):
+            small.invalidate(f"team:{n}")
+        small.put("stale", CachedResponse(b"{}", {}), ["team:other"], token)
+        self.assertIsNone(small.get("stale"))
+        self.assertLessEqual(len(small._invalidated_at), response_cache.INVALIDATED_TAGS)
+        small.put("fresh", CachedResponse(b"{}", {}), ["team:other"], small.token())
+        self.assertIsNotNone(small.get("fresh"))
+
+        print("response_cache_other_process_write OK")
+
+
+def _rename_team(backend, team_db_path, user_db_path, team_id, name):
+    # runs in a separate process, like a uvicorn worker
+    team_manager = TeamManager(team_db_path=team_db_path, user_db_path=user_db_path, backend=backend)
+    team_manager.update_team_dict({"id": team_id, "team": {"name": name}})
+    team_manager.close()
+
+
+class TestTeamManagerSqlite(TestTeamManager):
+    backend = "sqlite"
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,10 +1,14 @@
 import unittest
+import glob
+import threading
 import os
 import json
 from impl.user_manager import UserManager
 from impl.team_manager import TeamManager
 
 class TestUserManager(unittest.TestCase):
+    backend = "json"
+
     @classmethod
     def setUpClass(cls):
         print("Setting up TestUserManager Class...")
@@ -15,21 +19,17 @@ class TestUserManager(unittest.TestCase):
         # make sure tmp dir exists
         os.makedirs(os.path.dirname(cls.user_db_path), exist_ok=True)
 
-        # create fresh empty json files
-        with open(cls.user_db_path, "w") as f:
-            json.dump({}, f)
-        with open(cls.team_db_path, "w") as f:
-            json.dump({}, f)
-
         # init managers once for all tests
         cls.user_manager = UserManager(
             user_db_path=cls.user_db_path,
-            team_db_path=cls.team_db_path
+            team_db_path=cls.team_db_path,
+            backend=cls.backend
         )
         # We also need a team manager to create teams for get_user_teams test
         cls.team_manager = TeamManager(
             team_db_path=cls.team_db_path,
-            user_db_path=cls.user_db_path
+            user_db_path=cls.user_db_path,
+            backend=cls.backend
         )
 
     @classmethod
@@ -41,6 +41,9 @@ class TestUserManager(unittest.TestCase):
             os.remove(cls.user_db_path)
         if os.path.exists(cls.team_db_path):
             os.remove(cls.team_db_path)
+        # leftovers of the journaled and sqlite storage modes, and the lock files
+        for path in glob.glob("tests/tmp/*.journal") + glob.glob("tests/tmp/*.lock") + glob.glob("tests/tmp/storage.sqlite3*"):
+            os.remove(path)
         # remove the directory
         if os.path.exists("tests/tmp"):
             os.rmdir("tests/tmp")
@@ -48,10 +51,8 @@ class TestUserManager(unittest.TestCase):
 
     def setUp(self):
         # Clean user and team dbs before each test
-        with open(self.user_db_path, "w") as f:
-            json.dump({}, f)
-        with open(self.team_db_path, "w") as f:
-            json.dump({}, f)
+        self.user_manager.db.write({})
+        self.team_manager.team_db.write({})
 
 
     def test_create_user(self):
@@ -96,6 +97,84 @@ class TestUserManager(unittest.TestCase):
 
         print("list_user OK")
 
+    def test_list_users_pagination(self):
+        for i in range(7):
+            self.user_manager.create_user_dict({"name": f"user{i}", "display_name": f"User {i}"})
+
+        # walking the cursors visits every user exactly once, in the same order every time
+        names, cursor = [], None
+        while True:
+            page = self.user_manager.list_users_page(cursor, limit=3)
+            self.assertLessEqual(len(page["items"]), 3)
+            names += [user["name"] for user in page["items"]]
+            cursor = page["next_cursor"]
+            if cursor is None:
+                break
+        self.assertEqual(sorted(names), [f"user{i}" for i in range(7)])
+        self.assertEqual(names, [u["name"] for u in self.user_manager.list_users_page(limit=7)["items"]])
+        self.assertIsNone(self.user_manager.list_users_page(limit=7)["next_cursor"])
+
+        with self.assertRaises(ValueError):
+            self.user_manager.list_users_page("not a cursor!", limit=3)
+        with self.assertRaises(ValueError):
+            self.user_manager.list_users_page(limit=0)
+
+        print("list_users_pagination OK")
+
+    def test_iter_users(self):
+        for i in range(5):
+            self.user_manager.create_user_dict({"name": f"user{i}", "display_name": f"User {i}"})
+
+        # the stream yields the same users as the list, in id order
+        streamed = list(self.user_manager.iter_users())
+        self.assertEqual(streamed, self.user_manager.list_users_page(limit=5)["items"])
+        self.assertCountEqual(streamed, self.user_manager.list_users_dict())
+
+        print("iter_users OK")
+
+    def test_create_users(self):
+        self.user_manager.create_user_dict({"name": "taken", "display_name": "Taken"})
+        response = self.user_manager.create_users_dict({"users": [
+            {"name": "bulk1", "display_name": "Bulk 1"},
+            {"name": "taken", "display_name": "Taken again"},
+            {"name": "bulk2", "display_name": ""},
+            {"name": "bulk1", "display_name": "Duplicate in batch"},
+            {"name": "bulk3", "display_name": "Bulk 3"},
+        ]})
+
+        # each item gets its own result, valid ones are stored
+        results = response["results"]
+        self.assertEqual([r["error"] is None for r in results], [True, False, False, False, True])
+        self.assertIn("already exists", results[1]["error"])
+        self.assertIn("already exists", results[3]["error"])
+        names = sorted(u["name"] for u in self.user_manager.list_users_dict())
+        self.assertEqual(names, ["bulk1", "bulk3", "taken"])
+        self.assertEqual(self.user_manager.describe_user_dict({"id": results[4]["id"]})["name"], "bulk3")
+
+        print("create_users OK")
+
+    def test_collection_version(self):
+        version = self.user_manager.db.version()
+        self.user_manager.list_users_dict()
+        self.assertEqual(self.user_manager.db.version(), version)
+
+        # any write moves the version on, reads never do
+        user = self.user_manager.create_user_dict({"name": "testuser", "display_name": "Test User"})
+        after_create = self.user_manager.db.version()
+        self.assertNotEqual(after_create, version)
+        self.user_manager.update_user_dict({"id": user["id"], "user": {"display_name": "Renamed"}})
+        self.assertNotIn(self.user_manager.db.version(), [version, after_create])
+
+        # writes that change no rows leave it
+        db = self.user_manager.db
+        after_update = db.version()
+        stale = dict(db.get(user["id"]), version=0)
+        self.assertEqual(db.compare_and_put({user["id"]: stale}), [user["id"]])
+        db.delete_many(["missing"])
+        self.assertEqual(db.version(), after_update)
+
+        print("collection_version OK")
+
 
     def test_describe_user(self):
         # Create a user
@@ -181,6 +260,65 @@ class TestUserManager(unittest.TestCase):
         self.assertEqual(data[0]["name"], "Test Team")
 
         print("get_user_teams OK")
+    def test_concurrent_create_user(self):
+        # the shared manager must not let two requests both pass the uniqueness check
+        request = json.dumps({"name": "racer", "display_name": "Racer"})
+        start = threading.Barrier(8)
+        results = []
+
+        def create():
+            start.wait()
+            try:
+                results.append(self.user_manager.create_user(request))
+            except ValueError:
+                results.append(None)
+
+        threads = [threading.Thread(target=create) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(len([r for r in results if r is not None]), 1)
+        self.assertEqual(len(json.loads(self.user_manager.list_users())), 1)
+
+        print("concurrent_create_user OK")
+
+    def test_concurrent_creates_share_a_flush(self):
+        if self.backend != "json":
+            self.skipTest("group commit is a FileDB feature")
+        path = "tests/tmp/test_group_users.json"
+        manager = UserManager(user_db_path=path, team_db_path=self.team_db_path, backend=self.backend)
+        # snapshot mode: every flush is one rewrite of the file, counted in io_info()
+        manager.db.journal = False
+        manager.db.group_commit_ms = 100
+        start = threading.Barrier(8)
+
+        def create(i):
+            start.wait()
+            manager.create_user(json.dumps({"name": f"grouped{i}", "display_name": "Grouped"}))
+
+        writes = manager.db.io_info()["writes"]
+        threads = [threading.Thread(target=create, args=(i,)) for i in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        # the manager lock is released before waiting on the commit, so the creates queued on it join that flush
+        self.assertLessEqual(manager.db.io_info()["writes"] - writes, 2)
+        reopened = UserManager(user_db_path=path, team_db_path=self.team_db_path, backend=self.backend)
+        self.assertEqual(len(json.loads(reopened.list_users())), 8)
+        reopened.close()
+        manager.close()
+        os.remove(path)
+
+        print("concurrent_creates_share_a_flush OK")
+
+
+class TestUserManagerSqlite(TestUserManager):
+    backend = "sqlite"
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,158 @@
+# Helpers for sharing one manager instance between request threads
+
+import asyncio
+import contextvars
+import functools
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Callable, Iterable, List, Optional, TypeVar, Union
+
+from abstract_classes.storage_base import StorageBase
+from utils.metrics import MANAGER, timed
+from utils.profiling import profiled
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+# threads for blocking storage calls made on behalf of async handlers
+IO_WORKERS = int(os.environ.get("FACTWISE_IO_WORKERS", "32"))
+
+# attempts an optimistic update gets before giving up on a record that keeps changing under it
+CAS_RETRIES = int(os.environ.get("FACTWISE_CAS_RETRIES", "20"))
+
+
+# the durability waits of the writes made by the running synchronized method, per thread
+_deferred = threading.local()
+
+
+def synchronized(method: F) -> F:
+    """
+    Runs the method under the instance's `_lock`, so check-then-write sequences
+    (e.g. a uniqueness check followed by put) can't interleave between threads.
+    Its writes wait to be durable only once the lock is released (see wait_durable()): writers queued on the lock
+    get to join the same group commit instead of each sleeping out a commit window of its own.
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        outer = getattr(_deferred, "waits", None)
+        waits: List[Callable[[], None]] = []
+        try:
+            with self._lock:
+                # a synchronized method called from another one leaves its waits to the outermost
+                _deferred.waits = waits if outer is None else outer
+                try:
+                    return method(self, *args, **kwargs)
+                finally:
+                    _deferred.waits = outer
+        finally:
+            # even if the method failed after writing, what it stored has to reach the disk
+            for wait in waits:
+                wait()
+    return wrapper  # type: ignore[return-value]
+
+
+def wait_durable(wait: Callable[[], None]) -> None:
+    # a storage backend's wait for its write to be durable: right away, or after the synchronized method running
+    # on this thread releases its lock
+    waits = getattr(_deferred, "waits", None)
+    if waits is None:
+        wait()
+    else:
+        waits.append(wait)
+
+
+class VersionConflict(ValueError):
+    """
+    The record is not at the version the client expected, or kept changing for CAS_RETRIES attempts.
+    The API answers it with 409 Conflict.
+    """
+
+
+def check_version(record: Dict[str, Any], expected: Optional[int]) -> None:
+    # `expected` is the version a client based its change on, None to accept any
+    current = record.get("version", 0)
+    if expected is not None and current != expected:
+        raise VersionConflict(f"Record {record['id']} is at version {current}, expected {expected}")
+
+
+def _backoff(attempt: int) -> None:
+    # random and growing, so writers that collided once don't keep colliding
+    time.sleep(random.uniform(0, 0.001 * 2 ** min(attempt, 6)))
+
+
+def cas_update(db: StorageBase, update: Callable[[], Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Read-modify-write of one record without a lock held across it: update() reads the record and changes it,
+    compare_and_put() stores it only if nobody stored a newer version meanwhile, otherwise update() runs again
+    on a fresh read. Writers of different records never wait for each other.
+    Returns the stored record, with its new version.
+    """
+    for attempt in range(CAS_RETRIES):
+        record = update()
+        if not db.compare_and_put({record["id"]: record}):
+            return record
+        _backoff(attempt)
+    raise VersionConflict(f"Gave up updating a record that changed {CAS_RETRIES} times in a row")
+
+
+def cas_update_many(db: StorageBase, update: Callable[[Any], Dict[str, Any]],
+                    keys: Iterable[Any]) -> Dict[Any, Union[Dict[str, Any], ValueError]]:
+    """
+    cas_update() for several records with one write per round: update(key) reads and changes a record,
+    and only the records that lost the compare-and-set are read and changed again.
+    Returns key -> the stored record, or the ValueError update() raised for it.
+    """
+    results: Dict[Any, Union[Dict[str, Any], ValueError]] = {}
+    pending = list(dict.fromkeys(keys))
+    for attempt in range(CAS_RETRIES):
+        records = {}
+        for key in pending:
+            try:
+                records[key] = update(key)
+            except ValueError as exc:
+                results[key] = exc
+        stale = set(db.compare_and_put(records))
+        results.update((key, record) for key, record in records.items() if key not in stale)
+        pending = [key for key in records if key in stale]
+        if not pending:
+            return results
+        _backoff(attempt)
+    for key in pending:
+        results[key] = VersionConflict(f"Gave up updating record {key} after it changed {CAS_RETRIES} times in a row")
+    return results
+
+
+class AsyncDispatcher:
+    """
+    Runs manager methods for async handlers.
+    read() runs on the event loop when the manager or store can answer from memory (see in_memory() on them),
+    anything that may block (file I/O, fsync, a manager lock) goes to a dedicated executor,
+    so storage work never waits behind, or holds up, the server's shared threadpool.
+    """
+    def __init__(self, max_workers: Optional[int] = None) -> None:
+        self.max_workers = max_workers or IO_WORKERS
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="storage-io")
+        self.inline_reads = 0
+        self.offloaded = 0
+
+    async def read(self, method: Callable[..., Any], *args: Any) -> Any:
+        # `method` is bound to a manager or a store, e.g. manager.list_users_dict, db.version
+        if method.__self__.in_memory():
+            self.inline_reads += 1
+            # a few microseconds of dict lookups: left in the route phase rather than paying for a phase of its own
+            return method(*args)
+        return await self.write(method, *args)
+
+    async def write(self, method: Callable[..., Any], *args: Any) -> Any:
+        self.offloaded += 1
+        loop = asyncio.get_running_loop()
+        # the copied context carries the request's timer and profile session into the worker thread
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(
+            self._executor, functools.partial(context.run, profiled, timed, MANAGER, method, *args)
+        )
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=True)
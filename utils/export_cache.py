@@ -0,0 +1,103 @@
+# Export artifacts in out/, reused while the board is unchanged and evicted LRU under a disk budget
+
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Tuple
+
+EXPORT_CACHE_BYTES = int(os.environ.get("FACTWISE_EXPORT_CACHE_BYTES", str(256 * 1024 * 1024)))
+
+
+_VERSION = re.compile(r"\.v(\d+)\.txt$")
+
+
+def _parse(path: str) -> Tuple[str, int]:
+    # board id and version of an artifact, -1 for files written before versions existed
+    match = _VERSION.search(path)
+    return os.path.basename(path).split("_", 1)[0], int(match.group(1)) if match else -1
+
+
+class ExportCache:
+    """
+    One file per (board, version): out/<board_id>_<name>.v<version>.txt
+    A board's version changes with every write to it, so an existing file for the current version is up to date.
+    Files are kept in least-recently-used order; past `budget` bytes the oldest are deleted.
+    """
+    def __init__(self, directory: str = "out", budget: Optional[int] = None) -> None:
+        self.directory = directory
+        self.budget = EXPORT_CACHE_BYTES if budget is None else budget
+        self._lock = threading.Lock()
+        # path -> size, least recently used first
+        self._files: "OrderedDict[str, int]" = OrderedDict()
+        # board id -> (version, path) of its latest artifact
+        self._boards: Dict[str, Tuple[int, str]] = {}
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._scan()
+
+    def _scan(self) -> None:
+        # pick up artifacts from earlier runs, last used (mtime) order
+        if not os.path.isdir(self.directory):
+            return
+        found = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".txt"):
+                continue
+            path = f"{self.directory}/{name}"
+            st = os.stat(path)
+            found.append((st.st_mtime_ns, path, st.st_size))
+        for _, path, size in sorted(found):
+            self._files[path] = size
+            self._bytes += size
+            board_id, version = _parse(path)
+            if version >= self._boards.get(board_id, (-1, ""))[0]:
+                self._boards[board_id] = (version, path)
+
+    def path_for(self, board: Dict[str, Any]) -> str:
+        return f"{self.directory}/{board['id']}_{board['name'].replace(' ', '_')}.v{board.get('version', 0)}.txt"
+
+    def lookup(self, board: Dict[str, Any]) -> Optional[str]:
+        path = self.path_for(board)
+        with self._lock:
+            if path in self._files and os.path.exists(path):
+                self._files.move_to_end(path)
+                self.hits += 1
+                # keep the order across restarts
+                os.utime(path)
+                return path
+            self.misses += 1
+            return None
+
+    def add(self, board: Dict[str, Any], path: str) -> None:
+        version = board.get("version", 0)
+        with self._lock:
+            # older versions of the board can never be served again; an export that finished
+            # after a newer one keeps its file for the caller and just ages out of the LRU
+            previous = self._boards.get(board["id"])
+            if previous is None or previous[0] <= version:
+                if previous is not None and previous[1] != path:
+                    self._remove(previous[1])
+                self._boards[board["id"]] = (version, path)
+            self._bytes -= self._files.get(path, 0)
+            self._files[path] = os.path.getsize(path)
+            self._bytes += self._files[path]
+            self._files.move_to_end(path)
+            # the artifact just written stays even if it alone exceeds the budget
+            while self._bytes > self.budget and len(self._files) > 1:
+                self._remove(next(iter(self._files)))
+
+    def _remove(self, path: str) -> None:
+        self._bytes -= self._files.pop(path, 0)
+        board_id, _ = _parse(path)
+        if self._boards.get(board_id, (0, None))[1] == path:
+            del self._boards[board_id]
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def cache_info(self) -> Dict[str, int]:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "files": len(self._files), "bytes": self._bytes}
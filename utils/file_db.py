@@ -1,22 +1,756 @@
 # Helper util for JSON file persistance
 
+import bisect
+import functools
+import itertools
 import json
 import os
-from typing import Dict, Any
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Dict, Any, Callable, ContextManager, IO, Iterator, List, Optional, Sequence, Tuple
 
-class FileDB:
+from abstract_classes.storage_base import StorageBase
+from utils.concurrency import wait_durable
+from utils.metrics import STORAGE, timed, timed_storage
+
+try:
+    import fcntl
+except ImportError:
+    # no cross-process locking without fcntl (Windows); a single process is still safe
+    fcntl = None
+
+# Journaled mode appends one line per mutation to `<path>.journal` instead of rewriting the file.
+# The journal is folded into the snapshot once it passes either threshold.
+JOURNAL_MODE = os.environ.get("FILEDB_JOURNAL", "0") == "1"
+COMPACT_RECORDS = int(os.environ.get("FILEDB_COMPACT_RECORDS", "1000"))
+COMPACT_BYTES = int(os.environ.get("FILEDB_COMPACT_BYTES", str(4 * 1024 * 1024)))
+
+# Files are replaced by writing a temp file, fsyncing it and renaming it over the target,
+# so readers and crashes only ever see a complete file.
+# With a group commit window, writers arriving within that many ms share a single flush.
+FSYNC = os.environ.get("FILEDB_FSYNC", "1") == "1"
+GROUP_COMMIT_MS = float(os.environ.get("FILEDB_GROUP_COMMIT_MS", "0"))
+
+
+def _clone(value: Any) -> Any:
+    # cheaper than copy.deepcopy for plain JSON values
+    if isinstance(value, dict):
+        return {k: _clone(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_clone(v) for v in value]
+    return value
+
+
+def _index_keys(record: Dict[str, Any], fields: Tuple[str, ...]) -> List[Tuple[Any, ...]]:
+    # a list field is indexed under each of its elements, e.g. team["users"] gives user_id -> teams
+    keys: List[Tuple[Any, ...]] = [()]
+    for f in fields:
+        value = record.get(f)
+        options = value if isinstance(value, list) else [value]
+        keys = [key + (option,) for key in keys for option in options]
+    return keys
+
+
+def _matches(record: Dict[str, Any], field: str, value: Any) -> bool:
+    current = record.get(field)
+    return value in current if isinstance(current, list) else current == value
+
+
+def _fsync_dir(path: str) -> None:
+    # makes the rename itself durable
+    if not FSYNC:
+        return
+    fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _write_temp(path: str, dump: Callable[[IO], None], binary: bool = False) -> str:
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, 'wb' if binary else 'w') as file:
+            dump(file)
+            file.flush()
+            if FSYNC:
+                os.fsync(file.fileno())
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return tmp_path
+
+
+def _replace(tmp_path: str, path: str) -> None:
+    os.replace(tmp_path, path)
+    _fsync_dir(path)
+
+
+def _atomic_write(path: str, dump: Callable[[IO], None], binary: bool = False) -> None:
+    _replace(_write_temp(path, dump, binary), path)
+
+
+class _CacheEntry:
+    """
+    Parsed copy of one JSON file, shared by every FileDB opened on the same path in this process.
+    `stamp` identifies the snapshot and journal the data was built from.
+    """
     def __init__(self, path: str) -> None:
         self.path = path
+        self.lock = threading.RLock()
+        self.stamp: Optional[Tuple[int, ...]] = None
+        self.data: Optional[Dict[str, Any]] = None
+        self.hits = 0
+        self.misses = 0
+        # how much of the journal is already applied to `data`
+        self.journal_offset = 0
+        self.journal_records = 0
+        self.compactor: Optional[threading.Thread] = None
+        # group commit: writes up to `durable_seq` are on disk, `dirty` means the snapshot is behind `data`
+        # by the records in `pending`
+        self.commit_cond = threading.Condition()
+        self.write_seq = 0
+        self.durable_seq = 0
+        self.committing = False
+        self.dirty = False
+        self.pending: Dict[str, Optional[Dict[str, Any]]] = {}
+        self.failed: Optional[Tuple[int, Exception]] = None
+        # secondary indexes: fields -> {field values -> ids}, the inner dict used as an ordered set
+        self.indexes: Dict[Tuple[str, ...], Dict[Tuple[Any, ...], Dict[str, None]]] = {}
+        # every id in sorted order, for keyset pagination
+        self.keys: List[str] = []
+        # (fields, field values) -> the ids of that index bucket in sorted order, for find_page();
+        # built on the first page asked of a bucket and kept in step by set() from then on
+        self.sorted_buckets: Dict[Tuple[Tuple[str, ...], Tuple[Any, ...]], List[str]] = {}
+        # counts changes applied to `data`; `epoch` tells this process' counter apart from other processes'
+        self.version = 0
+        self.epoch = uuid.uuid4().hex[:8]
+        # `<path>.lock`, flocked while this process reads or writes the files; `lock_depth` counts nested holders
+        self.lock_file: Optional[IO] = None
+        self.lock_depth = 0
+        # the exclusive flock is kept from a group commit's first write until its flush, see FileDB._store()
+        self.commit_flock = False
+        # set while a writer of this process changes the files, until `stamp` is updated to match; see FileDB._rewriting()
+        self.rewriting = False
+        # mode -> [acquisitions, seconds spent waiting, longest wait]
+        self.lock_waits: Dict[str, List[float]] = {"shared": [0, 0.0, 0.0], "exclusive": [0, 0.0, 0.0]}
+        # json.load(s) of the snapshot or journal tail and json.dump(s) of a snapshot or journal record:
+        # kind -> [count, bytes, seconds, longest]
+        self.io: Dict[str, List[float]] = {"load": [0, 0, 0.0, 0.0], "dump": [0, 0, 0.0, 0.0]}
+
+    def record_lock_wait(self, mode: str, seconds: float) -> None:
+        stats = self.lock_waits[mode]
+        stats[0] += 1
+        stats[1] += seconds
+        stats[2] = max(stats[2], seconds)
+
+    def lock_info(self) -> Dict[str, Any]:
+        with self.lock:
+            info: Dict[str, Any] = {}
+            for mode, (count, total, longest) in self.lock_waits.items():
+                info[f"{mode}_acquired"] = int(count)
+                info[f"{mode}_wait_seconds"] = total
+                info[f"{mode}_max_wait_seconds"] = longest
+            return info
+
+    def record_io(self, kind: str, size: int, seconds: float) -> None:
+        # compaction serializes outside the file locks, hence the lock here
+        with self.lock:
+            stats = self.io[kind]
+            stats[0] += 1
+            stats[1] += size
+            stats[2] += seconds
+            stats[3] = max(stats[3], seconds)
+
+    def io_info(self) -> Dict[str, Any]:
+        with self.lock:
+            (reads, read_bytes, load_seconds, load_max), (writes, written, dump_seconds, dump_max) = self.io.values()
+            hits = self.hits
+        # what is on disk now, snapshot plus journal, whoever wrote it
+        size = 0
+        for path in (self.path, self.path + ".journal"):
+            try:
+                size += os.path.getsize(path)
+            except FileNotFoundError:
+                pass
+        return {
+            "file_bytes": size,
+            "reads": int(reads), "bytes_parsed": int(read_bytes),
+            "load_seconds": load_seconds, "load_max_seconds": load_max,
+            "writes": int(writes), "bytes_written": int(written),
+            "dump_seconds": dump_seconds, "dump_max_seconds": dump_max,
+            "cache_hits": hits,
+        }
+
+    def add_indexes(self, indexes: Sequence[Tuple[str, ...]]) -> None:
+        with self.lock:
+            for fields in indexes:
+                # "users[]" marks a list field for other backends; lists are always expanded here
+                fields = tuple(f[:-2] if f.endswith("[]") else f for f in fields)
+                if fields not in self.indexes:
+                    self.indexes[fields] = self._build(fields) if self.data is not None else {}
+
+    def _build(self, fields: Tuple[str, ...]) -> Dict[Tuple[Any, ...], Dict[str, None]]:
+        index: Dict[Tuple[Any, ...], Dict[str, None]] = {}
+        for key, record in self.data.items():
+            for value in _index_keys(record, fields):
+                index.setdefault(value, {})[key] = None
+        return index
+
+    def rebuild_indexes(self) -> None:
+        self.indexes = {fields: self._build(fields) for fields in self.indexes}
+        self.keys = sorted(self.data)
+        self.sorted_buckets = {}
+        self.version += 1
+
+    # data[key] = record, keeping the indexes in step; a None record deletes the key
+    def set(self, key: str, record: Optional[Dict[str, Any]]) -> None:
+        old = self.data.get(key)
+        if old is None and record is None:
+            return
+        for fields, index in self.indexes.items():
+            values = _index_keys(record, fields) if record is not None else []
+            old_values = _index_keys(old, fields) if old is not None else []
+            for old_value in old_values:
+                if old_value in values:
+                    continue
+                bucket = index.get(old_value)
+                if bucket is not None:
+                    bucket.pop(key, None)
+                    if not bucket:
+                        del index[old_value]
+                ids = self.sorted_buckets.get((fields, old_value))
+                if ids is not None:
+                    i = bisect.bisect_left(ids, key)
+                    if i < len(ids) and ids[i] == key:
+                        del ids[i]
+                    if not ids:
+                        del self.sorted_buckets[(fields, old_value)]
+            for value in values:
+                if value not in old_values:
+                    index.setdefault(value, {})[key] = None
+                    ids = self.sorted_buckets.get((fields, value))
+                    if ids is not None:
+                        bisect.insort(ids, key)
+        if record is None:
+            del self.keys[bisect.bisect_left(self.keys, key)]
+            del self.data[key]
+        else:
+            if old is None:
+                bisect.insort(self.keys, key)
+            self.data[key] = record
+        self.version += 1
+
+    def index_for(self, fields: Sequence[str]) -> Optional[Tuple[str, ...]]:
+        for index_fields in self.indexes:
+            if len(index_fields) == len(fields) and set(index_fields) == set(fields):
+                return index_fields
+        return None
+
+    def sorted_bucket(self, fields: Tuple[str, ...], value: Tuple[Any, ...]) -> List[str]:
+        with self.lock:
+            ids = self.sorted_buckets.get((fields, value))
+            if ids is None:
+                ids = sorted(self.indexes[fields].get(value, ()))
+                # an empty bucket is dropped by set(), nothing would keep its list in step
+                if ids:
+                    self.sorted_buckets[(fields, value)] = ids
+            return ids
+
+    # the index covering most of `fields`, for queries no index matches exactly, e.g. (board_id, user_id)
+    def narrowest_index(self, fields: Sequence[str]) -> Optional[Tuple[str, ...]]:
+        covering = [index_fields for index_fields in self.indexes if set(index_fields) <= set(fields)]
+        return max(covering, key=len, default=None)
+
+
+_entries: Dict[str, _CacheEntry] = {}
+_entries_lock = threading.Lock()
+
+
+def _get_entry(path: str) -> _CacheEntry:
+    key = os.path.abspath(path)
+    with _entries_lock:
+        if key not in _entries:
+            _entries[key] = _CacheEntry(key)
+        return _entries[key]
+
+
+def lock_info() -> Dict[str, Dict[str, Any]]:
+    # lock acquisitions and waits of every file this process has opened, by absolute path
+    with _entries_lock:
+        entries = dict(_entries)
+    return {path: entry.lock_info() for path, entry in entries.items()}
+
+
+def io_info() -> Dict[str, Dict[str, Any]]:
+    """
+    Parses, writes and size of every file this process has opened, by absolute path. `reads` counts the times
+    the file (or the new part of its journal) was actually parsed, `cache_hits` the reads served from memory.
+    """
+    with _entries_lock:
+        entries = dict(_entries)
+    return {path: entry.io_info() for path, entry in entries.items()}
+
+
+@timed_storage
+class FileDB(StorageBase):
+    # answered from the cache, so not wrapped by timed_storage: timing them would cost more than the lookup
+    memory_reads = ("get", "values", "page", "find", "find_page", "count", "__contains__", "version")
+
+    def __init__(self, path: str, journal: Optional[bool] = None,
+                 compact_records: Optional[int] = None, compact_bytes: Optional[int] = None,
+                 group_commit_ms: Optional[float] = None, indexes: Sequence[Tuple[str, ...]] = ()) -> None:
+        self.path = path
+        self.journal_path = path + ".journal"
+        self.journal = JOURNAL_MODE if journal is None else journal
+        self.compact_records = compact_records or COMPACT_RECORDS
+        self.compact_bytes = compact_bytes or COMPACT_BYTES
+        self.group_commit_ms = GROUP_COMMIT_MS if group_commit_ms is None else group_commit_ms
         os.makedirs(os.path.dirname(path), exist_ok=True)
         if not os.path.exists(path):
-            with open(path, 'w') as file:
-                json.dump({}, file)
+            _atomic_write(path, lambda file: json.dump({}, file))
+        self._entry = _get_entry(path)
+        self._entry.add_indexes(indexes)
+        # parse up front, so the first request doesn't pay for it and in_memory() holds from the start
+        self._load()
+
+    @contextmanager
+    def _locked(self, shared: bool) -> Iterator[None]:
+        """
+        Many readers or one writer per file, across processes (e.g. uvicorn workers): entry.lock keeps out
+        the other threads of this process, a flock on `<path>.lock` the other processes.
+        Writers hold it exclusively for their whole read-modify-write, so they can't lose each other's changes;
+        readers share it while parsing, so they never see half of a change (a journal append in progress,
+        or a compaction between its two renames). Reads answered from the cache take no lock at all.
+        Nested calls run under the outermost lock, which must be the exclusive one if any is.
+        """
+        entry = self._entry
+        start = time.perf_counter()
+        with entry.lock:
+            # while a group commit keeps the exclusive flock, this process already has the files to itself
+            outer = entry.lock_depth == 0 and not entry.commit_flock
+            if outer:
+                if fcntl is not None:
+                    if entry.lock_file is None:
+                        entry.lock_file = open(self.path + ".lock", "a")
+                    fcntl.flock(entry.lock_file.fileno(), fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+                entry.record_lock_wait("shared" if shared else "exclusive", time.perf_counter() - start)
+            entry.lock_depth += 1
+            try:
+                yield
+            finally:
+                entry.lock_depth -= 1
+                # a flush under this lock may have ended the group commit's hold
+                if entry.lock_depth == 0 and not entry.commit_flock and fcntl is not None and entry.lock_file is not None:
+                    fcntl.flock(entry.lock_file.fileno(), fcntl.LOCK_UN)
+
+    def _exclusive(self) -> ContextManager[None]:
+        return self._locked(shared=False)
+
+    @contextmanager
+    def _rewriting(self) -> Iterator[None]:
+        """
+        Around a change to the files under the exclusive lock, ending with entry.stamp updated to the new files.
+        In between, the files no longer match the stamp, and readers would take this process' own write for
+        another process' and wait for the lock to reload, an inline read holding up the event loop for a whole
+        fsync. Readers keep using the cached data instead: no other process can write while we hold the
+        exclusive flock, and the writer applies its records to the cache only once they are written, so it
+        holds what the files held before (plus, in a group commit's flush, the records already waiting on it).
+        """
+        entry = self._entry
+        entry.rewriting = True
+        try:
+            yield
+        finally:
+            entry.rewriting = False
+
+    # (inode, size, mtime) of the snapshot followed by (inode, size) of the journal, if any
+    def _stamp(self) -> Tuple[int, ...]:
+        st = os.stat(self.path)
+        try:
+            jst = os.stat(self.journal_path)
+            journal = (jst.st_ino, jst.st_size)
+        except FileNotFoundError:
+            journal = (0, 0)
+        return (st.st_ino, st.st_size, st.st_mtime_ns) + journal
+
+    # Returns the cached document, re-parsing only what another writer changed.
+    # The returned dict is shared: callers must not mutate it.
+    def _load(self) -> Dict[str, Any]:
+        entry = self._entry
+        # while a group commit is pending the stamp is still the last flushed one, and our copy is that plus `pending`
+        if entry.data is not None and (entry.rewriting or entry.stamp == self._stamp()):
+            entry.hits += 1
+            return entry.data
+        # reads answered above from memory aren't timed (see memory_reads), a reload is storage time
+        return timed(STORAGE, self._reload)
+
+    def _reload(self) -> Dict[str, Any]:
+        entry = self._entry
+        with self._locked(shared=True):
+            # no writer can change the files while we hold the shared lock
+            stamp = self._stamp()
+            if entry.data is not None and entry.stamp == stamp:
+                entry.hits += 1
+                return entry.data
+
+            old = entry.stamp
+            journal_grew = (
+                entry.data is not None and old[:3] == stamp[:3]
+                and old[3] in (0, stamp[3]) and stamp[4] >= entry.journal_offset
+            )
+            if journal_grew:
+                for op in self._read_journal(entry):
+                    entry.set(op["key"], op["value"])
+            else:
+                # snapshot replaced or journal rewritten: start over
+                start = time.perf_counter()
+                with open(self.path, 'r') as file:
+                    data = json.load(file)
+                # stamp[1] is the snapshot's size, stat'ed under the lock
+                entry.record_io("load", stamp[1], time.perf_counter() - start)
+                entry.journal_offset = 0
+                entry.journal_records = 0
+                for op in self._read_journal(entry):
+                    if op["value"] is None:
+                        data.pop(op["key"], None)
+                    else:
+                        data[op["key"]] = op["value"]
+                entry.data = data
+                entry.rebuild_indexes()
+            # the files changed under an unflushed group commit (a writer that ignores the lock file):
+            # our writes go on top of theirs instead of the flush overwriting them
+            for key, record in entry.pending.items():
+                entry.set(key, record)
+            entry.stamp = stamp
+            entry.misses += 1
+            return entry.data
+
+    # journal records appended after entry.journal_offset
+    def _read_journal(self, entry: _CacheEntry) -> List[Dict[str, Any]]:
+        try:
+            with open(self.journal_path, 'rb') as file:
+                file.seek(entry.journal_offset)
+                tail = file.read()
+        except FileNotFoundError:
+            return []
+        # a torn last line is an append still in progress (or lost in a crash); leave it for later
+        end = tail.rfind(b"\n") + 1
+        if not end:
+            return []
+        start = time.perf_counter()
+        lines = [json.loads(line) for line in tail[:end].splitlines() if line]
+        entry.record_io("load", end, time.perf_counter() - start)
+        entry.journal_records += len(lines)
+        entry.journal_offset += end
+        return [op for line in lines for op in line.get("batch", [line])]
+
+    # `changes`, if given, are the records `data` has on top of the cached copy: applied to it once on disk
+    def _dump(self, data: Dict[str, Any], changes: Optional[Dict[str, Optional[Dict[str, Any]]]] = None) -> None:
+        with self._rewriting():
+            try:
+                _atomic_write(self.path, lambda file: self._json_dump(data, file))
+                # `data` replaces everything, including what the journal had
+                if os.path.exists(self.journal_path):
+                    os.remove(self.journal_path)
+                    _fsync_dir(self.journal_path)
+            except Exception:
+                # never serve data that did not make it to disk
+                self._entry.data = None
+                self._entry.dirty = False
+                self._entry.pending = {}
+                self._entry.commit_flock = False
+                raise
+            if changes is not None:
+                for key, record in changes.items():
+                    self._entry.set(key, record)
+            elif data is not self._entry.data:
+                self._entry.data = data
+                self._entry.rebuild_indexes()
+            self._entry.dirty = False
+            self._entry.pending = {}
+            # the snapshot has everything, other processes may go ahead
+            self._entry.commit_flock = False
+            self._entry.journal_offset = 0
+            self._entry.journal_records = 0
+            self._entry.stamp = self._stamp()
+
+    def _json_dump(self, data: Dict[str, Any], file: IO) -> None:
+        start = time.perf_counter()
+        json.dump(data, file, indent=4)
+        self._entry.record_io("dump", file.tell(), time.perf_counter() - start)
+
+    def _append(self, records: Dict[str, Optional[Dict[str, Any]]], sync: bool = True) -> None:
+        entry = self._entry
+        ops = [{"key": key, "value": record} for key, record in records.items()]
+        # a batch is a single line, so a torn write drops all of it or none
+        start = time.perf_counter()
+        line = (json.dumps(ops[0] if len(ops) == 1 else {"batch": ops}) + "\n").encode()
+        entry.record_io("dump", len(line), time.perf_counter() - start)
+        with self._rewriting():
+            try:
+                with open(self.journal_path, 'ab') as file:
+                    if file.tell() > entry.journal_offset:
+                        # drop a torn record left by a crashed writer, or ours would be glued to it
+                        file.truncate(entry.journal_offset)
+                    file.write(line)
+                    if sync and FSYNC:
+                        file.flush()
+                        os.fsync(file.fileno())
+            except Exception:
+                entry.data = None
+                raise
+            for key, record in records.items():
+                entry.set(key, record)
+            entry.journal_offset += len(line)
+            entry.journal_records += 1
+            entry.stamp = self._stamp()
+
+        if entry.journal_records >= self.compact_records or entry.journal_offset >= self.compact_bytes:
+            if entry.compactor is None or not entry.compactor.is_alive():
+                entry.compactor = threading.Thread(target=self.compact, daemon=True)
+                entry.compactor.start()
+
+    def compact(self) -> None:
+        """
+        Fold the journal into a new snapshot. The snapshot is written outside the lock
+        so writers keep appending meanwhile; whatever they append is carried over to the new journal.
+        """
+        entry = self._entry
+        with entry.lock:
+            data = dict(self._load())
+            offset = entry.journal_offset
+            stamp = entry.stamp
+            if not offset:
+                return
+
+        tmp_path = _write_temp(self.path, lambda file: self._json_dump(data, file))
+
+        with self._exclusive():
+            self._load()
+            if entry.stamp[:4] != stamp[:4]:
+                # someone rewrote the snapshot or journal meanwhile, our copy is stale
+                os.remove(tmp_path)
+                return
+            with open(self.journal_path, 'rb') as file:
+                file.seek(offset)
+                tail = file.read()
+            tail = tail[:tail.rfind(b"\n") + 1]
+            # replaying the old journal over the new snapshot is harmless since records are whole-value upserts
+            # or deletes, so a crash between these two renames loses nothing
+            with self._rewriting():
+                _replace(tmp_path, self.path)
+                _atomic_write(self.journal_path, lambda file: file.write(tail), binary=True)
+                entry.journal_offset = len(tail)
+                entry.journal_records = tail.count(b"\n")
+                entry.stamp = self._stamp()
 
     def read(self) -> Dict[str, Any]:
-        # if not os.path.exists(self.path): return {}
-        with open(self.path, 'r') as file:
-            return json.load(file)
+        # private copy, safe for the caller to modify and write() back
+        data = dict(self._load())
+        return {key: _clone(record) for key, record in data.items()}
 
     def write(self, data: Dict[str, Any]) -> None:
-        with open(self.path, 'w') as file:
-            json.dump(data, file, indent=4)
+        # the cache takes ownership of `data`
+        with self._exclusive():
+            self._dump(data)
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        record = self._load().get(key)
+        return _clone(record) if record is not None else None
+
+    def put(self, key: str, record: Dict[str, Any]) -> None:
+        self.put_many({key: record})
+
+    def put_many(self, records: Dict[str, Dict[str, Any]]) -> None:
+        # journaled writes cost the size of the records, not of the whole file
+        if not records:
+            return
+        with self._exclusive():
+            seq = self._store(records)
+        if self.group_commit_ms:
+            wait_durable(functools.partial(self._group_commit, seq))
+
+    def delete_many(self, keys: List[str]) -> None:
+        # stored as None records: a journal record with a null value deletes its key on replay
+        with self._exclusive():
+            data = self._load()
+            tombstones: Dict[str, Optional[Dict[str, Any]]] = {key: None for key in keys if key in data}
+            seq = self._store(tombstones) if tombstones else None
+        if self.group_commit_ms and seq is not None:
+            wait_durable(functools.partial(self._group_commit, seq))
+
+    def compare_and_put(self, records: Dict[str, Dict[str, Any]]) -> List[str]:
+        # the check and the write happen under the exclusive lock, after _load() picked up other processes' writes
+        with self._exclusive():
+            data = self._load()
+            stale = [
+                key for key, record in records.items()
+                if key not in data or data[key].get("version", 0) != record.get("version", 0)
+            ]
+            fresh = {key: record for key, record in records.items() if key not in stale}
+            for record in fresh.values():
+                record["version"] = record.get("version", 0) + 1
+            seq = self._store(fresh) if fresh else None
+        if self.group_commit_ms and seq is not None:
+            wait_durable(functools.partial(self._group_commit, seq))
+        return stale
+
+    # put_many() under the exclusive lock, returns the write's sequence number for the group commit
+    def _store(self, records: Dict[str, Optional[Dict[str, Any]]]) -> int:
+        entry = self._entry
+        data = self._load()
+        # a live journal is always appended to, so replaying it can never roll back a newer snapshot
+        if self.journal or entry.journal_offset:
+            self._append(records, sync=not self.group_commit_ms)
+        elif self.group_commit_ms:
+            for key, record in records.items():
+                entry.set(key, record)
+            # persisted by the group commit below. Until then other processes must not read the file, it lacks
+            # these records, nor write it, the flush would overwrite them: the exclusive flock stays held
+            entry.dirty = True
+            entry.pending.update(records)
+            entry.commit_flock = True
+        else:
+            # written from a copy: lock-free readers must not see the records before they are on disk,
+            # nor keep them if the write fails
+            updated = dict(data)
+            for key, record in records.items():
+                if record is None:
+                    updated.pop(key, None)
+                else:
+                    updated[key] = record
+            self._dump(updated, records)
+        entry.write_seq += 1
+        return entry.write_seq
+
+    def _group_commit(self, seq: int) -> None:
+        # returns once write `seq` is durable; the first writer to arrive flushes for the whole group
+        entry = self._entry
+        with entry.commit_cond:
+            while entry.durable_seq < seq and entry.committing:
+                entry.commit_cond.wait()
+            if entry.failed is not None and seq <= entry.failed[0]:
+                # the flush carrying this write failed, and its data was dropped with the cache
+                raise entry.failed[1]
+            if entry.durable_seq >= seq:
+                return
+            entry.committing = True
+
+        pending = seq
+        try:
+            # give concurrent writers a chance to join this flush
+            time.sleep(self.group_commit_ms / 1000)
+            with self._exclusive():
+                pending = entry.write_seq
+                if entry.dirty:
+                    self._dump(entry.data)
+                elif FSYNC and os.path.exists(self.journal_path):
+                    with open(self.journal_path, 'ab') as file:
+                        os.fsync(file.fileno())
+            with entry.commit_cond:
+                entry.durable_seq = max(entry.durable_seq, pending)
+        except Exception as exc:
+            with entry.commit_cond:
+                entry.failed = (pending, exc)
+            raise
+        finally:
+            with entry.commit_cond:
+                entry.committing = False
+                entry.commit_cond.notify_all()
+
+    def values(self) -> List[Dict[str, Any]]:
+        # snapshot of the records; records are shared and must be treated as read-only
+        return list(self._load().values())
+
+    def page(self, after: Optional[str], limit: int) -> List[Dict[str, Any]]:
+        data = self._load()
+        keys = self._entry.keys
+        start = bisect.bisect_right(keys, after) if after is not None else 0
+        records = [data.get(key) for key in keys[start:start + limit]]
+        return [record for record in records if record is not None]
+
+    def find(self, **fields: Any) -> List[Dict[str, Any]]:
+        data = self._load()
+        index_fields = self._entry.index_for(list(fields)) or self._entry.narrowest_index(list(fields))
+        if index_fields is None:
+            candidates = list(data.values())
+        else:
+            ids = list(self._entry.indexes[index_fields].get(tuple(fields[f] for f in index_fields), ()))
+            candidates = [data.get(key) for key in ids]
+        # re-check the fields, an index can briefly run ahead of a concurrent reader
+        return [
+            record for record in candidates
+            if record is not None and all(_matches(record, f, v) for f, v in fields.items())
+        ]
+
+    def find_page(self, after: Optional[str], limit: int, **fields: Any) -> List[Dict[str, Any]]:
+        return list(itertools.islice(self.iter_find(after, limit, **fields), limit))
+
+    def iter_find(self, after: Optional[str], batch: int, **fields: Any) -> Iterator[Dict[str, Any]]:
+        data = self._load()
+        index_fields = self._entry.index_for(list(fields)) or self._entry.narrowest_index(list(fields))
+        if index_fields is None:
+            keys = self._entry.keys
+        else:
+            keys = self._entry.sorted_bucket(index_fields, tuple(fields[f] for f in index_fields))
+        # the bucket is walked a slice at a time, each found by bisecting from the last id seen:
+        # writers insert into the list meanwhile, and an index only narrowing the query leaves records to skip
+        while True:
+            start = bisect.bisect_right(keys, after) if after is not None else 0
+            chunk = keys[start:start + batch]
+            if not chunk:
+                return
+            after = chunk[-1]
+            for key in chunk:
+                record = data.get(key)
+                if record is not None and all(_matches(record, f, v) for f, v in fields.items()):
+                    yield record
+
+    def count(self, **fields: Any) -> int:
+        # an index bucket is a ready-made counter, e.g. tasks per (board_id, status)
+        self._load()
+        index_fields = self._entry.index_for(list(fields))
+        if index_fields is None:
+            return len(self.find(**fields))
+        return len(self._entry.indexes[index_fields].get(tuple(fields[f] for f in index_fields), ()))
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._load()
+
+    def version(self) -> str:
+        # a stat, plus a reload only if another process changed the file
+        self._load()
+        return f"{self._entry.epoch}.{self._entry.version}"
+
+    def in_memory(self) -> bool:
+        # the same check as the _load() fast path: one stat, no parsing
+        entry = self._entry
+        if entry.data is None:
+            return False
+        try:
+            return entry.rewriting or entry.stamp == self._stamp()
+        except FileNotFoundError:
+            return False
+
+    def close(self) -> None:
+        entry = self._entry
+        # a group commit may still be waiting out its window
+        with self._exclusive():
+            if entry.dirty:
+                self._dump(entry.data)
+        compactor = entry.compactor
+        if compactor is not None:
+            compactor.join()
+
+    def cache_info(self) -> Dict[str, int]:
+        return {"hits": self._entry.hits, "misses": self._entry.misses}
+
+    def lock_info(self) -> Dict[str, Any]:
+        return self._entry.lock_info()
+
+    def io_info(self) -> Dict[str, Any]:
+        return self._entry.io_info()
@@ -0,0 +1,70 @@
+# Background jobs on a shared worker pool, e.g. board exports
+
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Any, Callable, Optional
+
+EXPORT_WORKERS = int(os.environ.get("FACTWISE_EXPORT_WORKERS", "4"))
+
+# reports progress as (items done, items total)
+Progress = Callable[[int, int], None]
+
+
+class JobPool:
+    """
+    Runs `work(progress)` on a thread pool and keeps a status record per job:
+    PENDING -> RUNNING -> DONE (with the dict `work` returned merged in) or FAILED (with the error).
+    Only the latest `keep` jobs are remembered.
+    """
+    def __init__(self, max_workers: Optional[int] = None, keep: int = 1000) -> None:
+        self._executor = ThreadPoolExecutor(max_workers=max_workers or EXPORT_WORKERS, thread_name_prefix="job")
+        self._jobs: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._futures: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self._keep = keep
+
+    def submit(self, work: Callable[[Progress], Dict[str, Any]], **info: Any) -> Dict[str, Any]:
+        job_id = str(uuid.uuid4())
+        job = {"job_id": job_id, "status": "PENDING", "progress": 0.0, "error": None, **info}
+        with self._lock:
+            self._jobs[job_id] = job
+            while len(self._jobs) > self._keep:
+                old_id, _ = self._jobs.popitem(last=False)
+                self._futures.pop(old_id, None)
+            self._futures[job_id] = self._executor.submit(self._run, job, work)
+            return dict(job)
+
+    def _run(self, job: Dict[str, Any], work: Callable[[Progress], Dict[str, Any]]) -> None:
+        def progress(done: int, total: int) -> None:
+            job["progress"] = done / total if total else 1.0
+
+        job["status"] = "RUNNING"
+        try:
+            result = work(progress)
+        except Exception as exc:
+            job["error"] = str(exc)
+            job["status"] = "FAILED"
+            return
+        job.update(result)
+        job["progress"] = 1.0
+        job["status"] = "DONE"
+
+    def status(self, job_id: str) -> Dict[str, Any]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                raise ValueError(f"Job id:{job_id} not found")
+            return dict(job)
+
+    def wait(self, job_id: str, timeout: Optional[float] = None) -> Dict[str, Any]:
+        with self._lock:
+            future = self._futures.get(job_id)
+        if future is not None:
+            future.result(timeout)
+        return self.status(job_id)
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,340 @@
+# Request and storage metrics in the Prometheus text format, and the per-request phase timer behind Server-Timing
+
+import bisect
+import functools
+import os
+from collections import Counter
+from contextvars import ContextVar
+from itertools import groupby, repeat
+from operator import add, attrgetter, itemgetter
+from time import perf_counter
+from typing import Any, Callable, Dict, List, Optional, Tuple, TypeVar
+
+from abstract_classes.storage_base import StorageBase
+
+C = TypeVar("C", bound=type)
+R = TypeVar("R")
+
+# FACTWISE_METRICS=0 leaves the API uninstrumented
+METRICS_ENABLED = os.environ.get("FACTWISE_METRICS", "1") != "0"
+# FACTWISE_SERVER_TIMING=1 also splits every request into phases, for the Server-Timing header and the phase
+# counters; off by default, the per-request timer and the header cost more than the rest of the metrics together
+SERVER_TIMING = METRICS_ENABLED and os.environ.get("FACTWISE_SERVER_TIMING", "0") == "1"
+# requests Metrics.record() queues before counting them; each keeps its scope, and the response in it, until then
+RECORD_BATCH = 128
+
+# ASGI scope keys a request's outcome is left under, for Metrics to read once the request is done instead of
+# the middleware watching every message it sends: the Response (routes and exception handlers), the exception
+# type, the bytes sent of a streamed body, and the request's phases with Server-Timing on
+RESPONSE_KEY = "factwise.response"
+ERROR_KEY = "factwise.error"
+STREAMED_KEY = "factwise.streamed"
+PHASES_KEY = "factwise.phases"
+# route label of requests no route matched (404s), so random paths don't each get a series
+UNMATCHED = "<unmatched>"
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (64, 256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+# phases are slots of a list rather than dict keys, this runs several times per request.
+# "validation" is the request's time outside the handler: routing, body parsing, request and response model
+# validation, encoding; timing it as what's left over spares every request a layer of its own
+PHASES = ("validation", "route", "manager", "storage")
+VALIDATION, ROUTE, MANAGER, STORAGE = range(len(PHASES))
+_SERVER_TIMING = ", ".join(f"{phase};dur=%.3f" for phase in PHASES + ("total",)).encode()
+
+
+class RequestTimer:
+    """
+    Splits one request's time into phases. Phases nest (storage calls run inside manager calls, which run
+    inside the route), and each phase only gets its own time: entering a phase pauses the enclosing one.
+    """
+    __slots__ = ("spent", "_stack", "_mark")
+
+    def __init__(self) -> None:
+        # seconds per phase, indexed by VALIDATION, ROUTE, MANAGER, STORAGE
+        self.spent = [0.0] * len(PHASES)
+        self._stack = [VALIDATION]
+        self._mark = perf_counter()
+
+    def enter(self, phase: int) -> None:
+        now = perf_counter()
+        self.spent[self._stack[-1]] += now - self._mark
+        self._stack.append(phase)
+        self._mark = now
+
+    def exit(self) -> None:
+        now = perf_counter()
+        self.spent[self._stack.pop()] += now - self._mark
+        self._mark = now
+
+    def server_timing(self, total: float) -> bytes:
+        # milliseconds, as the header wants them; validation is what the other phases leave over of `total`
+        spent = self.spent
+        validation = total - spent[1] - spent[2] - spent[3]
+        return _SERVER_TIMING % (validation * 1e3, spent[1] * 1e3, spent[2] * 1e3, spent[3] * 1e3, total * 1e3)
+
+    def close(self, total: float) -> List[float]:
+        # the phases of a request that took `total` seconds, validation being what the others leave over
+        spent = self.spent
+        spent[VALIDATION] = total - spent[ROUTE] - spent[MANAGER] - spent[STORAGE]
+        return spent
+
+
+# the timer of the request being handled; run_in_executor() callers must copy the context to keep it
+_current: ContextVar[Optional[RequestTimer]] = ContextVar("factwise_request_timer", default=None)
+
+# the running request's RequestTimer, None outside requests (startup, export jobs, tests)
+current_timer = _current.get
+
+
+def start_timer() -> Tuple[RequestTimer, Any]:
+    timer = RequestTimer()
+    return timer, _current.set(timer)
+
+
+def stop_timer(token: Any) -> None:
+    _current.reset(token)
+
+
+class _Unanswered:
+    # stands in for the response of a request that ended without one, e.g. cancelled when the client went away
+    status_code = 500
+    body = b""
+
+
+def note_error(scope: Dict[str, Any], exc: BaseException, response: R) -> R:
+    # `response` answers `exc`; the exception type is counted whether a handler answered it or not
+    scope[ERROR_KEY] = type(exc).__name__
+    scope[RESPONSE_KEY] = response
+    return response
+
+
+def timed(phase: int, func: Callable[..., Any], *args: Any) -> Any:
+    # func(*args), its time charged to `phase` of the current request, if any
+    timer = _current.get()
+    if timer is None:
+        return func(*args)
+    timer.enter(phase)
+    try:
+        return func(*args)
+    finally:
+        timer.exit()
+
+
+def _timed_method(phase: int, method: Callable[..., Any]) -> Callable[..., Any]:
+    @functools.wraps(method)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        timer = _current.get()
+        if timer is None:
+            return method(*args, **kwargs)
+        timer.enter(phase)
+        try:
+            return method(*args, **kwargs)
+        finally:
+            timer.exit()
+    return wrapper
+
+
+def timed_storage(cls: C) -> C:
+    """
+    Class decorator for storage backends: every StorageBase method counts as "storage" time, except the ones
+    the class lists in `memory_reads`, which the backend answers from memory and times itself when they do I/O.
+    put() calling put_many() is still one storage phase, the inner call just nests in it.
+    """
+    if not METRICS_ENABLED:
+        return cls
+    for name in StorageBase.__abstractmethods__ - set(getattr(cls, "memory_reads", ())):
+        setattr(cls, name, _timed_method(STORAGE, getattr(cls, name)))
+    return cls
+
+
+class RouteStats:
+    """
+    Everything recorded for one (method, route). Histogram counts are per bucket, made cumulative
+    when rendered; the last slot is +Inf.
+    """
+    __slots__ = ("statuses", "errors", "latency", "latency_sum", "request_size", "request_bytes",
+                 "response_size", "response_bytes", "phases")
+
+    def __init__(self) -> None:
+        self.statuses: Dict[int, int] = {}
+        self.errors: Dict[str, int] = {}
+        self.latency = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.latency_sum = 0.0
+        self.request_size = [0] * (len(SIZE_BUCKETS) + 1)
+        self.request_bytes = 0
+        self.response_size = [0] * (len(SIZE_BUCKETS) + 1)
+        self.response_bytes = 0
+        self.phases = [0.0] * len(PHASES)
+
+
+def _histogram(counts: List[int], bounds: Tuple[float, ...], values: List[Any]) -> None:
+    # adds `values` to the per-bucket `counts`: sorted once, then split at each bound, rather than a search each
+    values.sort()
+    low = 0
+    for index, bound in enumerate(bounds):
+        high = bisect.bisect_right(values, bound, low)
+        counts[index] += high - low
+        low = high
+    counts[-1] += len(values) - low
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(**labels: Any) -> str:
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + "}"
+
+
+class Metrics:
+    """
+    Per-route request counters and histograms; the route is the path template (/api/v1/users/describe),
+    never the raw path, to keep the label set bounded. Only the event loop records, so there is no lock.
+    """
+    def __init__(self, phases: bool = SERVER_TIMING) -> None:
+        self.routes: Dict[Tuple[str, str], RouteStats] = {}
+        # whether the phase counters are rendered, they stay at zero unless requests are split into phases
+        self.phases = phases
+        # the RouteStats of each (method, id of the route object) seen, bound once so counting a request doesn't
+        # build its labels; routes aren't hashable, and live as long as the app
+        self._children: Dict[Tuple[str, int], RouteStats] = {}
+        # requests recorded but not yet counted, see record()
+        self._queued: List[Tuple[Any, ...]] = []
+
+    def labels(self, method: str, route: str) -> RouteStats:
+        stats = self.routes.get((method, route))
+        if stats is None:
+            stats = self.routes[(method, route)] = RouteStats()
+        return stats
+
+    def record(self, scope: Dict[str, Any], seconds: float) -> None:
+        # the finished request's `scope`, with its outcome under the keys above; queued and counted RECORD_BATCH
+        # at a time, a column at a time: counting each request on its own costs more than the rest of the
+        # instrumentation together
+        queued = self._queued
+        queued.append((scope, seconds))
+        if len(queued) >= RECORD_BATCH:
+            self._count()
+
+    def _count(self) -> None:
+        queued, self._queued = self._queued, []
+        scopes = list(map(itemgetter(0), queued))
+        keys = zip(map(itemgetter("method"), scopes), map(id, map(dict.get, scopes, repeat("route"))))
+        # grouped by (method, route): sorted on the key, the position breaking ties so the requests aren't compared
+        for key, group in groupby(sorted(zip(keys, range(len(queued)), queued)), itemgetter(0)):
+            batch = list(map(itemgetter(2), group))
+            stats = self._children.get(key)
+            if stats is None:
+                scope = batch[0][0]
+                route = scope.get("route")
+                stats = self._children[key] = self.labels(
+                    scope["method"], route.path if route is not None else UNMATCHED
+                )
+            self._count_route(stats, batch)
+
+    def _count_route(self, stats: RouteStats, batch: List[Tuple[Dict[str, Any], float]]) -> None:
+        # map() over the scopes rather than a loop, there is no Python code run per request
+        scopes, seconds = map(list, zip(*batch))
+        responses = list(map(dict.get, scopes, repeat(RESPONSE_KEY), repeat(_Unanswered)))
+        for status, count in Counter(map(attrgetter("status_code"), responses)).items():
+            stats.statuses[status] = stats.statuses.get(status, 0) + count
+        for error, count in Counter(map(dict.get, scopes, repeat(ERROR_KEY))).items():
+            if error is not None:
+                stats.errors[error] = stats.errors.get(error, 0) + count
+        stats.latency_sum += sum(seconds)
+        _histogram(stats.latency, LATENCY_BUCKETS, seconds)
+        # request size as declared by the client, cheaper than counting the body on its way to the handler
+        headers = map(dict, map(itemgetter("headers"), scopes))
+        lengths = list(map(dict.get, headers, repeat(b"content-length"), repeat(b"")))
+        sizes = {length: int(length) if length.isdigit() else 0 for length in set(lengths)}
+        request_bytes = list(map(sizes.__getitem__, lengths))
+        stats.request_bytes += sum(request_bytes)
+        _histogram(stats.request_size, SIZE_BUCKETS, request_bytes)
+        # a streamed response has no body, its size was added up as it was sent
+        bodies = map(len, map(getattr, responses, repeat("body"), repeat(b"")))
+        response_bytes = list(map(add, bodies, map(dict.get, scopes, repeat(STREAMED_KEY), repeat(0))))
+        stats.response_bytes += sum(response_bytes)
+        _histogram(stats.response_size, SIZE_BUCKETS, response_bytes)
+        if self.phases:
+            for spent in map(dict.get, scopes, repeat(PHASES_KEY)):
+                if spent is not None:
+                    for index, phase_seconds in enumerate(spent):
+                        stats.phases[index] += phase_seconds
+
+    def render(self) -> str:
+        self._count()
+        lines: List[str] = []
+        routes = sorted(self.routes.items())
+
+        def header(name: str, kind: str, help_text: str) -> None:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        def histogram(name: str, method: str, route: str, bounds: Tuple[float, ...], counts: List[int],
+                      total: float) -> None:
+            cumulative = 0
+            for bound, count in zip(bounds + ("+Inf",), counts):
+                cumulative += count
+                lines.append(f"{name}_bucket{_labels(method=method, route=route, le=bound)} {cumulative}")
+            lines.append(f"{name}_sum{_labels(method=method, route=route)} {total}")
+            lines.append(f"{name}_count{_labels(method=method, route=route)} {cumulative}")
+
+        header("factwise_http_requests_total", "counter", "Requests handled, by route and status code.")
+        for (method, route), stats in routes:
+            for status, count in sorted(stats.statuses.items()):
+                lines.append(f"factwise_http_requests_total{_labels(method=method, route=route, status=status)} {count}")
+        header("factwise_http_request_errors_total", "counter",
+               "Requests that raised, by route and exception type, including the ones answered with a 4xx/5xx.")
+        for (method, route), stats in routes:
+            for error, count in sorted(stats.errors.items()):
+                lines.append(
+                    f"factwise_http_request_errors_total{_labels(method=method, route=route, exception=error)} {count}"
+                )
+        header("factwise_http_request_duration_seconds", "histogram", "Time from request to the end of the response.")
+        for (method, route), stats in routes:
+            histogram("factwise_http_request_duration_seconds", method, route, LATENCY_BUCKETS,
+                      stats.latency, stats.latency_sum)
+        header("factwise_http_request_size_bytes", "histogram", "Request body size.")
+        for (method, route), stats in routes:
+            histogram("factwise_http_request_size_bytes", method, route, SIZE_BUCKETS,
+                      stats.request_size, stats.request_bytes)
+        header("factwise_http_response_size_bytes", "histogram", "Response body size.")
+        for (method, route), stats in routes:
+            histogram("factwise_http_response_size_bytes", method, route, SIZE_BUCKETS,
+                      stats.response_size, stats.response_bytes)
+        if not self.phases:
+            return "\n".join(lines) + "\n"
+        header("factwise_http_request_phase_seconds_total", "counter",
+               "Time spent in each phase of the requests: " + ", ".join(PHASES) + ".")
+        for (method, route), stats in routes:
+            for phase, seconds in zip(PHASES, stats.phases):
+                lines.append(
+                    f"factwise_http_request_phase_seconds_total{_labels(method=method, route=route, phase=phase)} {seconds}"
+                )
+        return "\n".join(lines) + "\n"
+
+
+# (io_info() field, metric, type, help) of the storage file metrics
+_FILE_METRICS = [
+    ("file_bytes", "factwise_storage_file_bytes", "gauge", "Current size of the file, journal included."),
+    ("reads", "factwise_storage_reads_total", "counter", "Times the file or its journal tail was parsed."),
+    ("bytes_parsed", "factwise_storage_read_bytes_total", "counter", "Bytes parsed."),
+    ("load_seconds", "factwise_storage_load_seconds_total", "counter", "Time spent in json.load."),
+    ("writes", "factwise_storage_writes_total", "counter", "Snapshots and journal records serialized."),
+    ("bytes_written", "factwise_storage_written_bytes_total", "counter", "Bytes serialized."),
+    ("dump_seconds", "factwise_storage_dump_seconds_total", "counter", "Time spent in json.dump."),
+    ("cache_hits", "factwise_storage_cache_hits_total", "counter", "Reads served from the parsed copy in memory."),
+]
+
+
+def render_files(files: Dict[str, Dict[str, Any]]) -> str:
+    # file_db.io_info() in the exposition format, one series per file
+    lines: List[str] = []
+    for field, name, kind, help_text in _FILE_METRICS:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for path, info in sorted(files.items()):
+            lines.append(f"{name}{_labels(file=path)} {info[field]}")
+    return "\n".join(lines) + "\n"
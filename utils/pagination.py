@@ -0,0 +1,78 @@
+# Keyset pagination for the list endpoints
+# A cursor is the id of the last record on the previous page, base64-encoded so clients treat it as opaque
+
+import base64
+import binascii
+import bisect
+import itertools
+from typing import Dict, Any, Callable, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from abstract_classes.storage_base import StorageBase
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+
+def encode_cursor(key: str) -> str:
+    return base64.urlsafe_b64encode(key.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: Optional[str]) -> Optional[str]:
+    if not cursor:
+        return None
+    try:
+        return base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+    except (binascii.Error, UnicodeDecodeError):
+        raise ValueError(f"Invalid cursor: {cursor}")
+
+
+def _check_limit(limit: int) -> None:
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        raise ValueError(f"limit must be 1-{MAX_PAGE_SIZE}\nGiven limit: {limit}")
+
+
+def paginate(db: StorageBase, cursor: Optional[str], limit: int) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    # records of one page in id order, and the cursor of the next page (None on the last one)
+    _check_limit(limit)
+    # one extra record tells whether another page follows
+    records = db.page(decode_cursor(cursor), limit + 1)
+    if len(records) <= limit:
+        return records, None
+    return records[:limit], encode_cursor(records[limit - 1]["id"])
+
+
+def paginate_find(db: StorageBase, cursor: Optional[str], limit: int, fields: Dict[str, Any],
+                  where: Optional[Callable[[Dict[str, Any]], bool]] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    # same as paginate() over the records db.find(**fields) returns, those `where` rejects left out
+    _check_limit(limit)
+    # one walk of the index from the cursor, however many records `where` rejects on the way
+    matches: Iterable[Dict[str, Any]] = db.iter_find(decode_cursor(cursor), limit + 1, **fields)
+    if where is not None:
+        matches = filter(where, matches)
+    records = list(itertools.islice(matches, limit + 1))
+    if len(records) <= limit:
+        return records, None
+    return records[:limit], encode_cursor(records[limit - 1]["id"])
+
+
+def paginate_ids(ids: Sequence[str], cursor: Optional[str], limit: int) -> Tuple[List[str], Optional[str]]:
+    # same as paginate() over a small in-memory list of ids, e.g. the members of a team
+    _check_limit(limit)
+    ids = sorted(ids)
+    after = decode_cursor(cursor)
+    start = bisect.bisect_right(ids, after) if after is not None else 0
+    page = ids[start:start + limit]
+    if start + limit >= len(ids):
+        return page, None
+    return page, encode_cursor(page[-1])
+
+
+def iterate(db: StorageBase, batch: int = DEFAULT_PAGE_SIZE) -> Iterator[Dict[str, Any]]:
+    # every record in id order, holding at most one batch at a time
+    after = None
+    while True:
+        records = db.page(after, batch)
+        yield from records
+        if len(records) < batch:
+            return
+        after = records[-1]["id"]
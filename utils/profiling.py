@@ -0,0 +1,160 @@
+# On-demand cProfile of single requests, dumped to profiles/ and summarised for the admin API
+
+import cProfile
+import os
+import pstats
+import random
+import re
+import time
+from collections import deque
+from contextvars import ContextVar
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+PROFILE_DIR = os.environ.get("FACTWISE_PROFILE_DIR", "profiles")
+# fraction of all requests profiled without being asked, 0 to 1
+PROFILE_SAMPLE = float(os.environ.get("FACTWISE_PROFILE_SAMPLE", "0"))
+# FACTWISE_PROFILE_HEADER=1 lets an X-Profile request header ask for a profile; off by default, so
+# clients can't make the server profile and dump their requests unless an admin allows it
+PROFILE_HEADER = os.environ.get("FACTWISE_PROFILE_HEADER", "0") == "1"
+# dumps kept on disk and listed by the admin API, older ones are deleted
+PROFILE_KEEP = int(os.environ.get("FACTWISE_PROFILE_KEEP", "50"))
+
+# pstats entry: (primitive calls, calls, own time, cumulative time, callers)
+SORT_KEYS = {"cumulative": 3, "tottime": 2, "calls": 1}
+
+
+class ProfileSession:
+    """
+    One profiled request: a profile of the event loop thread while the request runs, plus one per
+    storage executor call made for it (see profiled()). Requests interleaving with it on the event loop
+    show up in the loop profile too, which is why only one request is profiled at a time.
+    """
+    def __init__(self) -> None:
+        self.loop_profile = cProfile.Profile()
+        self.thread_profiles: List[cProfile.Profile] = []
+
+    def stats(self) -> pstats.Stats:
+        stats = pstats.Stats(self.loop_profile)
+        for profile in self.thread_profiles:
+            stats.add(profile)
+        return stats
+
+
+_session: ContextVar[Optional[ProfileSession]] = ContextVar("factwise_profile_session", default=None)
+
+
+def profiled(func: Callable[..., Any], *args: Any) -> Any:
+    # func(*args) in a worker thread, under its own profile if the request it runs for is being profiled
+    session = _session.get()
+    if session is None:
+        return func(*args)
+    profile = cProfile.Profile()
+    try:
+        profile.enable()
+    except ValueError:
+        # Python 3.12+ allows a single active profiler per interpreter; the loop profile has it
+        return func(*args)
+    try:
+        return func(*args)
+    finally:
+        profile.disable()
+        session.thread_profiles.append(profile)
+
+
+def _slug(route: str) -> str:
+    return re.sub(r"[^A-Za-z0-9]+", "_", route).strip("_") or "root"
+
+
+class Profiler:
+    """
+    Decides which requests to profile (X-Profile header or the sample rate, both changeable at runtime
+    through the admin API) and writes their stats to `directory` as
+    <time>_<pid>_<method>_<route>_<duration>ms.prof, readable with pstats or snakeviz.
+    Lives on the event loop, like the middleware using it, so it needs no lock.
+    """
+    def __init__(self, directory: str = PROFILE_DIR, sample_rate: float = PROFILE_SAMPLE,
+                 header: bool = PROFILE_HEADER, keep: int = PROFILE_KEEP) -> None:
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.header = header
+        self.keep = keep
+        # newest last: {"file", "method", "route", "status", "duration_ms"}
+        self.recent: Deque[Dict[str, Any]] = deque()
+        self.active = False
+        self.profiled = 0
+        # wanted while another request was being profiled
+        self.skipped = 0
+
+    def wanted(self, headers: List[Tuple[bytes, bytes]]) -> bool:
+        if self.sample_rate and random.random() < self.sample_rate:
+            return True
+        if self.header:
+            for name, value in headers:
+                if name == b"x-profile":
+                    return value not in (b"", b"0")
+        return False
+
+    def start(self) -> Optional[Tuple[ProfileSession, Any]]:
+        # None if another request holds the profiler
+        if self.active:
+            self.skipped += 1
+            return None
+        session = ProfileSession()
+        try:
+            session.loop_profile.enable()
+        except ValueError:
+            # some other profiler is running in this process
+            self.skipped += 1
+            return None
+        self.active = True
+        return session, _session.set(session)
+
+    def finish(self, session: ProfileSession, token: Any, method: str, route: str, status: int,
+               seconds: float) -> str:
+        session.loop_profile.disable()
+        _session.reset(token)
+        self.active = False
+        self.profiled += 1
+        os.makedirs(self.directory, exist_ok=True)
+        now = time.time()
+        stamp = time.strftime("%Y%m%dT%H%M%S", time.localtime(now)) + f".{int(now * 1000) % 1000:03d}"
+        path = os.path.join(
+            self.directory, f"{stamp}_{os.getpid()}_{method}_{_slug(route)}_{seconds * 1e3:.3f}ms.prof"
+        )
+        session.stats().dump_stats(path)
+        self.recent.append({
+            "file": path, "method": method, "route": route, "status": status,
+            "duration_ms": round(seconds * 1e3, 3),
+        })
+        while len(self.recent) > self.keep:
+            try:
+                os.remove(self.recent.popleft()["file"])
+            except FileNotFoundError:
+                pass
+        return path
+
+    def settings(self) -> Dict[str, Any]:
+        return {
+            "directory": self.directory, "sample_rate": self.sample_rate, "header": self.header,
+            "profiled": self.profiled, "skipped": self.skipped,
+        }
+
+    def top(self, limit: int, functions: int, sort: str) -> List[Dict[str, Any]]:
+        """
+        The `functions` most expensive functions of each of the last `limit` profiles, newest first.
+        Reads the dumps back from disk, so it belongs in a worker thread; deleted dumps are left out.
+        """
+        key = SORT_KEYS[sort]
+        profiles: List[Dict[str, Any]] = []
+        for entry in reversed(list(self.recent)[-limit:] if limit else []):
+            try:
+                stats = pstats.Stats(entry["file"]).stats  # type: ignore[attr-defined]
+            except FileNotFoundError:
+                continue
+            ranked = sorted(stats.items(), key=lambda item: item[1][key], reverse=True)[:functions]
+            profiles.append({**entry, "top": [
+                {"function": pstats.func_std_string(func), "calls": calls, "primitive_calls": primitive,
+                 "tottime": own, "cumtime": cumulative}
+                for func, (primitive, calls, own, cumulative, _) in ranked
+            ]})
+        return profiles
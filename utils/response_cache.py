@@ -0,0 +1,154 @@
+# Cache of encoded responses, invalidated by tag when the data behind them changes
+
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Iterable, NamedTuple, Optional, Set, Tuple
+
+from abstract_classes.storage_base import StorageBase
+
+RESPONSE_CACHE_BYTES = int(os.environ.get("FACTWISE_RESPONSE_CACHE_BYTES", str(64 * 1024 * 1024)))
+# tags whose last invalidation is remembered, for fills racing a write; see put()
+INVALIDATED_TAGS = 10000
+
+
+class CachedResponse(NamedTuple):
+    body: bytes
+    # headers the handler set besides the ETag, e.g. X-Next-Cursor
+    headers: Dict[str, str]
+
+
+class ResponseCache:
+    """
+    Maps a request key to the encoded response body, least recently used first, bounded to `max_bytes`.
+    Each entry carries the tags of the data it was built from, e.g. "team:<id>" or "user_teams:<user_id>";
+    managers call invalidate() with the tags a write touches and exactly those entries are dropped.
+
+    Collection names double as tags. sync() compares a collection's storage version with the last one
+    this process accounted for (seen()), so a write made by another process drops every entry built on that collection.
+    Managers sync() before each write and seen() after it, so the version they record covers their own write only.
+    """
+    def __init__(self, max_bytes: Optional[int] = None) -> None:
+        self.max_bytes = RESPONSE_CACHE_BYTES if max_bytes is None else max_bytes
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Tuple[CachedResponse, Tuple[str, ...]]]" = OrderedDict()
+        self._by_tag: Dict[str, Set[str]] = {}
+        self._bytes = 0
+        # invalidate() calls so far, and the last one that hit each tag, so fills racing a write are dropped
+        self._seq = 0
+        self._invalidated_at: Dict[str, int] = {}
+        # _invalidated_at was last cleared at this seq: fills started before it may have missed a write
+        self._forgotten = 0
+        self._versions: Dict[str, str] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def token(self) -> int:
+        # take before building a response, hand to put()
+        with self._lock:
+            return self._seq
+
+    def put(self, key: str, response: CachedResponse, tags: Iterable[str], token: int) -> None:
+        tags = tuple(set(tags))
+        with self._lock:
+            # the data changed while the response was being built
+            if token < self._forgotten or any(self._invalidated_at.get(tag, -1) > token for tag in tags):
+                return
+            if len(response.body) > self.max_bytes:
+                return
+            self._remove(key)
+            self._entries[key] = (response, tags)
+            self._bytes += len(response.body)
+            for tag in tags:
+                self._by_tag.setdefault(tag, set()).add(key)
+            while self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, *tags: str) -> None:
+        with self._lock:
+            self._seq += 1
+            for tag in tags:
+                self._invalidated_at[tag] = self._seq
+                for key in list(self._by_tag.get(tag, ())):
+                    self._remove(key)
+                    self.invalidations += 1
+            # one tag per record ever written otherwise; clearing only costs the fills in flight right now
+            if len(self._invalidated_at) > INVALIDATED_TAGS:
+                self._invalidated_at.clear()
+                self._forgotten = self._seq
+
+    def seen(self, **versions: str) -> None:
+        # the collections are at these versions because of writes this process has already invalidated for
+        with self._lock:
+            self._versions.update(versions)
+
+    def sync(self, collection: str, version: str) -> None:
+        with self._lock:
+            known = self._versions.get(collection)
+            self._versions[collection] = version
+        if known is not None and known != version:
+            self.invalidate(collection)
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self._bytes -= len(entry[0].body)
+        for tag in entry[1]:
+            keys = self._by_tag.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_tag[tag]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+
+class CachedCollections:
+    """
+    Mixin for the managers sharing a ResponseCache.
+    `_collections` maps the name of every collection the manager reads to its storage,
+    `_written` names the one its writes are accounted to, e.g. "users".
+    """
+    cache: ResponseCache
+    _collections: Dict[str, StorageBase]
+    _written: str
+
+    # called before a write: drops what other processes changed since, so the version _invalidate()
+    # accounts for afterwards covers only this write (bar one racing in between the two)
+    def _sync(self) -> None:
+        self.cache.sync(self._written, self._collections[self._written].version())
+
+    # drop the cached responses built on what a write changed; the new storage version is then accounted for
+    def _invalidate(self, *tags: str) -> None:
+        self.cache.invalidate(*tags)
+        self.cache.seen(**{self._written: self._collections[self._written].version()})
+
+    # reads can run on the event loop only while every collection is cached
+    def in_memory(self) -> bool:
+        return all(db.in_memory() for db in self._collections.values())
@@ -0,0 +1,232 @@
+# SQLite storage backend, one table per collection
+
+import json
+import os
+import re
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Dict, Any, Iterator, List, Optional, Sequence, Tuple
+
+from abstract_classes.storage_base import StorageBase
+from utils.metrics import timed_storage
+
+_IDENTIFIER = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+
+def _check_identifier(name: str) -> str:
+    # table and field names end up inside SQL text
+    if not _IDENTIFIER.match(name):
+        raise ValueError(f"Invalid storage identifier: {name}")
+    return name
+
+
+@timed_storage
+class SqliteDB(StorageBase):
+    """
+    Records are stored as JSON text; each index is an expression index over json_extract(),
+    so equality lookups in find() on indexed fields never scan the table.
+    A list field declared as "users[]" gets a side table of (element, id) rows instead.
+    The collection path keeps the JSON layout: db/users.json -> table `users` in db/storage.sqlite3
+    """
+    def __init__(self, path: str, indexes: Sequence[Tuple[str, ...]] = ()) -> None:
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        self.db_path = os.path.join(directory, "storage.sqlite3")
+        self.table = _check_identifier(os.path.splitext(os.path.basename(path))[0])
+        # one connection per thread, all tracked so close() can release them
+        self._local = threading.local()
+        self._conns: List[sqlite3.Connection] = []
+        self._conns_lock = threading.Lock()
+        self.list_fields = [
+            _check_identifier(f[:-2]) for fields in indexes for f in fields if f.endswith("[]")
+        ]
+
+        conn = self._conn()
+        conn.execute(
+            f'CREATE TABLE IF NOT EXISTS "{self.table}" (id TEXT PRIMARY KEY, data TEXT NOT NULL)'
+        )
+        # one change counter per collection, bumped in the same transaction as the change
+        conn.execute('CREATE TABLE IF NOT EXISTS "_versions" (name TEXT PRIMARY KEY, version INTEGER NOT NULL)')
+        for field in self.list_fields:
+            side = self._side_table(field)
+            conn.execute(f'CREATE TABLE IF NOT EXISTS "{side}" (value TEXT NOT NULL, id TEXT NOT NULL)')
+            conn.execute(f'DROP INDEX IF EXISTS "{side}__value"')
+            conn.execute(f'CREATE INDEX IF NOT EXISTS "{side}__value__id" ON "{side}" (value, id)')
+            conn.execute(f'CREATE INDEX IF NOT EXISTS "{side}__id" ON "{side}" (id)')
+        for fields in indexes:
+            fields = [f for f in fields if not f.endswith("[]")]
+            if not fields:
+                continue
+            name = "__".join([self.table] + [_check_identifier(f) for f in fields])
+            columns = ", ".join(self._field(f) for f in fields)
+            # id last, so find_page() walks the index in id order; replaces the fields-only index of older databases
+            conn.execute(f'DROP INDEX IF EXISTS "{name}"')
+            conn.execute(f'CREATE INDEX IF NOT EXISTS "{name}__id" ON "{self.table}" ({columns}, id)')
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            with self._conns_lock:
+                self._conns.append(conn)
+        return conn
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            changes = conn.total_changes
+            yield conn
+            # a write that changed no rows (every compare-and-set stale, deleted keys already gone) keeps
+            # the version, and with it the ETags and cached responses built on it
+            if conn.total_changes != changes:
+                conn.execute(
+                    'INSERT INTO "_versions" (name, version) VALUES (?, 1) '
+                    'ON CONFLICT(name) DO UPDATE SET version = version + 1',
+                    (self.table,)
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    @staticmethod
+    def _field(field: str) -> str:
+        # must match the index expression exactly for SQLite to use the index
+        return f"json_extract(data, '$.{_check_identifier(field)}')"
+
+    def _side_table(self, field: str) -> str:
+        return f"{self.table}__{field}"
+
+    def _condition(self, field: str) -> str:
+        if field in self.list_fields:
+            return f'id IN (SELECT id FROM "{self._side_table(field)}" WHERE value = ?)'
+        return f"{self._field(field)} = ?"
+
+    def _index_lists(self, conn: sqlite3.Connection, key: str, record: Dict[str, Any]) -> None:
+        for field in self.list_fields:
+            side = self._side_table(field)
+            conn.execute(f'DELETE FROM "{side}" WHERE id = ?', (key,))
+            conn.executemany(
+                f'INSERT INTO "{side}" (value, id) VALUES (?, ?)',
+                [(value, key) for value in set(record.get(field) or [])]
+            )
+
+    def read(self) -> Dict[str, Any]:
+        rows = self._conn().execute(f'SELECT id, data FROM "{self.table}" ORDER BY rowid')
+        return {key: json.loads(data) for key, data in rows}
+
+    def write(self, data: Dict[str, Any]) -> None:
+        with self._transaction() as conn:
+            conn.execute(f'DELETE FROM "{self.table}"')
+            conn.executemany(
+                f'INSERT INTO "{self.table}" (id, data) VALUES (?, ?)',
+                [(key, json.dumps(record)) for key, record in data.items()]
+            )
+            for field in self.list_fields:
+                side = self._side_table(field)
+                conn.execute(f'DELETE FROM "{side}"')
+                conn.executemany(
+                    f'INSERT INTO "{side}" (value, id) VALUES (?, ?)',
+                    [(value, key) for key, record in data.items() for value in set(record.get(field) or [])]
+                )
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        row = self._conn().execute(f'SELECT data FROM "{self.table}" WHERE id = ?', (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, key: str, record: Dict[str, Any]) -> None:
+        self.put_many({key: record})
+
+    def put_many(self, records: Dict[str, Dict[str, Any]]) -> None:
+        # upsert keeps the rowid, so updated records keep their position in values()
+        with self._transaction() as conn:
+            conn.executemany(
+                f'INSERT INTO "{self.table}" (id, data) VALUES (?, ?) '
+                f'ON CONFLICT(id) DO UPDATE SET data = excluded.data',
+                [(key, json.dumps(record)) for key, record in records.items()]
+            )
+            for key, record in records.items():
+                self._index_lists(conn, key, record)
+
+    def delete_many(self, keys: List[str]) -> None:
+        with self._transaction() as conn:
+            conn.executemany(f'DELETE FROM "{self.table}" WHERE id = ?', [(key,) for key in keys])
+            for field in self.list_fields:
+                conn.executemany(f'DELETE FROM "{self._side_table(field)}" WHERE id = ?', [(key,) for key in keys])
+
+    def compare_and_put(self, records: Dict[str, Dict[str, Any]]) -> List[str]:
+        # BEGIN IMMEDIATE takes the database write lock, so the version check holds across processes
+        stale = []
+        with self._transaction() as conn:
+            for key, record in records.items():
+                version = record.get("version", 0)
+                stored = dict(record, version=version + 1)
+                cursor = conn.execute(
+                    f'UPDATE "{self.table}" SET data = ? '
+                    f"WHERE id = ? AND COALESCE(json_extract(data, '$.version'), 0) = ?",
+                    (json.dumps(stored), key, version)
+                )
+                if cursor.rowcount == 0:
+                    stale.append(key)
+                    continue
+                record["version"] = version + 1
+                self._index_lists(conn, key, record)
+        return stale
+
+    def values(self) -> List[Dict[str, Any]]:
+        rows = self._conn().execute(f'SELECT data FROM "{self.table}" ORDER BY rowid')
+        return [json.loads(data) for (data,) in rows]
+
+    def page(self, after: Optional[str], limit: int) -> List[Dict[str, Any]]:
+        # walks the primary key index from `after`, never touching the skipped rows
+        rows = self._conn().execute(
+            f'SELECT data FROM "{self.table}" WHERE id > ? ORDER BY id LIMIT ?', (after or "", limit)
+        )
+        return [json.loads(data) for (data,) in rows]
+
+    def find(self, **fields: Any) -> List[Dict[str, Any]]:
+        where = " AND ".join(self._condition(f) for f in fields)
+        rows = self._conn().execute(
+            f'SELECT data FROM "{self.table}" WHERE {where} ORDER BY rowid', tuple(fields.values())
+        )
+        return [json.loads(data) for (data,) in rows]
+
+    def find_page(self, after: Optional[str], limit: int, **fields: Any) -> List[Dict[str, Any]]:
+        where = " AND ".join(["id > ?"] + [self._condition(f) for f in fields])
+        rows = self._conn().execute(
+            f'SELECT data FROM "{self.table}" WHERE {where} ORDER BY id LIMIT ?',
+            (after or "", *fields.values(), limit)
+        )
+        return [json.loads(data) for (data,) in rows]
+
+    def count(self, **fields: Any) -> int:
+        # walks the matching index range: O(bucket size), not O(1) like FileDB's buckets; see stats_dict()
+        where = " AND ".join(self._condition(f) for f in fields) or "1"
+        row = self._conn().execute(
+            f'SELECT COUNT(*) FROM "{self.table}" WHERE {where}', tuple(fields.values())
+        ).fetchone()
+        return row[0]
+
+    def __contains__(self, key: str) -> bool:
+        row = self._conn().execute(f'SELECT 1 FROM "{self.table}" WHERE id = ?', (key,)).fetchone()
+        return row is not None
+
+    def version(self) -> str:
+        row = self._conn().execute('SELECT version FROM "_versions" WHERE name = ?', (self.table,)).fetchone()
+        return str(row[0]) if row else "0"
+
+    def close(self) -> None:
+        with self._conns_lock:
+            conns, self._conns = self._conns, []
+        if conns:
+            # fold the WAL back into the database file
+            conns[0].execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        for conn in conns:
+            conn.close()
+        self._local = threading.local()
@@ -0,0 +1,26 @@
+# Picks the storage backend for a collection
+# FACTWISE_STORAGE=sqlite switches every manager to SQLite, the JSON files stay the default
+
+import os
+from typing import Optional, Sequence, Tuple
+
+from abstract_classes.storage_base import StorageBase
+from utils.file_db import FileDB
+from utils.sqlite_db import SqliteDB
+
+STORAGE_BACKEND = os.environ.get("FACTWISE_STORAGE", "json")
+
+# fields each collection is looked up by, "[]" marks a list field indexed by its elements
+USER_INDEXES = [("name",)]
+TEAM_INDEXES = [("name",), ("users[]",)]
+BOARD_INDEXES = [("team_id", "name"), ("team_id", "status")]
+TASK_INDEXES = [("board_id", "title"), ("board_id",), ("board_id", "status"), ("user_id",), ("user_id", "status"), ("status",)]
+
+
+def open_storage(path: str, indexes: Sequence[Tuple[str, ...]] = (), backend: Optional[str] = None) -> StorageBase:
+    backend = backend or STORAGE_BACKEND
+    if backend == "json":
+        return FileDB(path, indexes=indexes)
+    if backend == "sqlite":
+        return SqliteDB(path, indexes)
+    raise ValueError(f"Unknown storage backend: {backend}")